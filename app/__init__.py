@@ -33,6 +33,7 @@ def create_app():
     # Register Flask extensions and routing
     register_extensions(server)
     register_blueprints(server)
+    register_commands(server)
 
     # Register Jinja filters
     server.jinja_env.filters['datetime_humanize'] = jinja_filters.datetime_humanize
@@ -42,6 +43,10 @@ def create_app():
     server.jinja_env.filters['serialize'] = jinja_filters.serialize
     server.jinja_env.filters['user_is_dept_admin'] = jinja_filters.user_is_dept_admin
 
+    # Warm up connections, templates and caches, `/ready` reports the instance ready when done
+    from app.extensions import readiness
+    readiness.start()
+
     return server
 
 
@@ -57,9 +62,31 @@ def register_extensions(server):
     """
     from app.extensions import cas
     from app.extensions import dynamo
+    from app.extensions import pubsub
+    from app.extensions import event_store
+    from app.extensions import limits
+    from app.extensions import archive
+    from app.extensions import access_log
+    from app.extensions import fragment_cache
+    from app.extensions import shared_cache
+    from app.extensions import assets
+    from app.extensions import compress
+    from app.extensions import readiness
+    from app.extensions import profiler
 
     cas.init_app(server)
     dynamo.init_app(server)
+    pubsub.init_app(server)
+    event_store.init_app(server)
+    limits.init_app(server)
+    archive.init_app(server)
+    access_log.init_app(server)
+    fragment_cache.init_app(server)
+    shared_cache.init_app(server)
+    assets.init_app(server)
+    compress.init_app(server)
+    readiness.init_app(server)
+    profiler.init_app(server)
 
 
 def register_blueprints(server):
@@ -83,3 +110,27 @@ def register_blueprints(server):
     server.register_blueprint(admin.bp)
     server.register_blueprint(dept_admin.bp)
     server.register_blueprint(sample.bp)
+
+
+def register_commands(server):
+    """
+    Registers Flask CLI commands to the Flask server.
+
+    Args:
+        server (Flask object)
+
+    Returns:
+        None
+    """
+    from app import commands
+
+    server.cli.add_command(commands.migrate_event_keys)
+    server.cli.add_command(commands.reshard_events)
+    server.cli.add_command(commands.move_long_blocks)
+    server.cli.add_command(commands.archive_events)
+    server.cli.add_command(commands.rollup_access_logs)
+    server.cli.add_command(commands.access_stats)
+    server.cli.add_command(commands.build_assets_command)
+    server.cli.add_command(commands.sort_resources)
+    server.cli.add_command(commands.put_resource_command)
+    server.cli.add_command(commands.rebuild_quotas)
@@ -0,0 +1,251 @@
+"""
+Archive of past events
+
+`flask archive-events` moves events that started more than ARCHIVE_DAYS ago out of the scheduling
+table into compressed columnar files, partitioned by department and month of the start time:
+
+    {dept}/{YYYY}/{MM}/{first startEpoch}-{last startEpoch}-{id}.cols
+
+File format: each attribute is stored as a separately zlib-compressed JSON array, rows sorted by
+`startEpoch`, followed by a JSON footer with the offset and length of every column block. Reads
+memory-map the file and only decompress the columns they need: `startEpoch` first to bisect the
+requested range, then the columns of the other predicates, and the remaining columns only if any
+row is left. Files outside the range are skipped by their name without being opened.
+
+Files are kept in a local directory (ARCHIVE_PATH), or in an S3 bucket (ARCHIVE_S3_BUCKET) with a
+local download cache (ARCHIVE_CACHE_DIR).
+"""
+
+# Standard library imports
+import os
+import json
+import mmap
+import uuid
+import zlib
+import struct
+import tempfile
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+
+# Third party imports
+import arrow
+
+# Local application imports
+from app.utils.scheduler import decimal_conversion
+
+
+MAGIC = b'COLS1'
+FOOTER_LENGTH = struct.Struct('<Q')
+
+
+def write_columns(path, items):
+    """Writes `items` (dicts) sorted by `startEpoch` as a columnar file"""
+    items = sorted(items, key=lambda item: item['startEpoch'])
+    columns = sorted(set().union(*items))
+
+    index = {}
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        for name in columns:
+            values = [item.get(name) for item in items]
+            block = zlib.compress(json.dumps(values, default=decimal_conversion).encode())
+            index[name] = (f.tell(), len(block))
+            f.write(block)
+
+        footer = json.dumps({'rows': len(items), 'columns': index}).encode()
+        f.write(footer)
+        f.write(FOOTER_LENGTH.pack(len(footer)))
+        f.write(MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_columns(path, lower, upper, **equals):
+    """
+    Returns the rows of a columnar file with `lower` <= startEpoch <= `upper` whose attributes
+    equal the values in `equals`.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+        end = len(m) - len(MAGIC)
+        if m[:len(MAGIC)] != MAGIC or m[end:] != MAGIC:
+            raise ValueError(f'{path} is not an archive file')
+
+        footer_length, = FOOTER_LENGTH.unpack(m[end - FOOTER_LENGTH.size:end])
+        footer_start = end - FOOTER_LENGTH.size - footer_length
+        index = json.loads(m[footer_start:footer_start + footer_length].decode())['columns']
+
+        def column(name):
+            offset, length = index[name]
+            return json.loads(zlib.decompress(m[offset:offset + length]).decode())
+
+        starts = column('startEpoch')
+        rows = range(bisect_left(starts, lower), bisect_right(starts, upper))
+
+        for name, value in equals.items():
+            if not rows:
+                break
+            values = column(name) if name in index else [None] * len(starts)
+            rows = [i for i in rows if values[i] == value]
+
+        if not rows:
+            return []
+
+        items = [{} for _ in rows]
+        for name in index:
+            values = starts if name == 'startEpoch' else column(name)
+            for item, i in zip(items, rows):
+                if values[i] is not None:
+                    item[name] = values[i]
+
+        return items
+
+
+class LocalStorage(object):
+    """Archive files in a local directory"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def staging_dir(self, key):
+        """Directory for the file of `key` while it is written: its own, so that `put` is a rename"""
+        directory = os.path.dirname(os.path.join(self.root, key))
+        os.makedirs(directory, exist_ok=True)
+        return directory
+
+    def put(self, key, path):
+        target = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(path, target)
+
+    def list(self, prefix):
+        keys = []
+        for directory, _, files in os.walk(os.path.join(self.root, prefix)):
+            # Files being written are hidden until they are put
+            keys.extend(os.path.relpath(os.path.join(directory, name), self.root)
+                        for name in files if not name.startswith('.'))
+        return keys
+
+    def depts(self):
+        return os.listdir(self.root) if os.path.isdir(self.root) else []
+
+    def path(self, key):
+        return os.path.join(self.root, key)
+
+
+class S3Storage(object):
+    """Archive files in an S3 bucket, downloaded once to a local cache directory for reading"""
+
+    def __init__(self, client, bucket, cache_dir):
+        self.client = client
+        self.bucket = bucket
+        self.cache_dir = cache_dir
+
+    def staging_dir(self, key):
+        return None  # The temp directory, files are uploaded from it
+
+    def put(self, key, path):
+        self.client.upload_file(path, self.bucket, key)
+        os.remove(path)
+
+    def list(self, prefix, delimiter=None):
+        kwargs = {'Bucket': self.bucket, 'Prefix': prefix}
+        if delimiter:
+            kwargs['Delimiter'] = delimiter
+
+        keys = []
+        for page in self.client.get_paginator('list_objects_v2').paginate(**kwargs):
+            keys.extend(obj['Key'] for obj in page.get('Contents', ()))
+            keys.extend(p['Prefix'] for p in page.get('CommonPrefixes', ()))
+        return keys
+
+    def depts(self):
+        return [prefix.rstrip('/') for prefix in self.list('', delimiter='/')]
+
+    def path(self, key):
+        # Archive files are never modified once written, so a cached copy stays valid
+        target = os.path.join(self.cache_dir, key)
+        if not os.path.exists(target):
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+            os.close(fd)
+            self.client.download_file(self.bucket, key, tmp)
+            os.replace(tmp, target)
+        return target
+
+
+class Archive(object):
+    """Flask extension for writing and reading archived events"""
+
+    def __init__(self, app=None):
+        self.storage = None
+        self.days = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ARCHIVE_DAYS', 365)
+        app.config.setdefault('ARCHIVE_PATH', os.path.join(app.instance_path, 'archive'))
+        app.config.setdefault('ARCHIVE_S3_BUCKET', None)
+        app.config.setdefault('ARCHIVE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'event-archive'))
+        app.config.setdefault('ARCHIVE_FILE_ROWS', 50000)
+
+        self.days = app.config['ARCHIVE_DAYS']
+        if app.config['ARCHIVE_S3_BUCKET']:
+            self.storage = S3Storage(app.config['DYNAMO_SESSION'].client('s3'),
+                                     app.config['ARCHIVE_S3_BUCKET'],
+                                     app.config['ARCHIVE_CACHE_DIR'])
+        else:
+            self.storage = LocalStorage(app.config['ARCHIVE_PATH'])
+
+    def cutoff(self):
+        """Epoch before which events are archived"""
+        return int(arrow.utcnow().shift(days=-self.days).float_timestamp)
+
+    def write(self, dept, items, file_rows=50000):
+        """
+        Writes the department's `items` to one file per month (split every `file_rows` rows).
+        Returns once every file is stored, so the items can then be deleted from the table.
+        """
+        def month(item):
+            return arrow.get(int(item['startEpoch'])).format('YYYY/MM')
+
+        items = sorted(items, key=lambda item: item['startEpoch'])
+        for partition, group in groupby(items, key=month):
+            group = list(group)
+            for i in range(0, len(group), file_rows):
+                rows = group[i:i + file_rows]
+                name = f'{int(rows[0]["startEpoch"])}-{int(rows[-1]["startEpoch"])}-{uuid.uuid4().hex[:8]}.cols'
+
+                key = f'{dept}/{partition}/{name}'
+                fd, tmp = tempfile.mkstemp(prefix='.', suffix='.cols', dir=self.storage.staging_dir(key))
+                os.close(fd)
+                try:
+                    write_columns(tmp, rows)
+                    self.storage.put(key, tmp)
+                finally:
+                    if os.path.exists(tmp):
+                        os.remove(tmp)
+
+    def query(self, lower, upper, dept=None, **equals):
+        """
+        Returns archived events starting between the epochs `lower` and `upper`, ordered by `startEpoch`.
+
+        Args:
+            lower, upper (int): Epoch range of `startEpoch`, inclusive
+            dept (str, optional): Department, all departments if None
+            **equals: Attributes that must have the given values, e.g. uni='abc123' or active=True
+        """
+        depts = [dept] if dept is not None else self.storage.depts()
+
+        events = {}
+        for dept in depts:
+            for key in self.storage.list(f'{dept}/'):
+                first, last, _ = os.path.basename(key).split('-', 2)
+                if int(last) < lower or int(first) > upper:
+                    continue
+
+                for item in read_columns(self.storage.path(key), lower, upper, **equals):
+                    # The same event is in two files if an archive run was interrupted before deleting it
+                    events.setdefault(item['SK'], item)
+
+        return sorted(events.values(), key=lambda item: item['startEpoch'])
@@ -0,0 +1,143 @@
+"""
+Static asset pipeline
+
+`flask build-assets` copies every file of the static folder to static/dist under a name containing a
+hash of its content (calendar.js -> calendar.3f2a9c1e.js), minified if it is JavaScript and the `rjsmin`
+package is installed, with gzip and, if the `brotli` package is installed, brotli variants next to it.
+A manifest maps the original names to the hashed ones.
+
+When the manifest exists, `url_for('static', filename='calendar.js')` returns the hashed name, and hashed
+files are served with the best precompressed variant the browser accepts and a one-year immutable
+Cache-Control header: a new build changes the names, so browsers never need to revalidate them.
+Without a manifest (e.g. in development) static files are served as usual.
+"""
+
+# Standard library imports
+import os
+import gzip
+import json
+import shutil
+import hashlib
+import mimetypes
+
+# Third party imports
+from flask import current_app, request, send_from_directory
+
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Content-Encoding values in order of preference, with the file suffix of their precompressed variant
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def minify(name, data):
+    """Minified JavaScript if `rjsmin` is installed, otherwise the content unchanged"""
+    if not name.endswith('.js'):
+        return data
+
+    try:
+        import rjsmin
+    except ImportError:
+        return data
+
+    return rjsmin.jsmin(data.decode()).encode()
+
+
+def build_assets(static_folder):
+    """
+    Builds static/dist from the files of the static folder.
+
+    Returns:
+        The manifest: dict of original name -> hashed name
+    """
+    dist = os.path.join(static_folder, DIST)
+    shutil.rmtree(dist, ignore_errors=True)
+    os.makedirs(dist)
+
+    try:
+        import brotli
+    except ImportError:
+        brotli = None
+
+    manifest = {}
+    for directory, dirs, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            dirs[:] = [d for d in dirs if d != DIST]
+
+        for filename in files:
+            source = os.path.join(directory, filename)
+            name = os.path.relpath(source, static_folder).replace(os.sep, '/')
+
+            with open(source, 'rb') as f:
+                data = minify(name, f.read())
+
+            root, ext = os.path.splitext(name)
+            hashed = f'{root}.{hashlib.sha256(data).hexdigest()[:8]}{ext}'
+            target = os.path.join(dist, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+
+            with open(target, 'wb') as f:
+                f.write(data)
+            with gzip.open(target + '.gz', 'wb', compresslevel=9) as f:
+                f.write(data)
+            if brotli is not None:
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+
+            manifest[name] = hashed
+
+    with open(os.path.join(dist, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+class Assets(object):
+    """Flask extension that rewrites static URLs to the built assets and serves them"""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.hashed = set()
+        self.dist = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.dist = os.path.join(app.static_folder, DIST)
+
+        manifest_path = os.path.join(self.dist, MANIFEST)
+        if not os.path.exists(manifest_path):
+            return
+
+        with open(manifest_path) as f:
+            self.manifest = json.load(f)
+        self.hashed = set(self.manifest.values())
+
+        app.url_defaults(self.hashed_url)
+        app.view_functions['static'] = self.send_static
+
+    def hashed_url(self, endpoint, values):
+        if endpoint == 'static' and values.get('filename') in self.manifest:
+            values['filename'] = f'{DIST}/{self.manifest[values["filename"]]}'
+
+    def send_static(self, filename):
+        name = filename[len(DIST) + 1:] if filename.startswith(f'{DIST}/') else None
+        if name not in self.hashed:
+            return current_app.send_static_file(filename)
+
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+        for encoding, suffix in ENCODINGS:
+            if request.accept_encodings[encoding] and os.path.exists(os.path.join(self.dist, name + suffix)):
+                response = send_from_directory(self.dist, name + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.dist, name, mimetype=mimetype)
+
+        response.headers['Cache-Control'] = IMMUTABLE
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
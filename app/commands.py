@@ -0,0 +1,456 @@
+"""
+Flask CLI commands for table maintenance.
+
+Run with `flask <command>` (FLASK_APP=application.py).
+"""
+
+# Standard library imports
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports
+import arrow
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from boto3.dynamodb.conditions import Attr, Key
+
+# Local application imports
+from app.assets import build_assets
+from app.extensions import archive, dynamo
+from app.utils.access_logs import compact_access_logs, query_access_counts, query_access_users
+from app.utils.resources import put_resource, resource_sort_key
+from app.utils.events import (bump_dept_version,
+                              event_epochs,
+                              event_dept,
+                              event_partition,
+                              history_key,
+                              is_long_block,
+                              long_blocks_PK,
+                              query_events)
+from app.utils.quotas import rebuild_counters
+from app.utils.scheduler import datetime_to_epoch
+
+
+def migrate_segment(table, segment, total_segments):
+    """
+    Sets the epoch attributes (and `history` for events) on EVENT/BLOCK items of one scan segment
+    that do not have them yet. Each update is conditioned on `start` and `end` being unchanged,
+    so an item modified by the application in the meantime (which writes the attributes itself) is skipped.
+    Items without `start` or `end` (e.g. recurring blocks made by hand) cannot have epochs and are left as they are.
+
+    Returns:
+        Tuple of (updated, skipped) item counts and the keys of the items without `start` or `end`
+    """
+    is_event_or_block = Attr('PK').begins_with('EVENT') | Attr('PK').begins_with('BLOCK')
+    scan_kwargs = {
+        'FilterExpression': is_event_or_block & Attr('startEpoch').not_exists(),
+        'Segment': segment,
+        'TotalSegments': total_segments,
+    }
+    client_errors = dynamo.connection.meta.client.exceptions
+
+    updated = 0
+    skipped = 0
+    undated = []
+    while True:
+        response = table.scan(**scan_kwargs)
+
+        for item in response['Items']:
+            if 'start' not in item or 'end' not in item:
+                undated.append(f"{item['PK']} {item['SK']}")
+                continue
+
+            epochs = event_epochs(item['start'], item['end'])
+            expr = 'SET startEpoch = :se, endEpoch = :ee'
+            vals = {
+                ':se': epochs['startEpoch'],
+                ':ee': epochs['endEpoch'],
+                ':s': item['start'],
+                ':e': item['end'],
+            }
+
+            if item['PK'].startswith('EVENT'):
+                timestamp = item['start'] if item['active'] else (item.get('changedOn') or item['start'])
+                expr = f'{expr}, history = :h'
+                vals[':h'] = history_key(item['active'], event_dept(item['PK']), timestamp)
+
+            try:
+                table.update_item(
+                    Key={'PK': item['PK'], 'SK': item['SK']},
+                    UpdateExpression=expr,
+                    ConditionExpression='#s = :s AND #e = :e',
+                    ExpressionAttributeValues=vals,
+                    ExpressionAttributeNames={
+                        '#s': 'start',
+                        '#e': 'end',
+                    },
+                )
+                updated += 1
+            except client_errors.ConditionalCheckFailedException:
+                skipped += 1
+
+        if 'LastEvaluatedKey' not in response:
+            return updated, skipped, undated
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+@click.command('migrate-event-keys')
+@click.option('--segments', default=4, show_default=True, help='Number of parallel scan segments.')
+@with_appcontext
+def migrate_event_keys(segments):
+    """Backfills `startEpoch`/`endEpoch` and the epoch-based `history` key on existing EVENT/BLOCK items.
+
+    Safe to run while the application is serving traffic and to re-run: only items without
+    `startEpoch` are updated. Items without `start` or `end` are listed instead, `move-long-blocks`
+    moves such blocks where calendars still find them.
+    """
+
+    app = current_app._get_current_object()
+    table = dynamo.tables[app.config['DB_SCHEDULING']]
+
+    def run(segment):
+        with app.app_context():
+            return migrate_segment(table, segment, segments)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = list(executor.map(run, range(segments)))
+
+    undated = [key for r in results for key in r[2]]
+    click.echo(f'Updated {sum(r[0] for r in results)} item(s), '
+               f'skipped {sum(r[1] for r in results)} modified during the migration '
+               f'and {len(undated)} without start or end.')
+    for key in undated:
+        click.echo(f'  {key}')
+
+
+def reshard_segment(table, segment, total_segments):
+    """
+    Moves the events of one scan segment whose PK differs from `event_partition` to their partition.
+    The put and the delete are one transaction, and the delete is conditioned on `changedOn` being
+    unchanged so an event modified in the meantime is left for the next run.
+
+    Returns:
+        Tuple of (moved, skipped) item counts
+    """
+    client = dynamo.connection.meta.client
+    scan_kwargs = {
+        'FilterExpression': Attr('PK').begins_with('EVENT'),
+        'Segment': segment,
+        'TotalSegments': total_segments,
+    }
+
+    moved = 0
+    skipped = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+
+        for item in response['Items']:
+            PK = event_partition(event_dept(item['PK']), item['SK'])
+            if PK == item['PK']:
+                continue
+
+            try:
+                client.transact_write_items(TransactItems=[
+                    {
+                        'Put': {
+                            'TableName': table.name,
+                            'Item': dict(item, PK=PK),
+                            'ConditionExpression': 'attribute_not_exists(PK)',
+                        }
+                    },
+                    {
+                        'Delete': {
+                            'TableName': table.name,
+                            'Key': {'PK': item['PK'], 'SK': item['SK']},
+                            'ConditionExpression': 'changedOn = :c',
+                            'ExpressionAttributeValues': {':c': item['changedOn']},
+                        }
+                    },
+                ])
+                moved += 1
+            except client.exceptions.TransactionCanceledException:
+                skipped += 1
+
+        if 'LastEvaluatedKey' not in response:
+            return moved, skipped
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+@click.command('reshard-events')
+@click.option('--segments', default=4, show_default=True, help='Number of parallel scan segments.')
+@with_appcontext
+def reshard_events(segments):
+    """Moves events to the partitions of the configured EVENT_SHARDS layout.
+
+    Run with EVENT_SHARDS_MIGRATING=1 set on the application, so that it keeps reading the old
+    partitions as well, and unset it once a run reports nothing skipped.
+    """
+
+    app = current_app._get_current_object()
+    table = dynamo.tables[app.config['DB_SCHEDULING']]
+
+    def run(segment):
+        with app.app_context():
+            return reshard_segment(table, segment, segments)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = list(executor.map(run, range(segments)))
+
+    click.echo(f'Moved {sum(r[0] for r in results)} event(s), '
+               f'skipped {sum(r[1] for r in results)} modified during the migration.')
+
+
+@click.command('move-long-blocks')
+@with_appcontext
+def move_long_blocks():
+    """Moves blocks longer than a day, or without epochs, to the BLOCK#{dept}#LONG partitions.
+
+    Calendars only look a day back for the blocks of BLOCK#{dept}, see `app.utils.events.query_blocks`.
+    Run after `migrate-event-keys` and before deploying a version that reads the LONG partitions;
+    safe to re-run.
+    """
+
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+    client = dynamo.connection.meta.client
+    scan_kwargs = {'FilterExpression': Attr('PK').begins_with('BLOCK#')}
+
+    moved = defaultdict(int)
+    while True:
+        response = table.scan(**scan_kwargs)
+
+        for item in response['Items']:
+            dept = event_dept(item['PK'])
+            if item['PK'] == long_blocks_PK(dept) or not is_long_block(item):
+                continue
+
+            client.transact_write_items(TransactItems=[
+                {
+                    'Put': {
+                        'TableName': table.name,
+                        'Item': dict(item, PK=long_blocks_PK(dept)),
+                        'ConditionExpression': 'attribute_not_exists(PK)',
+                    }
+                },
+                {
+                    'Delete': {
+                        'TableName': table.name,
+                        'Key': {'PK': item['PK'], 'SK': item['SK']},
+                        'ConditionExpression': 'attribute_exists(PK)',
+                    }
+                },
+            ])
+            moved[dept] += 1
+
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # Calendars and event stores pick up the moved blocks
+    for dept in moved:
+        bump_dept_version(dept)
+
+    click.echo(f'Moved {sum(moved.values())} block(s) of {len(moved)} department(s).')
+
+
+def archive_segment(table, segment, total_segments, cutoff, file_rows):
+    """
+    Archives the events of one scan segment that started before `cutoff`. Buffered events are written
+    to archive files every `file_rows` events and only deleted from the table once their files are stored.
+
+    Returns:
+        Number of archived events
+    """
+    scan_kwargs = {
+        'FilterExpression': Attr('PK').begins_with('EVENT') & Attr('startEpoch').lt(cutoff),
+        'Segment': segment,
+        'TotalSegments': total_segments,
+    }
+
+    def flush(buffered):
+        for dept, items in buffered.items():
+            archive.write(dept, items, file_rows)
+
+        # BatchWriteItem in chunks of 25, unprocessed items are retried by the batch writer
+        with table.batch_writer() as batch:
+            for items in buffered.values():
+                for item in items:
+                    batch.delete_item(Key={'PK': item['PK'], 'SK': item['SK']})
+
+        # Pages that list the department's events are rendered again
+        for dept in buffered:
+            bump_dept_version(dept)
+
+        return sum(len(items) for items in buffered.values())
+
+    archived = 0
+    buffered = defaultdict(list)
+    while True:
+        response = table.scan(**scan_kwargs)
+
+        for item in response['Items']:
+            buffered[event_dept(item['PK'])].append(item)
+
+        if sum(len(items) for items in buffered.values()) >= file_rows:
+            archived += flush(buffered)
+            buffered = defaultdict(list)
+
+        if 'LastEvaluatedKey' not in response:
+            return archived + flush(buffered)
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+@click.command('archive-events')
+@click.option('--segments', default=4, show_default=True, help='Number of parallel scan segments.')
+@click.option('--days', type=int, default=None, help='Archive events that started more than this many days ago '
+                                                     '[default: ARCHIVE_DAYS].')
+@with_appcontext
+def archive_events(segments, days):
+    """Moves past events from the scheduling table to the archive (see `app.archive`).
+
+    Meant to be scheduled, e.g. nightly with cron. Safe to re-run after an interruption:
+    events whose files were stored but that were not deleted yet are read only once.
+    """
+
+    app = current_app._get_current_object()
+    table = dynamo.tables[app.config['DB_SCHEDULING']]
+    if days is not None:
+        archive.days = days
+    cutoff = archive.cutoff()
+
+    def run(segment):
+        with app.app_context():
+            return archive_segment(table, segment, segments, cutoff, app.config['ARCHIVE_FILE_ROWS'])
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = list(executor.map(run, range(segments)))
+
+    click.echo(f'Archived {sum(results)} event(s) that started before {arrow.get(cutoff).isoformat()}.')
+
+
+@click.command('rollup-access-logs')
+@click.option('--segments', default=4, show_default=True, help='Number of parallel scan segments.')
+@with_appcontext
+def rollup_access_logs(segments):
+    """Compacts new access log items into hourly and daily rollups (see `app.utils.access_logs`).
+
+    Meant to be scheduled, e.g. hourly with cron.
+    """
+
+    compacted, until = compact_access_logs(segments)
+    click.echo(f'Compacted {compacted} access log item(s), rollups are complete up to {until or "-"}.')
+
+
+@click.command('access-stats')
+@click.option('--start', required=True, help='ISO8601 start of the time range.')
+@click.option('--end', required=True, help='ISO8601 end of the time range.')
+@click.option('--by', type=click.Choice(['day', 'hour', 'total']), default='day', show_default=True)
+@click.option('--resource', help='Only count requests to this resource (logger name).')
+@click.option('--route', help='Only count requests to this route.')
+@click.option('--success/--failed', default=None, help='Only count successful or failed requests.')
+@click.option('--users', is_flag=True, help='Count requests per user of --resource instead.')
+@with_appcontext
+def access_stats(start, end, by, resource, route, success, users):
+    """Prints access counts between START and END from the rollups."""
+
+    if users:
+        if not resource:
+            raise click.UsageError('--users requires --resource.')
+        for uni, count in query_access_users(start, end, resource):
+            click.echo(f'{uni}\t{count}')
+        return
+
+    filters = {name: value for name, value in (('resource', resource), ('route', route), ('success', success))
+               if value is not None}
+    rows, until = query_access_counts(start, end, None if by == 'total' else by, **filters)
+
+    for row in rows:
+        columns = ('period', 'resource', 'route', 'success', 'error', 'count')
+        click.echo('\t'.join('' if row[name] is None else str(row[name]) for name in columns))
+    click.echo(f'Rollups are complete up to {until or "-"}.', err=True)
+
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Builds fingerprinted, precompressed static files (see `app.assets`).
+
+    Run before starting the application, e.g. as a deployment step.
+    """
+
+    manifest = build_assets(current_app.static_folder)
+    for name, hashed in sorted(manifest.items()):
+        click.echo(f'{name} -> {hashed}')
+
+
+@click.command('sort-resources')
+@with_appcontext
+def sort_resources():
+    """Sets `sortKey` on resources that do not have it or whose room or title changed (see `app.utils.resources`).
+
+    Run after adding or renaming resources other than with `flask put-resource`.
+    """
+
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+    client_errors = dynamo.connection.meta.client.exceptions
+    scan_kwargs = {'FilterExpression': Attr('PK').begins_with('RESOURCE#')}
+
+    updated = 0
+    while True:
+        response = table.scan(**scan_kwargs)
+
+        for item in response['Items']:
+            sort_key = resource_sort_key(item)
+            if item.get('sortKey') == sort_key:
+                continue
+
+            try:
+                table.update_item(
+                    Key={'PK': item['PK'], 'SK': item['SK']},
+                    UpdateExpression='SET sortKey = :k',
+                    ConditionExpression=Attr('room').eq(item.get('room')) & Attr('title').eq(item.get('title')),
+                    ExpressionAttributeValues={':k': sort_key},
+                )
+                updated += 1
+            except client_errors.ConditionalCheckFailedException:
+                click.echo(f'{item["PK"]} {item["SK"]} changed during the update, run again.')
+
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    click.echo(f'Updated the sort key of {updated} resource(s).')
+
+
+@click.command('put-resource')
+@click.argument('dept')
+@click.argument('resource_id')
+@click.argument('room')
+@click.argument('title')
+@with_appcontext
+def put_resource_command(dept, resource_id, room, title):
+    """Adds or renames the resource RESOURCE_ID of DEPT."""
+
+    put_resource(dept, {'id': resource_id, 'room': room, 'title': title})
+    click.echo(f'Saved {room} - {title} ({resource_id}) in {dept}.')
+
+
+@click.command('rebuild-quotas')
+@click.argument('dept')
+@with_appcontext
+def rebuild_quotas(dept):
+    """Recomputes the quota counters of DEPT from its events (see `app.utils.quotas`).
+
+    Run when the department's BOOKING_QUOTAS are first configured, at a quiet time: reservations
+    made while it runs can be counted wrongly.
+    """
+
+    week_start = arrow.now('US/Eastern').floor('week')
+    events = query_events(
+        dept,
+        Key('startEpoch').gte(datetime_to_epoch(week_start)),
+        FilterExpression=Attr('active').eq(True),
+    )
+
+    written = rebuild_counters(dept, events)
+    click.echo(f'Counted {len(events)} event(s) of {dept} in {written} counter(s).')
@@ -0,0 +1,143 @@
+"""
+Response compression
+
+Compresses responses with brotli (if the `brotli` package is installed) or gzip, whichever the request
+accepts, when their mimetype is listed in COMPRESS_MIMETYPES. Bodies smaller than COMPRESS_MIN_SIZE are sent
+as they are. Streamed responses are compressed chunk by chunk, each chunk flushed so that it reaches the
+client without waiting for the next one. Responses that already have a Content-Encoding,
+e.g. precompressed static assets, are left alone.
+
+The level (1-9, used as gzip level and brotli quality) is COMPRESS_LEVEL, or COMPRESS_ROUTE_LEVELS[endpoint].
+
+Bytes before and after compression and the time spent compressing are counted per endpoint
+(see `stats`). Non-streamed responses also report the time in a Server-Timing header.
+"""
+
+# Standard library imports
+import time
+import zlib
+import threading
+from collections import defaultdict
+
+# Third party imports
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def compressor(encoding, level):
+    """
+    Returns:
+        Tuple of functions (compress(data), flush(), finish()) returning compressed bytes
+    """
+    if encoding == 'br':
+        c = brotli.Compressor(quality=level)
+        return c.process, c.flush, c.finish
+
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31: gzip container
+    return c.compress, lambda: c.flush(zlib.Z_SYNC_FLUSH), c.flush
+
+
+class Compress(object):
+    """Flask extension compressing responses in an after_request handler"""
+
+    def __init__(self, app=None):
+        self.counters = defaultdict(lambda: {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'seconds': 0.0})
+        self.lock = threading.Lock()
+        self.config = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json', 'text/html', 'text/css',
+                                                     'text/javascript', 'application/javascript'])
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_ROUTE_LEVELS', {})
+
+        self.config = app.config
+        app.after_request(self.after_request)
+
+    def encoding(self):
+        """Best encoding the request accepts, or None"""
+        if brotli is not None and request.accept_encodings['br']:
+            return 'br'
+        if request.accept_encodings['gzip']:
+            return 'gzip'
+        return None
+
+    def count(self, endpoint, bytes_in, bytes_out, seconds, response=False):
+        with self.lock:
+            counter = self.counters[endpoint]
+            counter['responses'] += response
+            counter['bytes_in'] += bytes_in
+            counter['bytes_out'] += bytes_out
+            counter['seconds'] += seconds
+
+    def stats(self):
+        """Counters per endpoint with the compression ratio (uncompressed / compressed bytes)"""
+        with self.lock:
+            return {
+                endpoint: dict(counter, ratio=round(counter['bytes_in'] / counter['bytes_out'], 2)
+                               if counter['bytes_out'] else None)
+                for endpoint, counter in self.counters.items()
+            }
+
+    def after_request(self, response):
+        successful = 200 <= response.status_code < 300
+        encoded = response.direct_passthrough or 'Content-Encoding' in response.headers
+        if not successful or encoded or response.mimetype not in self.config['COMPRESS_MIMETYPES']:
+            return response
+
+        length = response.content_length
+        if not response.is_streamed and length is not None and length < self.config['COMPRESS_MIN_SIZE']:
+            return response
+
+        response.vary.add('Accept-Encoding')
+
+        encoding = self.encoding()
+        if encoding is None:
+            return response
+
+        endpoint = request.endpoint
+        level = self.config['COMPRESS_ROUTE_LEVELS'].get(endpoint, self.config['COMPRESS_LEVEL'])
+        compress, flush, finish = compressor(encoding, level)
+
+        if response.is_streamed:
+            response.response = self.stream(response.response, endpoint, compress, flush, finish)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            start = time.perf_counter()
+            compressed = compress(data) + finish()
+            seconds = time.perf_counter() - start
+
+            response.set_data(compressed)
+            response.headers['Server-Timing'] = f'compress;dur={seconds * 1000:.2f}'
+            self.count(endpoint, len(data), len(compressed), seconds, response=True)
+
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    def stream(self, chunks, endpoint, compress, flush, finish):
+        """Compresses and flushes each chunk of a streamed response"""
+        self.count(endpoint, 0, 0, 0, response=True)
+
+        try:
+            for chunk in chunks:
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+
+                start = time.perf_counter()
+                compressed = compress(chunk) + flush()
+                self.count(endpoint, len(chunk), len(compressed), time.perf_counter() - start)
+
+                yield compressed
+        finally:
+            if hasattr(chunks, 'close'):
+                chunks.close()
+
+        yield finish()
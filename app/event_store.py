@@ -0,0 +1,344 @@
+"""
+In-memory event store
+
+Keeps the active events and blocked-off times of recently used departments in memory so that
+calendar window queries do not go to DynamoDB. Events are kept sorted by `startEpoch` per resource,
+blocks by `startEpoch`, and a window is answered with bisect range lookups.
+
+The store is kept current by:
+    - write-through: routes that modify events call `apply` after a successful write
+    - a change-feed consumer: a background thread polls each cached department's change version
+      (VERSION#{dept} item) and re-reads only items within the horizon created or changed since its last
+      poll. Changes made by other worker processes reach this one through it; an event that another process
+      moves out of the horizon stays at its old time here until the department is reloaded (EVENT_STORE_TTL).
+      A window of a department whose version moved since the last poll catches up before it is answered.
+
+Memory is bounded by the number of cached departments (least recently used are evicted),
+the number of events and blocks per department and the loaded time horizon. Windows outside the horizon
+return None and are answered by DynamoDB as before.
+"""
+
+# Standard library imports
+import time
+import threading
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict
+
+# Third party imports
+import arrow
+from boto3.dynamodb.conditions import Attr, Key
+
+# Local application imports
+from app.utils.scheduler import datetime_to_EST, datetime_to_epoch
+
+
+class DeptEvents(object):
+    """Events of one department sorted by start time per resource, and its blocks sorted by start time"""
+
+    def __init__(self, lower, upper, version, watermark):
+        self.lower = lower
+        self.upper = upper
+        self.version = version
+        self.watermark = watermark
+        self.loaded_at = time.time()
+        self.keys = {}  # resourceId -> sorted list of (start epoch, SK)
+        self.items = {}  # SK -> event
+        self.block_keys = []  # sorted list of (start epoch, SK)
+        self.blocks = {}  # SK -> block
+        self.long_blocks = {}  # SK -> block of BLOCK#{dept}#LONG, see `app.utils.events.query_blocks`
+
+    def __len__(self):
+        return len(self.items) + len(self.blocks) + len(self.long_blocks)
+
+    def upsert(self, event):
+        self.remove(event['SK'])
+
+        if not event.get('active'):
+            return
+
+        start = event['startEpoch']
+        if not (self.lower <= start <= self.upper):
+            return
+
+        insort(self.keys.setdefault(event['resourceId'], []), (start, event['SK']))
+        self.items[event['SK']] = event
+
+    def remove(self, SK):
+        event = self.items.pop(SK, None)
+        if event is None:
+            return
+
+        keys = self.keys[event['resourceId']]
+        i = bisect_left(keys, (event['startEpoch'], SK))
+        del keys[i]
+
+    def upsert_block(self, block):
+        from app.utils.events import MAX_BLOCK_SECONDS, is_long_block
+
+        self.remove_block(block['SK'])
+
+        if is_long_block(block):
+            self.long_blocks[block['SK']] = block
+            return
+
+        start = block['startEpoch']
+        if not (self.lower - MAX_BLOCK_SECONDS <= start <= self.upper):
+            return
+
+        insort(self.block_keys, (start, block['SK']))
+        self.blocks[block['SK']] = block
+
+    def remove_block(self, SK):
+        self.long_blocks.pop(SK, None)
+        block = self.blocks.pop(SK, None)
+        if block is None:
+            return
+
+        i = bisect_left(self.block_keys, (block['startEpoch'], SK))
+        del self.block_keys[i]
+
+    def overlapping_blocks(self, lower, upper):
+        from app.utils.events import MAX_BLOCK_SECONDS, overlaps
+
+        i = bisect_left(self.block_keys, (lower - MAX_BLOCK_SECONDS, ''))
+        j = bisect_right(self.block_keys, (upper, '\uffff'))
+        blocks = (self.blocks[SK] for _, SK in self.block_keys[i:j])
+
+        long_blocks = [block for block in self.long_blocks.values() if overlaps(block, lower, upper)]
+
+        return [block for block in blocks if block['endEpoch'] >= lower] + long_blocks
+
+    def window(self, lower, upper):
+        events = []
+        for keys in self.keys.values():
+            i = bisect_left(keys, (lower, ''))
+            j = bisect_right(keys, (upper, '\uffff'))
+            events.extend(self.items[SK] for _, SK in keys[i:j])
+
+        return events
+
+
+class EventStore(object):
+    """Flask extension holding `DeptEvents` per department"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.depts = OrderedDict()
+        self.oversized = {}  # dept -> time when it was found to have too many events to cache
+        self.lock = threading.RLock()
+        self.poller = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('EVENT_STORE_ENABLED', True)
+        app.config.setdefault('EVENT_STORE_MAX_DEPTS', 50)
+        app.config.setdefault('EVENT_STORE_MAX_EVENTS', 20000)
+        app.config.setdefault('EVENT_STORE_PAST_DAYS', 31)
+        app.config.setdefault('EVENT_STORE_FUTURE_DAYS', 180)
+        app.config.setdefault('EVENT_STORE_POLL_INTERVAL', 10)
+        app.config.setdefault('EVENT_STORE_TTL', 3600)
+        self.app = app
+
+    @property
+    def table(self):
+        from app.extensions import dynamo
+        return dynamo.tables[self.app.config['DB_SCHEDULING']]
+
+    def window(self, dept, start, end):
+        """
+        Returns active events starting between `start` and `end` plus the department's blocked-off times
+        overlapping them, or None if the window cannot be answered from memory. A department whose change
+        version moved since its last poll catches up first, so the window is at least as current as a version
+        read before it (e.g. for an ETag).
+
+        Args:
+            dept (str)
+            start, end (str): ISO8601 timestamps
+        """
+        if not self.app.config['EVENT_STORE_ENABLED']:
+            return None
+
+        self.start_poller()
+
+        lower = datetime_to_epoch(start)
+        upper = datetime_to_epoch(end)
+
+        with self.lock:
+            if time.time() - self.oversized.get(dept, 0) < self.app.config['EVENT_STORE_TTL']:
+                return None
+
+            events = self.depts.get(dept)
+            if events is not None and time.time() - events.loaded_at <= self.app.config['EVENT_STORE_TTL']:
+                self.depts.move_to_end(dept)
+            else:
+                events = None
+
+        # Loaded without holding the lock, so that other departments are answered meanwhile
+        if events is None:
+            events = self.load(dept)
+        else:
+            self.catch_up(dept, events)
+
+        if events is None or not (events.lower <= lower and upper <= events.upper):
+            return None
+
+        with self.lock:
+            # Evicted or reloaded while catching up
+            if self.depts.get(dept) is not events:
+                return None
+
+            return events.window(lower, upper) + events.overlapping_blocks(lower, upper)
+
+    def apply(self, dept, change, event):
+        """
+        Write-through of a change already written to DynamoDB.
+
+        Args:
+            dept (str)
+            change (str): 'create', 'modify' or 'delete'
+            event (dict): Full item for 'create', PK/SK plus changed attributes otherwise. Events and blocks
+                (BLOCK# items) are both accepted
+        """
+        with self.lock:
+            events = self.depts.get(dept)
+            if events is None:
+                return
+
+            if event['PK'].startswith('BLOCK#'):
+                if change == 'create':
+                    events.upsert_block(event)
+                elif change == 'delete':
+                    events.remove_block(event['SK'])
+            elif change == 'create':
+                events.upsert(event)
+            elif change == 'modify' and event['SK'] in events.items:
+                events.upsert(dict(events.items[event['SK']], **event))
+            elif change == 'delete':
+                events.remove(event['SK'])
+
+            if len(events) > self.app.config['EVENT_STORE_MAX_EVENTS']:
+                del self.depts[dept]
+                self.oversized[dept] = time.time()
+
+    def load(self, dept):
+        """
+        Loads the department's events and blocks within the configured horizon, evicting the least recently used
+        department. DynamoDB is queried without holding the lock, the loaded events replace the department's under it.
+        """
+        from app.utils.events import get_dept_version, query_blocks, query_events
+
+        now = arrow.utcnow()
+        lower = now.shift(days=-self.app.config['EVENT_STORE_PAST_DAYS'])
+        upper = now.shift(days=self.app.config['EVENT_STORE_FUTURE_DAYS'])
+
+        version = get_dept_version(dept)
+        items = query_events(
+            dept,
+            Key('startEpoch').between(datetime_to_epoch(lower), datetime_to_epoch(upper)),
+            FilterExpression=Attr('active').eq(True),
+        )
+
+        # Blocks count towards EVENT_STORE_MAX_EVENTS too
+        blocks = []
+        if len(items) <= self.app.config['EVENT_STORE_MAX_EVENTS']:
+            blocks = query_blocks(dept, datetime_to_epoch(lower), datetime_to_epoch(upper))
+
+        events = None
+        if len(items) + len(blocks) <= self.app.config['EVENT_STORE_MAX_EVENTS']:
+            events = DeptEvents(datetime_to_epoch(lower), datetime_to_epoch(upper), version, now)
+            for item in items:
+                events.upsert(item)
+            for block in blocks:
+                events.upsert_block(block)
+
+        with self.lock:
+            self.depts.pop(dept, None)
+            if events is None:
+                self.oversized[dept] = time.time()
+                return None
+
+            self.depts[dept] = events
+            while len(self.depts) > self.app.config['EVENT_STORE_MAX_DEPTS']:
+                self.depts.popitem(last=False)
+
+        return events
+
+    def query_all(self, **kwargs):
+        items = []
+        while True:
+            response = self.table.query(**kwargs)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def poll(self):
+        """Applies changes made since the last poll to every cached department whose version moved"""
+        with self.lock:
+            depts = list(self.depts.items())
+
+        for dept, events in depts:
+            self.catch_up(dept, events)
+
+    def catch_up(self, dept, events):
+        """Applies changes made since the last poll to the department's `events` if its version moved"""
+        from app.utils.events import MAX_BLOCK_SECONDS, START_INDEX, get_dept_version, query_events, query_long_blocks
+
+        version = get_dept_version(dept)
+        if version == events.version:
+            return
+
+        # Margin for clock skew between workers and for UTC offset changes in the ISO strings
+        now = arrow.utcnow()
+        since = datetime_to_EST(events.watermark.shift(hours=-2))
+        changed_since = Attr('changedOn').gte(since) | Attr('createdOn').gte(since)
+        changed = query_events(
+            dept,
+            Key('startEpoch').between(events.lower, events.upper),
+            FilterExpression=changed_since,
+        )
+        blocks_start = Key('startEpoch').between(events.lower - MAX_BLOCK_SECONDS, events.upper)
+        blocks = self.query_all(
+            IndexName=START_INDEX,
+            KeyConditionExpression=Key('PK').eq(f'BLOCK#{dept}') & blocks_start,
+            FilterExpression=changed_since,
+        )
+        # Read whole, so that long blocks removed by hand go too
+        long_blocks = query_long_blocks(dept, events.lower, events.upper)
+
+        with self.lock:
+            if self.depts.get(dept) is not events:
+                return
+            for item in changed:
+                events.upsert(item)
+            for block in blocks:
+                events.upsert_block(block)
+            events.long_blocks = {block['SK']: block for block in long_blocks}
+            events.version = version
+            events.watermark = now
+
+            if len(events) > self.app.config['EVENT_STORE_MAX_EVENTS']:
+                del self.depts[dept]
+                self.oversized[dept] = time.time()
+
+    def start_poller(self):
+        """Starts the change-feed consumer thread once per process"""
+        if self.poller is not None and self.poller.is_alive():
+            return
+
+        app = self.app
+
+        def run():
+            while True:
+                time.sleep(app.config['EVENT_STORE_POLL_INTERVAL'])
+                with app.app_context():
+                    try:
+                        self.poll()
+                    except Exception as e:
+                        app.logger.warning(f'Event store poll failed: {e}')
+
+        with self.lock:
+            if self.poller is None or not self.poller.is_alive():
+                self.poller = threading.Thread(target=run, name='event-store-poller', daemon=True)
+                self.poller.start()
@@ -6,6 +6,30 @@ Flask extensions
 from flask_cas import CAS
 from flask_dynamo import Dynamo
 
+# Local application imports
+from app.pubsub import PubSub
+from app.event_store import EventStore
+from app.limits import Limits
+from app.archive import Archive
+from app.log_sinks import AccessLogSinks
+from app.fragment_cache import FragmentCache
+from app.shared_cache import SharedCache
+from app.assets import Assets
+from app.compression import Compress
+from app.readiness import Readiness
+from app.profiling import Profiler
+
 
 cas = CAS()
 dynamo = Dynamo()
+pubsub = PubSub()
+event_store = EventStore()
+limits = Limits()
+archive = Archive()
+access_log = AccessLogSinks()
+fragment_cache = FragmentCache()
+shared_cache = SharedCache()
+assets = Assets()
+compress = Compress()
+readiness = Readiness()
+profiler = Profiler()
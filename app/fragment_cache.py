@@ -0,0 +1,123 @@
+"""
+Template fragment cache
+
+Adds a `{% cache key, ... %}...{% endcache %}` tag to Jinja. The rendered body is kept in a per-process
+LRU cache under the template, the tag's line and the given key values, so a fragment is rendered
+again only when one of the values changes or its entry expires. Key fragments that show events on
+the department's change version (see `app.utils.events.get_dept_version`), so that any change
+to an event renders them again.
+
+Data used only inside a fragment should be passed as `Deferred`, so that its query only runs when
+the fragment is rendered.
+
+Compiled templates are also kept in a Jinja bytecode cache on the filesystem (JINJA_BYTECODE_CACHE_DIR,
+by default a per-user directory in the temp directory), so worker processes do not compile them again.
+"""
+
+# Standard library imports
+import time
+import threading
+from collections import OrderedDict
+
+# Third party imports
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+
+class Deferred(object):
+    """Value computed by `fn` on first access of `value`"""
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.computed = False
+        self.result = None
+
+    @property
+    def value(self):
+        if not self.computed:
+            self.result = self.fn()
+            self.computed = True
+        return self.result
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja extension implementing the `cache` tag"""
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        fragment = nodes.Const(f'{parser.name}:{lineno}')
+
+        return nodes.CallBlock(self.call_method('_render', [fragment, nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, fragment, args, caller):
+        return Markup(self.environment.fragment_cache.get_or_render((fragment, ) + tuple(args), caller))
+
+
+class FragmentCache(object):
+    """Flask extension holding the rendered fragments, bounded by total size and age"""
+
+    def __init__(self, app=None):
+        self.fragments = OrderedDict()  # key -> (rendered string, time rendered)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.max_bytes = None
+        self.ttl = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', 64 * 1024 * 1024)
+        app.config.setdefault('FRAGMENT_CACHE_TTL', 300)
+        app.config.setdefault('JINJA_BYTECODE_CACHE_DIR', None)
+
+        self.max_bytes = app.config['FRAGMENT_CACHE_MAX_BYTES']
+        self.ttl = app.config['FRAGMENT_CACHE_TTL']
+
+        app.jinja_env.add_extension(FragmentCacheExtension)
+        app.jinja_env.fragment_cache = self
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['JINJA_BYTECODE_CACHE_DIR'])
+
+    def get_or_render(self, key, render):
+        now = time.time()
+
+        with self.lock:
+            cached = self.fragments.get(key)
+            if cached is not None and now - cached[1] < self.ttl:
+                self.fragments.move_to_end(key)
+                return cached[0]
+
+        rendered = str(render())
+
+        with self.lock:
+            previous = self.fragments.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+
+            self.fragments[key] = (rendered, now)
+            self.size += len(rendered)
+
+            while self.size > self.max_bytes and self.fragments:
+                _, (evicted, _) = self.fragments.popitem(last=False)
+                self.size -= len(evicted)
+
+        return rendered
+
+    def discard(self, key):
+        with self.lock:
+            previous = self.fragments.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous[0])
+
+    def clear(self):
+        with self.lock:
+            self.fragments.clear()
+            self.size = 0
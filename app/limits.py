@@ -0,0 +1,132 @@
+"""
+Request coalescing and rate limiting
+
+Protects the scheduling table from bursts of identical calendar reads, e.g. when a whole
+department opens the calendar at the top of the hour:
+
+    - single-flight: concurrent calls with the same key share one execution and its result
+    - token buckets per user (every request) and per department (only reads that reach DynamoDB)
+
+Counters of coalesced, executed and throttled calls are kept per process.
+"""
+
+# Standard library imports
+import time
+import threading
+from collections import Counter
+
+
+class Throttled(Exception):
+    """Raised when a token bucket is empty"""
+
+    def __init__(self, retry_after):
+        super(Throttled, self).__init__(retry_after)
+        self.retry_after = retry_after
+
+
+class TokenBuckets(object):
+    """Token buckets keyed by an arbitrary string, refilled at `rate` tokens per second up to `burst`"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = {}  # key -> (tokens, last refill time)
+        self.lock = threading.Lock()
+
+    def take(self, key):
+        """Takes one token for `key`, raises `Throttled` if there is none"""
+        now = time.monotonic()
+
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                raise Throttled((1 - tokens) / self.rate)
+
+            self.buckets[key] = (tokens - 1, now)
+
+            if len(self.buckets) > self.max_keys:
+                self.prune(now)
+
+    def prune(self, now):
+        """Drops buckets that have refilled completely, they are the same as new ones"""
+        full = [k for k, (tokens, last) in self.buckets.items() if tokens + (now - last) * self.rate >= self.burst]
+        for key in full:
+            del self.buckets[key]
+
+
+class Call(object):
+    """A single-flight execution that other callers can wait for"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Limits(object):
+    """Flask extension with the single-flight group and rate limiters"""
+
+    def __init__(self, app=None):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.counters = Counter()
+        self.users = None
+        self.depts = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('RATE_LIMIT_USER', (5, 20))
+        app.config.setdefault('RATE_LIMIT_DEPT', (20, 50))
+
+        self.users = TokenBuckets(*app.config['RATE_LIMIT_USER'])
+        self.depts = TokenBuckets(*app.config['RATE_LIMIT_DEPT'])
+
+    def take_user(self, uni):
+        try:
+            self.users.take(uni)
+        except Throttled:
+            self.counters['throttled_user'] += 1
+            raise
+
+    def take_dept(self, dept):
+        try:
+            self.depts.take(dept)
+        except Throttled:
+            self.counters['throttled_dept'] += 1
+            raise
+
+    def coalesce(self, key, fn):
+        """
+        Returns `fn()`. Concurrent calls with the same key wait for the first one and share its
+        result (or exception) instead of calling `fn` again.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = Call()
+                self.counters['executed'] += 1
+            else:
+                self.counters['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
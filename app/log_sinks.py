@@ -0,0 +1,166 @@
+"""
+Access log sinks and sampling
+
+`DynamoAccessLogger` hands every access item to the sinks configured in ACCESS_LOG_SINKS
+(comma-separated):
+
+    dynamo: one item per request in the DB_ACCESS_LOGS table (default)
+    file:   JSON lines appended to ACCESS_LOG_FILE in buffered writes, rotated at ACCESS_LOG_FILE_MAX_BYTES
+            with the rotated files gzip-compressed. '{pid}' in the path is replaced by the process id,
+            so that worker processes do not rotate each other's files.
+    stdout: JSON lines on standard output, for containers whose log driver collects it
+
+Successful requests can be sampled per route with ACCESS_LOG_SAMPLE_RATES, a dict from
+'{resource}.{route}' or '{route}' to the fraction of requests to log. Failed requests are always logged.
+Sampled items carry their `sampleRate`, so that rollups can scale the counts back up.
+"""
+
+# Standard library imports
+import os
+import sys
+import gzip
+import json
+import time
+import atexit
+import random
+import shutil
+import threading
+
+
+class DynamoSink(object):
+    """Writes each item to the access log table"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def write(self, item):
+        from app.extensions import dynamo
+        dynamo.tables[self.app.config['DB_ACCESS_LOGS']].put_item(Item=item)
+
+    def flush(self):
+        pass
+
+
+class StreamSink(object):
+    """Writes each item as a JSON line to a stream"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, item):
+        line = json.dumps(item, default=str)
+        with self.lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+    def flush(self):
+        pass
+
+
+class FileSink(object):
+    """Appends JSON lines to a file in buffered writes and rotates it by size"""
+
+    def __init__(self, path, max_bytes, backups, buffer_lines, buffer_seconds):
+        self.path = path.format(pid=os.getpid())
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.buffer_lines = buffer_lines
+        self.buffer_seconds = buffer_seconds
+        self.buffer = []
+        self.buffered_since = None
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        atexit.register(self.flush)
+
+    def write(self, item):
+        line = json.dumps(item, default=str)
+        with self.lock:
+            if not self.buffer:
+                self.buffered_since = time.monotonic()
+            self.buffer.append(line)
+
+            if len(self.buffer) >= self.buffer_lines or time.monotonic() - self.buffered_since >= self.buffer_seconds:
+                self.write_buffer()
+
+    def flush(self):
+        with self.lock:
+            self.write_buffer()
+
+    def write_buffer(self):
+        if not self.buffer:
+            return
+
+        with open(self.path, 'a') as f:
+            f.write('\n'.join(self.buffer) + '\n')
+            size = f.tell()
+        self.buffer = []
+
+        if size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        """Shifts {path}.{n}.gz to {path}.{n + 1}.gz and compresses the current file to {path}.1.gz"""
+        for n in range(self.backups - 1, 0, -1):
+            source = f'{self.path}.{n}.gz'
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{n + 1}.gz')
+
+        with open(self.path, 'rb') as source, gzip.open(f'{self.path}.1.gz', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.remove(self.path)
+
+
+class AccessLogSinks(object):
+    """Flask extension holding the configured access log sinks and sampling rates"""
+
+    def __init__(self, app=None):
+        self.sinks = []
+        self.sample_rates = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ACCESS_LOG_SINKS', 'dynamo')
+        app.config.setdefault('ACCESS_LOG_SAMPLE_RATES', {})
+        app.config.setdefault('ACCESS_LOG_FILE', os.path.join(app.instance_path, 'logs', 'access-{pid}.jsonl'))
+        app.config.setdefault('ACCESS_LOG_FILE_MAX_BYTES', 50 * 1024 * 1024)
+        app.config.setdefault('ACCESS_LOG_FILE_BACKUPS', 10)
+        app.config.setdefault('ACCESS_LOG_FILE_BUFFER_LINES', 100)
+        app.config.setdefault('ACCESS_LOG_FILE_BUFFER_SECONDS', 5)
+
+        self.sample_rates = app.config['ACCESS_LOG_SAMPLE_RATES']
+        self.sinks = []
+        for name in app.config['ACCESS_LOG_SINKS'].split(','):
+            name = name.strip()
+            if name == 'dynamo':
+                self.sinks.append(DynamoSink(app))
+            elif name == 'file':
+                self.sinks.append(FileSink(app.config['ACCESS_LOG_FILE'],
+                                           app.config['ACCESS_LOG_FILE_MAX_BYTES'],
+                                           app.config['ACCESS_LOG_FILE_BACKUPS'],
+                                           app.config['ACCESS_LOG_FILE_BUFFER_LINES'],
+                                           app.config['ACCESS_LOG_FILE_BUFFER_SECONDS']))
+            elif name == 'stdout':
+                self.sinks.append(StreamSink(sys.stdout))
+            elif name:
+                raise ValueError(f'Unknown access log sink: {name}')
+
+    def sample_rate(self, resource, route, success):
+        """Fraction of requests like this one that are logged"""
+        if not success:
+            return 1
+        return self.sample_rates.get(f'{resource}.{route}', self.sample_rates.get(route, 1))
+
+    def write(self, item):
+        for sink in self.sinks:
+            sink.write(item)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    @staticmethod
+    def sampled(rate):
+        return rate >= 1 or random.random() < rate
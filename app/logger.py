@@ -5,6 +5,7 @@ Logger class
 # Standard library imports
 import datetime
 import uuid
+from decimal import Decimal
 
 # Third party imports
 from flask import current_app
@@ -15,13 +16,14 @@ from flask import has_request_context
 # from boto3.dynamodb.conditions import Key, Attr
 
 # Local application imports
-from app.extensions import dynamo
+from app.extensions import access_log
 
 
 class DynamoAccessLogger(object):
     """Access Logger
 
     Handles logging of user access to CAS-protected pages.
+    Items are written to the sinks configured in ACCESS_LOG_SINKS, see `app.log_sinks`.
 
     Args:
         resource (str): Resource which the logger will log access to
@@ -59,7 +61,10 @@ class DynamoAccessLogger(object):
 
         if has_request_context():
 
-            access_table = dynamo.tables[self.access_table_name]
+            rate = access_log.sample_rate(self.resource, kwargs.get('route'), success)
+            if not access_log.sampled(rate):
+                return
+
             timestamp = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S')
 
             # Default payload
@@ -74,12 +79,16 @@ class DynamoAccessLogger(object):
             for key, value in kwargs.items():
                 item[key] = value
 
+            # Lets rollups count this item as 1 / rate requests
+            if rate < 1:
+                item['sampleRate'] = Decimal(str(rate))
+
             if 'CAS_USERNAME' in session:
 
                 item['accessedBy'] = session.get('CAS_USERNAME')
-                access_table.put_item(Item=item)
+                access_log.write(item)
 
             # else:
 
             #     item['accessedBy'] = 'DEBUG'
-            #     access_table.put_item(Item=item)
+            #     access_log.write(item)
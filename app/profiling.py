@@ -0,0 +1,182 @@
+"""
+On-demand request profiling for admins
+
+A request carrying PROFILE_PARAM (by default `_profile`) with a token from `/admin/profile_token` is
+profiled by a sampling profiler: a background thread records the request thread's stack every
+PROFILE_INTERVAL seconds from `before_request` to `after_request`. While the request runs Python code the
+sampler waits for the GIL, so samples are at least `sys.getswitchinterval()` (5ms by default) apart.
+
+The response is replaced by an HTML flame graph (icicle: callers above their callees, widths proportional
+to samples) with the stacks in folded format, which flamegraph.pl and speedscope read.
+
+Reports are also written to PROFILE_DIR (by default `profiles` in the instance folder, shared by the
+worker processes and readable only by their user), keeping the PROFILE_KEEP most recent ones, and listed by `/admin/profiles`.
+
+The token is the admin's uni signed with SERIALIZER and is checked against the logged-in user, who must
+be a global admin; requests without the parameter only pay for one dictionary lookup.
+"""
+
+# Standard library imports
+import os
+import sys
+import time
+import threading
+from collections import Counter
+
+# Third party imports
+import arrow
+from flask import g, render_template, request, session
+from itsdangerous.exc import BadSignature
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Sampler(object):
+    """Counts the stacks of one thread, sampled every `interval` seconds"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()  # tuple of frame names, outermost first -> samples
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='profile-sampler', daemon=True)
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+
+    def stop(self):
+        if self.seconds is None:
+            self.seconds = time.perf_counter() - self.started
+            self.stopped.set()
+            self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame))
+                frame = frame.f_back
+            self.stacks[tuple(reversed(stack))] += 1
+
+    def folded(self):
+        """Stacks in folded format: frames separated by `;`, then the number of samples"""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common())
+
+    def tree(self):
+        """Call tree of the samples: dict with `name`, `samples` and `children` sorted by samples"""
+        root = {'name': 'request', 'samples': 0, 'children': {}}
+        for stack, count in self.stacks.items():
+            node = root
+            node['samples'] += count
+            for name in stack:
+                node = node['children'].setdefault(name, {'name': name, 'samples': 0, 'children': {}})
+                node['samples'] += count
+
+        def ordered(node):
+            children = sorted(node['children'].values(), key=lambda child: -child['samples'])
+            return dict(node, children=[ordered(child) for child in children])
+
+        return ordered(root)
+
+
+class Profiler(object):
+    """Flask extension profiling requests flagged by an admin"""
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PROFILE_ENABLED', True)
+        app.config.setdefault('PROFILE_PARAM', '_profile')
+        app.config.setdefault('PROFILE_INTERVAL', 0.001)
+        app.config.setdefault('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+        app.config.setdefault('PROFILE_KEEP', 50)
+        self.app = app
+
+        if app.config['PROFILE_ENABLED']:
+            app.before_request(self.before_request)
+            app.after_request(self.after_request)
+            app.teardown_request(self.teardown_request)
+
+    def token(self, uni):
+        return self.app.config['SERIALIZER'].dumps(('profile', uni))
+
+    def allowed(self, token):
+        from app.users import User
+
+        try:
+            kind, uni = self.app.config['SERIALIZER'].loads(token)
+        except (BadSignature, TypeError, ValueError):
+            return False
+
+        return kind == 'profile' and uni == session.get('CAS_USERNAME') and User(uni).is_admin()
+
+    def before_request(self):
+        token = request.args.get(self.app.config['PROFILE_PARAM'])
+        if token is None or not self.allowed(token):
+            return
+
+        g.profile_sampler = Sampler(threading.get_ident(), self.app.config['PROFILE_INTERVAL'])
+        g.profile_sampler.start()
+
+    def after_request(self, response):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return response
+
+        sampler.stop()
+        report = render_template(
+            'profile.html',
+            method=request.method,
+            path=request.path,
+            args=[(key, value) for key, value in request.args.items(multi=True)
+                  if key != self.app.config['PROFILE_PARAM']],
+            status=response.status,
+            seconds=sampler.seconds,
+            interval=self.app.config['PROFILE_INTERVAL'],
+            tree=sampler.tree(),
+            folded=sampler.folded(),
+            created=arrow.now('US/Eastern').format('YYYY-MM-DD HH:mm:ss'),
+        )
+        self.save(report)
+
+        return self.app.response_class(report, mimetype='text/html')
+
+    def teardown_request(self, exc=None):
+        # Requests that raised do not reach after_request
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+
+    def save(self, report):
+        directory = self.app.config['PROFILE_DIR']
+        # Reports show request parameters and code paths, so only the app's user may read them
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+
+        name = f'{int(time.time() * 1000)}-{os.getpid()}-{request.endpoint}.html'
+        fd = os.open(os.path.join(directory, name), os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(report)
+
+        for old in self.names()[self.app.config['PROFILE_KEEP']:]:
+            try:
+                os.remove(os.path.join(directory, old))
+            except FileNotFoundError:
+                pass
+
+    def names(self):
+        """Saved reports, most recent first"""
+        directory = self.app.config['PROFILE_DIR']
+        if not os.path.isdir(directory):
+            return []
+
+        return sorted((name for name in os.listdir(directory) if name.endswith('.html')), reverse=True)
@@ -0,0 +1,138 @@
+"""
+Publish/subscribe of calendar changes
+
+Routes that modify events publish compact change messages per department, and each open
+calendar subscribes to its department through a Server-Sent Events stream.
+
+By default messages are passed in-process, which only reaches clients connected to the same
+worker process. Setting PUBSUB_REDIS_URL uses Redis channels instead, so all workers see
+every message (requires the `redis` package).
+"""
+
+# Standard library imports
+import json
+import queue
+import threading
+from collections import defaultdict
+
+
+class LocalSubscriber(object):
+    """Bounded message queue of a single stream"""
+
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = False
+
+
+class LocalBackend(object):
+    """In-process backend: one bounded queue per subscriber"""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.subscribers = defaultdict(set)
+        self.lock = threading.Lock()
+
+    def publish(self, channel, data):
+        with self.lock:
+            subscribers = list(self.subscribers.get(channel, ()))
+
+        for sub in subscribers:
+            try:
+                sub.queue.put_nowait(data)
+            except queue.Full:
+                # Subscriber is not keeping up, drop it; the browser reconnects and refetches
+                sub.dropped = True
+                self.unsubscribe(channel, sub)
+
+    def subscribe(self, channel):
+        sub = LocalSubscriber(self.maxsize)
+        with self.lock:
+            self.subscribers[channel].add(sub)
+        return sub
+
+    def unsubscribe(self, channel, sub):
+        with self.lock:
+            self.subscribers[channel].discard(sub)
+            if not self.subscribers[channel]:
+                del self.subscribers[channel]
+
+    def listen(self, sub, timeout):
+        """Yields messages, or None every `timeout` seconds without one. Stops once dropped."""
+        while not sub.dropped:
+            try:
+                yield sub.queue.get(timeout=timeout)
+            except queue.Empty:
+                yield None
+
+
+class RedisBackend(object):
+    """Redis backend: one channel per department, shared by all worker processes"""
+
+    def __init__(self, url):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def publish(self, channel, data):
+        self.client.publish(channel, data)
+
+    def subscribe(self, channel):
+        p = self.client.pubsub(ignore_subscribe_messages=True)
+        p.subscribe(channel)
+        return p
+
+    def unsubscribe(self, channel, p):
+        p.close()
+
+    def listen(self, p, timeout):
+        while True:
+            message = p.get_message(timeout=timeout)
+            yield message['data'].decode() if message else None
+
+
+class PubSub(object):
+    """Flask extension that publishes event changes to per-department channels
+
+    Messages are JSON strings, serialized once per publish regardless of the number of subscribers.
+    """
+
+    def __init__(self, app=None):
+        self.backend = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PUBSUB_REDIS_URL', None)
+        app.config.setdefault('PUBSUB_QUEUE_SIZE', 100)
+
+        if app.config['PUBSUB_REDIS_URL']:
+            self.backend = RedisBackend(app.config['PUBSUB_REDIS_URL'])
+        else:
+            self.backend = LocalBackend(app.config['PUBSUB_QUEUE_SIZE'])
+
+    @staticmethod
+    def channel(dept):
+        return f'events:{dept}'
+
+    def publish(self, dept, change, event):
+        """
+        Args:
+            dept (str): Department whose calendars should receive the message
+            change (str): 'create', 'modify' or 'delete'
+            event (dict): Changed event attributes, must include PK and SK
+        """
+        self.backend.publish(self.channel(dept), json.dumps({'change': change, 'event': event}))
+
+    def stream(self, dept, heartbeat):
+        """
+        Generator of Server-Sent Events for a department.
+        A comment line is sent every `heartbeat` seconds without messages to keep the connection open.
+        """
+        channel = self.channel(dept)
+        subscription = self.backend.subscribe(channel)
+
+        try:
+            yield 'retry: 5000\n\n'
+            for data in self.backend.listen(subscription, heartbeat):
+                yield f'data: {data}\n\n' if data is not None else ': keep-alive\n\n'
+        finally:
+            self.backend.unsubscribe(channel, subscription)
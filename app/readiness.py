@@ -0,0 +1,134 @@
+"""
+Readiness probe and warm-up
+
+`/ping` only shows that the process answers, so a new instance would take traffic while its DynamoDB
+connections, table metadata and compiled templates are still cold. At the end of `create_app` a background
+thread warms the process up:
+
+    - dynamo: loads the metadata of the scheduling and access log tables and opens WARM_UP_CONNECTIONS
+      pooled connections with concurrent reads
+    - templates: compiles every template, which also fills the Jinja bytecode cache
+    - depts: loads the resource lists of WARM_UP_DEPTS into the shared cache and their events into the
+      event store
+
+`/ready` answers 503 until warm-up is done, then 200 as long as the scheduling table can be read with a
+GetItem of a key that does not exist. Its body reports the time taken by warm-up and by each step. A failed
+warm-up is reported by `/ready` and started again by its next call. Warm-up is skipped under the flask CLI.
+"""
+
+# Standard library imports
+import os
+import time
+import threading
+
+# Third party imports
+from botocore.exceptions import BotoCoreError, ClientError
+
+
+# Read by the readiness check and to open connections, never written
+READY_KEY = {'PK': 'READY', 'SK': 'READY'}
+
+
+class Readiness(object):
+    """Flask extension running the warm-up and answering the readiness check"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.ready = False
+        self.error = None
+        self.seconds = None
+        self.steps = {}  # step -> seconds
+        self.thread = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('WARM_UP_ENABLED', os.getenv('FLASK_RUN_FROM_CLI') != 'true')
+        app.config.setdefault('WARM_UP_DEPTS', [])
+        app.config.setdefault('WARM_UP_CONNECTIONS', 8)
+        self.app = app
+
+    @property
+    def table(self):
+        from app.extensions import dynamo
+        return dynamo.tables[self.app.config['DB_SCHEDULING']]
+
+    def start(self):
+        """Starts the warm-up thread unless it is running or done"""
+        if not self.app.config['WARM_UP_ENABLED']:
+            self.ready = True
+            return
+
+        with self.lock:
+            if self.ready or (self.thread is not None and self.thread.is_alive()):
+                return
+            self.error = None
+            self.thread = threading.Thread(target=self.warm_up, name='warm-up', daemon=True)
+            self.thread.start()
+
+    def warm_up(self):
+        app = self.app
+        start = time.perf_counter()
+        steps = {}
+
+        with app.app_context():
+            try:
+                for name, step in (('dynamo', self.warm_dynamo),
+                                   ('templates', self.warm_templates),
+                                   ('depts', self.warm_depts)):
+                    step_start = time.perf_counter()
+                    step()
+                    steps[name] = round(time.perf_counter() - step_start, 3)
+            except Exception as e:
+                app.logger.warning(f'Warm-up failed: {e}')
+                self.error = str(e)
+                return
+
+        self.steps = steps
+        self.seconds = round(time.perf_counter() - start, 3)
+        self.ready = True
+        app.logger.info(f'Warmed up in {self.seconds}s: {steps}')
+
+    def warm_dynamo(self):
+        from app.extensions import dynamo
+        from app.utils.events import partition_executor
+
+        for name in (self.app.config['DB_SCHEDULING'], self.app.config.get('DB_ACCESS_LOGS')):
+            if name:
+                dynamo.tables[name].load()
+
+        table = self.table
+        list(partition_executor.map(lambda _: table.get_item(Key=READY_KEY),
+                                    range(self.app.config['WARM_UP_CONNECTIONS'])))
+
+    def warm_templates(self):
+        jinja_env = self.app.jinja_env
+        for name in jinja_env.list_templates(extensions=['html']):
+            jinja_env.get_template(name)
+
+    def warm_depts(self):
+        from app.extensions import event_store
+        from app.utils.resources import resource_list_json
+
+        for dept in self.app.config['WARM_UP_DEPTS']:
+            resource_list_json(dept)
+            if self.app.config['EVENT_STORE_ENABLED']:
+                event_store.load(dept)
+
+    def check(self):
+        """
+        Returns:
+            dict with `ready`, plus `warmUpSeconds` and `steps` once warmed up, or `error`
+        """
+        if not self.ready:
+            error = self.error
+            self.start()
+            return {'ready': False, 'error': error}
+
+        try:
+            self.table.get_item(Key=READY_KEY)
+        except (BotoCoreError, ClientError) as e:
+            return {'ready': False, 'error': str(e)}
+
+        return {'ready': True, 'warmUpSeconds': self.seconds, 'steps': self.steps}
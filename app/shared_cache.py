@@ -0,0 +1,263 @@
+"""
+Cache shared by the worker processes of an instance
+
+Per-process caches hold one copy of every entry per worker and miss once per worker after each change.
+This cache keeps small reference data in one memory-mapped file (SHARED_CACHE_PATH, by default in the app's
+instance folder) that every worker maps, so a single copy is loaded once per instance:
+    - ('resources', dept): the department's resource list as served to calendars (`resource_list_json`)
+    - ('user', uni): the user's department and type (`app.users.User`)
+    - ('dept-change', dept): the department's change version and last change (`get_dept_change`)
+
+Layout of the file:
+    header: magic, number of slots, size of the data area, end of the data written
+    slots: SHARED_CACHE_SLOTS entries of (key hash, data offset, data length, version, time stored),
+        a key is looked up in PROBES consecutive slots from its hash
+    data: records appended one after the other, each the key followed by the value, JSON (or text as is).
+        Keys are stored with the name of the scheduling table (DB_SCHEDULING) in front, so that apps sharing
+        a file never read each other's entries
+
+Replacing an entry appends a new record; when the data area is full every entry is dropped and writing
+starts over, so the file never grows. Entries carry a version and the time they were stored: a read may ask
+for a given version (e.g. a department's change version) or an entry younger than a TTL.
+
+Readers and writers take a shared or exclusive `flock` on the file, each process opening it itself (also
+after a fork). Entries decide who is an administrator, so the file is only used if it is a regular file of the
+user running the app, readable and writable by that user alone; otherwise the cache is disabled. Without
+`fcntl` (Windows) or with SHARED_CACHE_ENABLED false every read is a miss.
+"""
+
+# Standard library imports
+import os
+import json
+import mmap
+import time
+import struct
+import stat
+import hashlib
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+MAGIC = b'RSCACHE1'
+HEADER = struct.Struct('<8sIII')  # magic, slots, data size, data end
+SLOT = struct.Struct('<QIIqd')  # key hash, offset, length, version, time stored
+RECORD = struct.Struct('<HB')  # key length, value is text
+
+# Slots looked at for a key, the oldest of them is replaced when all are taken
+PROBES = 8
+
+
+def key_bytes(namespace, key):
+    return json.dumps([namespace, key], separators=(',', ':'), default=str).encode()
+
+
+def key_hash(data):
+    # 0 marks an empty slot
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little') or 1
+
+
+class SharedCache(object):
+    """Flask extension holding the shared cache file, see the module docstring"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.path = None
+        self.namespace = None
+        self.slots = None
+        self.data_bytes = None
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.pid = None
+        self.fd = None
+        self.map = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SHARED_CACHE_ENABLED', True)
+        app.config.setdefault('SHARED_CACHE_PATH', os.path.join(app.instance_path, 'shared-cache'))
+        app.config.setdefault('SHARED_CACHE_BYTES', 16 * 1024 * 1024)
+        app.config.setdefault('SHARED_CACHE_SLOTS', 4096)
+        app.config.setdefault('SHARED_CACHE_TTL', 300)
+        app.config.setdefault('SHARED_CACHE_USER_TTL', 60)
+        app.config.setdefault('SHARED_CACHE_VERSION_TTL', 1)
+
+        self.app = app
+        self.path = app.config['SHARED_CACHE_PATH']
+        self.namespace = app.config.get('DB_SCHEDULING')
+        self.slots = app.config['SHARED_CACHE_SLOTS']
+        self.data_bytes = app.config['SHARED_CACHE_BYTES']
+        self.enabled = app.config['SHARED_CACHE_ENABLED'] and fcntl is not None
+
+    @property
+    def data_start(self):
+        return HEADER.size + self.slots * SLOT.size
+
+    def open(self):
+        """
+        Opens the file, created if missing, or returns None (and disables the cache) if it is not a regular file
+        of this user only this user can use
+        """
+        os.makedirs(os.path.dirname(self.path), mode=0o700, exist_ok=True)
+        try:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT | getattr(os, 'O_NOFOLLOW', 0), 0o600)
+        except OSError as e:
+            self.app.logger.warning(f'Shared cache disabled, {self.path} cannot be opened: {e}')
+            self.enabled = False
+            return None
+
+        info = os.fstat(fd)
+        if not stat.S_ISREG(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            os.close(fd)
+            self.app.logger.warning(f'Shared cache disabled, {self.path} is not private to this user')
+            self.enabled = False
+            return None
+
+        return fd
+
+    def mapped(self):
+        """
+        The file's memory map, opened (and laid out if new) by this process, or None if the cache was disabled
+        when opening it. Call with `self.lock` held.
+        """
+        if self.pid == os.getpid():
+            return self.map
+
+        # A map inherited through fork shares its lock with the parent, open the file again
+        size = self.data_start + self.data_bytes
+        fd = self.open()
+        if fd is None:
+            return None
+
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(fd).st_size != size:
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, size)
+            cache_map = mmap.mmap(fd, size)
+            if HEADER.unpack_from(cache_map, 0)[:3] != (MAGIC, self.slots, self.data_bytes):
+                cache_map[:self.data_start] = bytes(self.data_start)
+                HEADER.pack_into(cache_map, 0, MAGIC, self.slots, self.data_bytes, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+        self.pid, self.fd, self.map = os.getpid(), fd, cache_map
+        return cache_map
+
+    def find(self, cache_map, data, hashed):
+        """Slot index of the key, or None"""
+        for probe in range(PROBES):
+            index = (hashed + probe) % self.slots
+            slot_hash, offset, length, _, _ = SLOT.unpack_from(cache_map, HEADER.size + index * SLOT.size)
+            if slot_hash == hashed and length:
+                start = self.data_start + offset
+                key_length, _ = RECORD.unpack_from(cache_map, start)
+                if cache_map[start + RECORD.size:start + RECORD.size + key_length] == data:
+                    return index
+        return None
+
+    def get(self, key, version=None, ttl=None):
+        """
+        Returns:
+            The value stored for `key`, or None if there is none, it has another version than `version`
+            or is older than `ttl` seconds
+        """
+        if not self.enabled:
+            return None
+
+        data = key_bytes(self.namespace, key)
+        with self.lock:
+            cache_map = self.mapped()
+            if cache_map is None:
+                return None
+
+            fcntl.flock(self.fd, fcntl.LOCK_SH)
+            try:
+                index = self.find(cache_map, data, key_hash(data))
+                if index is None:
+                    return None
+
+                _, offset, length, stored_version, stored_at = SLOT.unpack_from(
+                    cache_map, HEADER.size + index * SLOT.size)
+                if version is not None and stored_version != version:
+                    return None
+                if ttl is not None and time.time() - stored_at >= ttl:
+                    return None
+
+                start = self.data_start + offset
+                key_length, is_text = RECORD.unpack_from(cache_map, start)
+                value = cache_map[start + RECORD.size + key_length:start + length]
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return value.decode() if is_text else json.loads(value)
+
+    def set(self, key, value, version=0):
+        """Stores `value`, a string or anything JSON serializable, for `key` (values too large are skipped)"""
+        if not self.enabled:
+            return
+
+        data = key_bytes(self.namespace, key)
+        is_text = isinstance(value, str)
+        record = RECORD.pack(len(data), is_text) + data + (
+            value.encode() if is_text else json.dumps(value, separators=(',', ':'), default=str).encode())
+        if len(record) > self.data_bytes // 4:
+            return
+
+        hashed = key_hash(data)
+        with self.lock:
+            cache_map = self.mapped()
+            if cache_map is None:
+                return
+
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                _, slots, data_bytes, end = HEADER.unpack_from(cache_map, 0)
+                if end + len(record) > data_bytes:
+                    # Full: drop every entry and start over
+                    cache_map[HEADER.size:self.data_start] = bytes(self.data_start - HEADER.size)
+                    end = 0
+
+                index = self.find(cache_map, data, hashed)
+                if index is None:
+                    index = min(((hashed + probe) % slots for probe in range(PROBES)),
+                                key=lambda i: SLOT.unpack_from(cache_map, HEADER.size + i * SLOT.size)[4])
+
+                start = self.data_start + end
+                cache_map[start:start + len(record)] = record
+                SLOT.pack_into(cache_map, HEADER.size + index * SLOT.size, hashed, end, len(record), version,
+                               time.time())
+                HEADER.pack_into(cache_map, 0, MAGIC, slots, data_bytes, end + len(record))
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def discard(self, key):
+        if not self.enabled:
+            return
+
+        data = key_bytes(self.namespace, key)
+        with self.lock:
+            cache_map = self.mapped()
+            if cache_map is None:
+                return
+
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                index = self.find(cache_map, data, key_hash(data))
+                if index is not None:
+                    SLOT.pack_into(cache_map, HEADER.size + index * SLOT.size, 0, 0, 0, 0, 0.0)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def get_or_load(self, key, load, ttl=None, version=None):
+        """The value stored for `key` (see `get`), else the result of `load()`, which is stored"""
+        value = self.get(key, version=version, ttl=ttl)
+        if value is None:
+            value = load()
+            self.set(key, value, version=version or 0)
+
+        return value
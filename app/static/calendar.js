@@ -41,6 +41,238 @@ function isOverlapping(events, eventToCheck) {
 }
 
 
+/*
+Client cache of the calendar feeds.
+
+Resources and events are kept in IndexedDB with the ETag they were sent with. Events are fetched in windows of
+one week (Monday to Monday), whatever the view shows, so that every visit to a week uses the same window.
+A cached feed is shown right away and revalidated with the server in the background, once per page view
+until the calendar is refreshed (a change on the event stream, a change of the user's or a return after
+inactivity); when the server has a newer version, the calendar is refetched from the updated cache. Without a
+connection the cached feeds are shown read-only.
+*/
+var calendar = null;
+var offline = false;
+const validatedFeeds = new Set();
+
+const cacheDB = new Promise(function(resolve) {
+    if (!window.indexedDB) {
+        resolve(null);
+        return;
+    }
+    const request = indexedDB.open('room-scheduler', 1);
+    request.onupgradeneeded = function() {
+        request.result.createObjectStore('feeds');
+    };
+    request.onsuccess = function() {
+        resolve(request.result);
+    };
+    request.onerror = function() {
+        resolve(null);  // e.g. private browsing: no cache
+    };
+});
+
+function cacheRequest(mode, operation) {
+    return cacheDB.then(function(db) {
+        if (!db) {
+            return undefined;
+        }
+        return new Promise(function(resolve) {
+            const request = operation(db.transaction('feeds', mode).objectStore('feeds'));
+            request.onsuccess = function() {
+                resolve(request.result);
+            };
+            request.onerror = function() {
+                resolve(undefined);
+            };
+        });
+    });
+}
+
+function setOffline(value) {
+    if (value === offline) {
+        return;
+    }
+    offline = value;
+    $('#offline-notice').toggle(offline);
+    if (calendar) {
+        calendar.setOption('editable', !offline);
+        calendar.setOption('selectable', !offline);
+    }
+}
+
+/*
+Downloads `url` unless the cached copy is still current, updates the cache and returns the body.
+*/
+function revalidateFeed(key, url, cached) {
+    return fetch(url, {
+        credentials: 'same-origin',
+        cache: 'no-store',
+        headers: cached ? {'If-None-Match': cached.etag} : {},
+    }).then(function(response) {
+        setOffline(false);
+
+        if (response.status === 304) {
+            validatedFeeds.add(key);
+            return cached.body;
+        }
+        if (!response.ok) {
+            throw new Error(response.status + ' ' + response.statusText);
+        }
+        return response.json().then(function(body) {
+            validatedFeeds.add(key);
+            cacheRequest('readwrite', function(store) {
+                return store.put({etag: response.headers.get('ETag'), body: body}, key);
+            });
+            return body;
+        });
+    }, function(error) {
+        setOffline(true);
+        throw error;
+    });
+}
+
+/*
+Returns the body of `url`: the cached one right away if there is one, with `onChange` called if the background
+revalidation finds a newer version. Cache keys include the user, so that users sharing a browser never see
+each other's department.
+*/
+function cachedFeed(url, onChange) {
+    url = new URL(url, document.baseURI).href;
+    const key = document.getElementById('calendar').dataset.cacheScope + ' ' + url;
+
+    return cacheRequest('readonly', function(store) { return store.get(key); }).then(function(cached) {
+        if (!cached) {
+            return revalidateFeed(key, url, null);
+        }
+        if (!validatedFeeds.has(key)) {
+            revalidateFeed(key, url, cached).then(function(body) {
+                if (body !== cached.body) {
+                    onChange();
+                }
+            }, function() {});
+        }
+        return cached.body;
+    });
+}
+
+function weekWindows(start, end) {
+    const windows = [];
+    for (let week = moment(start).startOf('isoWeek'); week.isBefore(end); week.add(1, 'week')) {
+        windows.push({start: week.format(), end: week.clone().add(1, 'week').format()});
+    }
+    return windows;
+}
+
+/*
+Refetches the calendar from the server, e.g. after the user's own changes: every window is revalidated.
+*/
+function refreshEvents() {
+    validatedFeeds.clear();
+    calendar.refetchEvents();
+}
+
+var refetchScheduled = false;
+
+function refetchEventsSoon() {
+    // Several windows can change at once, refetch them together
+    if (!refetchScheduled) {
+        refetchScheduled = true;
+        setTimeout(function() {
+            refetchScheduled = false;
+            calendar.refetchEvents();
+        });
+    }
+}
+
+
+/*
+Resources are fetched a page of PAGE_ROOMS rooms at a time, the next page when the calendar is scrolled near
+its last row (or does not fill its height yet). Each page has its own event source, which only fetches the
+events of the page's resources, so what is downloaded and rendered grows with the rows that were shown.
+*/
+const PAGE_ROOMS = 20;
+var resourcePages = [];  // resource ids of each page shown
+var moreResources = false;
+var loadingResources = false;
+
+function fetchResourcePage(page) {
+    const url = 'resource_data?' + $.param({offset: page * PAGE_ROOMS, limit: PAGE_ROOMS});
+    return cachedFeed(url, function() { calendar.refetchResources(); });
+}
+
+function resourcePage(resourceId) {
+    return resourcePages.findIndex(function(ids) { return ids.includes(resourceId); });
+}
+
+function pageEventSource(page) {
+    return {
+        id: 'page-' + page,
+        events: function(info, successCallback, failureCallback) {
+            const ids = resourcePages[page].join(',');
+            const weeks = weekWindows(info.start, info.end).map(function(week) {
+                return cachedFeed('event_data?' + $.param(Object.assign({resourceIds: ids}, week)), refetchEventsSoon);
+            });
+
+            Promise.all(weeks).then(function(weeks) {
+                // Events on a boundary are in two windows
+                const events = new Map();
+                weeks.forEach(function(week) {
+                    week.forEach(function(e) { events.set(e.PK + ' ' + e.SK, e); });
+                });
+                successCallback(Array.from(events.values()));
+            }, function(error) {
+                failureCallback(error);
+                if (navigator.onLine) {
+                    alert('Unexpected error while fetching events.');
+                }
+            });
+        },
+    };
+}
+
+function showResourcePage(page, body) {
+    const ids = body.resources.map(function(resource) { return resource.id; });
+    const changed = String(resourcePages[page]) !== String(ids);
+
+    resourcePages[page] = ids;
+    if (!calendar.getEventSourceById('page-' + page)) {
+        calendar.addEventSource(pageEventSource(page));
+    } else if (changed) {
+        calendar.getEventSourceById('page-' + page).refetch();
+    }
+}
+
+function loadMoreResources() {
+    if (loadingResources || !moreResources) {
+        return;
+    }
+    loadingResources = true;
+
+    const page = resourcePages.length;
+    fetchResourcePage(page).then(function(body) {
+        loadingResources = false;
+        moreResources = body.next !== null;
+        calendar.batchRendering(function() {
+            body.resources.forEach(function(resource) { calendar.addResource(resource); });
+            showResourcePage(page, body);
+        });
+        setTimeout(fillCalendar);
+    }, function() {
+        loadingResources = false;
+    });
+}
+
+function fillCalendar() {
+    // Loads pages until the rows reach past the bottom of the calendar
+    $('#calendar .fc-scroller').each(function() {
+        if (this.scrollHeight - this.scrollTop - this.clientHeight < 200) {
+            loadMoreResources();
+        }
+    });
+}
+
+
 const options = {
     schedulerLicenseKey: '0320620453-fcs-1597083069',
     aspectRatio: 1.7,
@@ -67,15 +299,23 @@ const options = {
     resourceGroupField: 'room',
     resourceAreaWidth: '25%',
     resourceOrder: 'PK',  // Sorting by this, which is the same for all resources, will ensure fullcalendar does not mess up the correct order from url feed
-    resources: {
-        url: 'resource_data',
-        method: 'POST'
+    resources: function(info, successCallback, failureCallback) {
+        // The pages shown so far, at least the first one
+        const pages = [];
+        for (let page = 0; page < Math.max(resourcePages.length, 1); page++) {
+            pages.push(fetchResourcePage(page));
+        }
+
+        Promise.all(pages).then(function(bodies) {
+            moreResources = bodies[bodies.length - 1].next !== null;
+            successCallback([].concat.apply([], bodies.map(function(body) { return body.resources; })));
+            bodies.forEach(function(body, page) { showResourcePage(page, body); });
+            setTimeout(fillCalendar);
+        }, failureCallback);
     },
-    events: {
-        url: 'event_data',
-        failure: function() {
-            alert('Unexpected error while fetching events.');
-        },
+    eventDataTransform: function(eventData) {
+        eventData.id = eventData.SK;  // Lets changes from the event stream find the event
+        return eventData;
     },
     eventOverlap: false,
     firstDay: 1, // start week on Sunday
@@ -84,14 +324,47 @@ const options = {
 document.addEventListener('DOMContentLoaded', function() {
 
     var calendarEl = document.getElementById('calendar');
-    var calendar = new FullCalendar.Calendar(calendarEl, options);
+    calendar = new FullCalendar.Calendar(calendarEl, options);
 
     /*
     Callback that is triggered when a date/time selection is made.
     */
+    /*
+    Books whichever desk of the selected desk's room is free, when the selected one is taken.
+    */
+    function offerAnyInRoom(info) {
+        const room = info.resource.extendedProps.room;
+
+        if (!confirm('This desk is taken at that time. Book any free desk in ' + room + ' instead?')) {
+            calendar.unselect();
+            return;
+        }
+
+        $.ajax({
+            type: 'POST',
+            url: ('event_create_any'),
+            contentType: 'application/json;charset=UTF-8',
+            data: JSON.stringify({
+                start: info.startStr,
+                end: info.endStr,
+                room: room,
+            }),
+
+            success: function (data) {
+                refreshEvents();
+                alert('Booked ' + data.resourceName + '.');
+            },
+
+            error: function (xhr, status, error) {
+                refreshEvents();
+                alert(xhr.responseText);
+            },
+        });
+    }
+
     calendar.on('select', function(info) {
         if (isOverlapping(info.resource.getEvents(), info)) {
-            alert('Your booking overlaps with another booking or a reserved time.');
+            offerAnyInRoom(info);
         } else {
 
             const startTime = new Date(info.startStr).toLocaleString()
@@ -111,19 +384,21 @@ document.addEventListener('DOMContentLoaded', function() {
                         end: info.endStr,
                         resourceId: info.resource.id,
                         resourceName: info.resource.extendedProps.room + ' - ' + info.resource.title,
-                        viewStart: info.view.currentStart,
-                        viewEnd: info.view.currentEnd,
                     }),
 
                     success: function (data) {
                         // Refresh calendar on success
-                        // Can also reload page with location.reload(); if the reservation history needs to be refreshed
-                        calendar.refetchEvents();
+                        refreshEvents();
                     },
 
                     error: function (xhr, status, error) {
-                        calendar.refetchEvents();
-                        alert(xhr.responseText);
+                        refreshEvents();
+                        if (xhr.status === 409) {
+                            // Taken by a booking this calendar did not show yet
+                            offerAnyInRoom(info);
+                        } else {
+                            alert(xhr.responseText);
+                        }
                     },
 
                 });
@@ -161,10 +436,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 contentType: 'application/json;charset=UTF-8',
                 data: JSON.stringify(payload),
                 success: function (data) {
-                    calendar.refetchEvents();
+                    refreshEvents();
                 },
                 error: function (xhr, status, error) {
-                    calendar.refetchEvents();
+                    refreshEvents();
                     alert(xhr.responseText);
                 },
             });
@@ -217,10 +492,10 @@ document.addEventListener('DOMContentLoaded', function() {
                 contentType: 'application/json;charset=UTF-8',
                 data: JSON.stringify(payload),
                 success: function (data) {
-                    calendar.refetchEvents();
+                    refreshEvents();
                 },
                 error: function (xhr, status, error) {
-                    calendar.refetchEvents();
+                    refreshEvents();
                     alert(xhr.responseText);
                 },
             });
@@ -233,16 +508,158 @@ document.addEventListener('DOMContentLoaded', function() {
 
     calendar.render();
 
+    // Scroll events do not bubble, listen for those of the calendar's scrollers while capturing
+    calendarEl.addEventListener('scroll', fillCalendar, true);
+
     /*
-    Refetch events after returning from a given amount (milliseconds) of inactivity; Using https://github.com/shawnmclean/Idle.js
+    Reservation history is paginated: the page renders the first page of upcoming reservations,
+    other statuses and further pages are fetched from the history endpoint.
     */
-    const AWAY_TIMEOUT = 60000;
-    var awayBackCallback = function() {
-        calendar.refetchEvents();
-    };
-    var idle = new Idle({
-        onAwayBack: awayBackCallback,
-        awayTimeout: AWAY_TIMEOUT
-    }).start();
+    function historyRow(e) {
+        const muted = e.active ? '' : 'text-muted font-italic';
+        const row = $('<tr>');
+
+        const select = $('<td>');
+        if (e.active) {
+            select.append($('<input type="checkbox" class="batch-delete-select">').val(e.token));
+        }
+        row.append(select);
+        row.append($('<th scope="row">').addClass(muted).text(e.resourceName));
+        row.append($('<td>').addClass(muted).text(e.startDisplay));
+        row.append($('<td>').addClass(muted).text(e.endDisplay));
+
+        if (e.active) {
+            const form = $('<form class="download-form" method="POST">').attr('action', $('#history-rows').data('delete-url'));
+            form.append($('<input type="hidden" name="token">').val(e.token));
+            form.append('<button type="submit" class="btn btn-danger btn-sm"><i class="fa fa-trash-o fa-lg"></i></button>');
+            row.append($('<td class="text-center">').append(form));
+        } else {
+            row.append($('<td class="text-center text-muted font-italic">').text('Deleted'));
+        }
+
+        return row;
+    }
+
+    function loadHistory(status, cursor) {
+        $.ajax({
+            type: 'GET',
+            url: $('#history-status').data('url'),
+            data: cursor ? {status: status, cursor: cursor} : {status: status},
+            success: function (data) {
+                if (!cursor) {
+                    $('#history-rows').empty();
+                }
+                $('#history-rows').append(data.events.map(historyRow));
+                $('#history-more').data('cursor', data.cursor || '').toggle(Boolean(data.cursor));
+            },
+            error: function (xhr, status, error) {
+                alert(xhr.responseText);
+            },
+        });
+    }
+
+    $('#history-status button').on('click', function() {
+        $('#history-status button').removeClass('active');
+        $(this).addClass('active');
+        loadHistory(this.value, null);
+    });
+
+    $('#history-more').on('click', function() {
+        loadHistory($('#history-status button.active').val(), $(this).data('cursor'));
+    });
+
+    /*
+    Delete all selected reservations from the history table in one request, without reloading the page.
+    */
+    $('#batch-delete').on('click', function() {
+
+        const tokens = $('.batch-delete-select:checked').map(function() { return this.value; }).get();
+
+        if (tokens.length === 0 || !confirm('Delete ' + tokens.length + ' selected reservation(s)?')) {
+            return;
+        }
+
+        $.ajax({
+            type: 'POST',
+            url: $(this).data('url'),
+            contentType: 'application/json;charset=UTF-8',
+            data: JSON.stringify({tokens: tokens}),
+            success: function (data) {
+                data.deleted.forEach(function(token) {
+                    const row = $('.batch-delete-select').filter(function() { return this.value === token; }).closest('tr');
+                    row.find('th, td').addClass('text-muted font-italic');
+                    row.find('td:first').empty();
+                    row.find('td:last').addClass('text-center').text('Deleted');
+                });
+                refreshEvents();
+                if (data.failed.length > 0) {
+                    alert(data.failed.length + ' reservation(s) could not be deleted.');
+                }
+            },
+            error: function (xhr, status, error) {
+                alert(xhr.responseText);
+            },
+        });
+    });
+
+    /*
+    Apply changes published by the server for the user's department to the events already on the calendar.
+    After a reconnect, changes may have been missed, so the events are refetched once. The stream is only
+    used when the server shares changes between its worker processes (data-stream on #calendar), otherwise
+    the events are refetched after returning from AWAY_TIMEOUT (milliseconds) of inactivity;
+    Using https://github.com/shawnmclean/Idle.js
+    */
+    function applyChange(message) {
+        const data = JSON.parse(message.data);
+        const existing = calendar.getEventById(data.event.SK);
+
+        if (data.change === 'delete') {
+            if (existing) {
+                existing.remove();
+            }
+        } else if (existing) {
+            existing.setDates(data.event.start, data.event.end);
+            if (data.event.resourceId) {
+                existing.setResources([data.event.resourceId]);
+            }
+        } else if (data.change === 'create' && resourcePage(data.event.resourceId) !== -1) {
+            // Added to its page's source so that a later refetch replaces it instead of duplicating it
+            const source = calendar.getEventSourceById('page-' + resourcePage(data.event.resourceId));
+            calendar.addEvent(options.eventDataTransform(data.event), source);
+        }
+    }
+
+    if (calendarEl.dataset.stream === 'true' && window.EventSource) {
+        var streamConnected = false;
+        var stream = new EventSource('events/stream');
+        stream.onmessage = function(message) {
+            // The calendar is up to date, the cached windows are revalidated on their next use
+            validatedFeeds.clear();
+            applyChange(message);
+        };
+        stream.onopen = function() {
+            if (streamConnected) {
+                refreshEvents();
+            }
+            streamConnected = true;
+        };
+    } else {
+        const AWAY_TIMEOUT = 60000;
+        var idle = new Idle({
+            onAwayBack: refreshEvents,
+            awayTimeout: AWAY_TIMEOUT
+        }).start();
+    }
+
+    window.addEventListener('online', refreshEvents);
+
+    /*
+    The service worker keeps this page and its scripts, so that it opens without a connection.
+    */
+    if ('serviceWorker' in navigator) {
+        navigator.serviceWorker.register('service-worker.js').catch(function(error) {
+            console.error(error);
+        });
+    }
 
 });
@@ -0,0 +1,79 @@
+/*
+Service worker of the calendar page.
+
+Keeps the page itself and its scripts, stylesheets and fonts, so that the calendar opens without a connection
+and shows the feeds calendar.js keeps in IndexedDB. The page is fetched from the network first and only served
+from the cache when the network fails; scripts, stylesheets and fonts are served from the cache and refreshed
+in the background. The feeds themselves are not handled here, calendar.js caches and revalidates them.
+*/
+
+const CACHE = 'scheduler-shell-v1';
+const SHELL_DESTINATIONS = ['script', 'style', 'font'];
+
+self.addEventListener('install', function(event) {
+    self.skipWaiting();
+});
+
+self.addEventListener('activate', function(event) {
+    event.waitUntil(
+        caches.keys().then(function(names) {
+            return Promise.all(names.filter(function(name) { return name !== CACHE; }).map(function(name) {
+                return caches.delete(name);
+            }));
+        }).then(function() {
+            return self.clients.claim();
+        })
+    );
+});
+
+function store(request, response) {
+    // Opaque responses are cross-origin resources loaded without CORS, their status is unknown
+    if (response.ok || response.type === 'opaque') {
+        const copy = response.clone();
+        caches.open(CACHE).then(function(cache) {
+            cache.put(request, copy);
+        });
+    }
+    return response;
+}
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+
+    if (request.method !== 'GET') {
+        return;
+    }
+
+    // Only the calendar page, e.g. not the admin pages under the same scope
+    if (request.mode === 'navigate') {
+        if (new URL(request.url).pathname !== new URL(self.registration.scope).pathname) {
+            return;
+        }
+        event.respondWith(
+            fetch(request).then(function(response) {
+                // Redirects go to the login page
+                return response.redirected ? response : store(request, response);
+            }).catch(function() {
+                return caches.match(request).then(function(cached) {
+                    return cached || Response.error();
+                });
+            })
+        );
+        return;
+    }
+
+    if (SHELL_DESTINATIONS.includes(request.destination)) {
+        event.respondWith(
+            caches.match(request).then(function(cached) {
+                const fetched = fetch(request).then(function(response) {
+                    return store(request, response);
+                });
+                if (cached) {
+                    fetched.catch(function() {});
+                    return cached;
+                }
+                return fetched;
+            })
+        );
+    }
+});
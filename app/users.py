@@ -8,7 +8,12 @@ from flask import session
 from flask import has_request_context
 
 # Local application imports
-from app.extensions import dynamo
+from app.extensions import dynamo, shared_cache
+
+
+def user_cache_key(uni):
+    """Shared cache key of the user's profile, to be discarded when the user is added or removed"""
+    return ('user', uni)
 
 
 class User(object):
@@ -66,13 +71,13 @@ class User(object):
         else:
             return str(self._uni)
 
-    @property
-    def dept(self):
+    def profile(self):
         """
-        Returns user's department. If user is not registered to use the application, returns an empty string.
+        Returns:
+            dict with the user's department (`dept`) and `type`, empty if the user is not registered. It is kept
+            in the shared cache for SHARED_CACHE_USER_TTL seconds, see `app.shared_cache`.
         """
-        if (has_request_context() and 'CAS_USERNAME' in session) or (self._uni is not None):
-
+        def load():
             response = dynamo.tables[self.table_name].query(
                 KeyConditionExpression='PK = :pk',
                 ExpressionAttributeValues={
@@ -81,48 +86,32 @@ class User(object):
             )
 
             try:
-                return response['Items'][0]['SK']
+                item = response['Items'][0]
             except IndexError:
-                return ''
+                return {}
 
-        else:
+            return {'dept': item['SK'], 'type': item.get('type', '')}
 
+        return shared_cache.get_or_load(user_cache_key(self.uni), load, ttl=self.app.config['SHARED_CACHE_USER_TTL'])
+
+    @property
+    def dept(self):
+        """
+        Returns user's department. If user is not registered to use the application, returns an empty string.
+        """
+        if (has_request_context() and 'CAS_USERNAME' in session) or (self._uni is not None):
+            return self.profile().get('dept', '')
+        else:
             return ''
 
     def is_admin(self):
         if (has_request_context() and 'CAS_USERNAME' in session) or (self._uni is not None):
-
-            response = dynamo.tables[self.table_name].query(
-                KeyConditionExpression='PK = :pk',
-                ExpressionAttributeValues={
-                    ':pk': f'USER#{self.uni}',
-                },
-            )
-
-            try:
-                return response['Items'][0]['SK'] == 'ADMIN'
-            except IndexError:
-                return False
-
+            return self.profile().get('dept') == 'ADMIN'
         else:
-
             return False
 
     def is_dept_admin(self):
         if (has_request_context() and 'CAS_USERNAME' in session) or (self._uni is not None):
-
-            response = dynamo.tables[self.table_name].query(
-                KeyConditionExpression='PK = :pk',
-                ExpressionAttributeValues={
-                    ':pk': f'USER#{self.uni}',
-                },
-            )
-
-            try:
-                return response['Items'][0]['type'].lower() in ['staff', 'chair']
-            except IndexError:
-                return False
-
+            return self.profile().get('type', '').lower() in ['staff', 'chair']
         else:
-
             return False
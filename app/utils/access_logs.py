@@ -0,0 +1,238 @@
+"""
+Rollups of the access log table
+
+`DynamoAccessLogger` writes one item per request. `compact_access_logs` aggregates them into one item
+per hour and per day (UTC) in the same table, keyed ROLLUP#HOUR#{YYYY-MM-DDTHH} and ROLLUP#DAY#{YYYY-MM-DD}:
+
+    counts: {'{resource}|{route}|{success}|{error}': number of requests}
+    users:  {'{resource}|{accessedBy}': number of requests}
+
+Compaction is incremental. The checkpoint item ROLLUP#CHECKPOINT holds the hour up to which raw items
+have been compacted, and every run scans (in parallel segments) only items of complete hours after it.
+Hourly items are recomputed entirely from the raw items of their hour and daily items from the hourly
+items of their day, so a run interrupted before moving the checkpoint can simply be repeated.
+
+`query_access_counts` and `query_access_users` answer time-range questions with batched gets of at most
+one item per hour or day instead of a table scan.
+"""
+# Standard library imports
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports
+import arrow
+from flask import current_app
+from boto3.dynamodb.conditions import Attr
+
+# Local application imports
+from app.extensions import dynamo
+
+
+CHECKPOINT_KEY = 'ROLLUP#CHECKPOINT'
+HOUR_FORMAT = 'YYYY-MM-DDTHH'
+DAY_FORMAT = 'YYYY-MM-DD'
+
+# Raw items are only compacted once their hour has been over for this long, so that late writes are included
+COMPACT_DELAY_MINUTES = 5
+
+# DynamoDB limit on the number of keys in a single BatchGetItem call
+BATCH_GET_MAX_KEYS = 100
+
+# Hash key of the access log table
+KEY = 'resource-timestamp'
+
+
+def rollup_key(granularity, period):
+    return f'ROLLUP#{granularity}#{period}'
+
+
+def dimension_key(item):
+    return '|'.join((
+        item.get('resource') or '',
+        item.get('route') or '',
+        'true' if item.get('success') else 'false',
+        item.get('error') or '',
+    ))
+
+
+def parse_dimension_key(key):
+    resource, route, success, error = key.split('|', 3)
+    return {'resource': resource, 'route': route, 'success': success == 'true', 'error': error}
+
+
+def access_table():
+    return dynamo.tables[current_app.config['DB_ACCESS_LOGS']]
+
+
+def batch_get(table, keys):
+    """Returns the items that exist for `keys` (values of the table's hash key)"""
+    items = []
+    for i in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {table.name: {'Keys': [{KEY: key} for key in keys[i:i + BATCH_GET_MAX_KEYS]]}}
+        while request:
+            response = dynamo.connection.batch_get_item(RequestItems=request)
+            items.extend(response['Responses'].get(table.name, []))
+            request = response.get('UnprocessedKeys')
+
+    return items
+
+
+def compact_segment(table, segment, total_segments, since, until):
+    """
+    Aggregates the raw items of one scan segment with `since` <= timestamp < `until`, page by page.
+
+    Returns:
+        Tuple of (counts, users): Counters of dimension and user keys per hour
+    """
+    scan_kwargs = {
+        'FilterExpression': Attr('timestamp').gte(since) & Attr('timestamp').lt(until),
+        'Segment': segment,
+        'TotalSegments': total_segments,
+    }
+
+    counts = defaultdict(Counter)
+    users = defaultdict(Counter)
+    while True:
+        response = table.scan(**scan_kwargs)
+
+        for item in response['Items']:
+            # A sampled item stands for 1 / sampleRate requests
+            weight = round(1 / item['sampleRate']) if 'sampleRate' in item else 1
+            hour = item['timestamp'][:13]
+            counts[hour][dimension_key(item)] += weight
+            users[hour][f'{item.get("resource") or ""}|{item.get("accessedBy") or ""}'] += weight
+
+        if 'LastEvaluatedKey' not in response:
+            return counts, users
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def compact_access_logs(segments=4):
+    """
+    Compacts raw access items of complete hours since the checkpoint into hourly and daily rollups.
+
+    Returns:
+        Tuple of (number of requests counted, new checkpoint hour)
+    """
+    app = current_app._get_current_object()
+    table = access_table()
+
+    checkpoint = table.get_item(Key={KEY: CHECKPOINT_KEY}).get('Item', {}).get('until', '')
+    until = arrow.utcnow().shift(minutes=-COMPACT_DELAY_MINUTES).floor('hour').format(HOUR_FORMAT)
+    if checkpoint >= until:
+        return 0, checkpoint
+
+    def run(segment):
+        with app.app_context():
+            return compact_segment(table, segment, segments, checkpoint, until)
+
+    with ThreadPoolExecutor(max_workers=segments) as executor:
+        results = list(executor.map(run, range(segments)))
+
+    counts = defaultdict(Counter)
+    users = defaultdict(Counter)
+    for segment_counts, segment_users in results:
+        for hour, counter in segment_counts.items():
+            counts[hour].update(counter)
+        for hour, counter in segment_users.items():
+            users[hour].update(counter)
+
+    with table.batch_writer() as batch:
+        for hour in counts:
+            batch.put_item(Item={
+                KEY: rollup_key('HOUR', hour),
+                'period': hour,
+                'counts': dict(counts[hour]),
+                'users': dict(users[hour]),
+            })
+
+    for day in sorted({hour[:10] for hour in counts}):
+        hourly = batch_get(table, [rollup_key('HOUR', f'{day}T{h:02d}') for h in range(24)])
+        day_counts = Counter()
+        day_users = Counter()
+        for item in hourly:
+            day_counts.update({k: int(v) for k, v in item['counts'].items()})
+            day_users.update({k: int(v) for k, v in item['users'].items()})
+
+        table.put_item(Item={
+            KEY: rollup_key('DAY', day),
+            'period': day,
+            'counts': dict(day_counts),
+            'users': dict(day_users),
+        })
+
+    table.put_item(Item={KEY: CHECKPOINT_KEY, 'until': until})
+
+    return sum(sum(counter.values()) for counter in counts.values()), until
+
+
+def rollup_periods(start, end):
+    """
+    Smallest set of rollup keys covering the hours from `start` (inclusive) to `end` (exclusive):
+    daily rollups for whole days and hourly rollups for the partial days at either end.
+    """
+    hour = arrow.get(start).to('UTC').floor('hour')
+    end = arrow.get(end).to('UTC')
+
+    keys = []
+    while hour < end:
+        if hour.hour == 0 and hour.shift(days=1) <= end:
+            keys.append(rollup_key('DAY', hour.format(DAY_FORMAT)))
+            hour = hour.shift(days=1)
+        else:
+            keys.append(rollup_key('HOUR', hour.format(HOUR_FORMAT)))
+            hour = hour.shift(hours=1)
+
+    return keys
+
+
+def query_access_counts(start, end, by='day', **filters):
+    """
+    Returns request counts between `start` and `end` from the rollups.
+
+    Args:
+        start, end (str): ISO8601 timestamps, rounded to whole hours
+        by (str): 'day', 'hour' or None to aggregate the whole range
+        **filters: Required values of 'resource', 'route', 'success' or 'error'
+
+    Returns:
+        Tuple of (list of {'period', 'resource', 'route', 'success', 'error', 'count'} ordered by period,
+        hour up to which raw items have been compacted)
+    """
+    table = access_table()
+
+    if by == 'hour':
+        end = arrow.get(end)
+        hours = arrow.Arrow.range('hour', arrow.get(start).to('UTC').floor('hour'), end.to('UTC'))
+        keys = [rollup_key('HOUR', hour.format(HOUR_FORMAT)) for hour in hours if hour < end]
+    else:
+        keys = rollup_periods(start, end)
+
+    totals = Counter()
+    for item in batch_get(table, keys):
+        period = {'hour': item['period'], 'day': item['period'][:10]}.get(by)
+        for key, count in item['counts'].items():
+            dimensions = parse_dimension_key(key)
+            if all(dimensions[name] == value for name, value in filters.items()):
+                totals[(period, key)] += int(count)
+
+    rows = [
+        dict(parse_dimension_key(key), period=period, count=count)
+        for (period, key), count in sorted(totals.items(), key=lambda kv: (kv[0][0] or '', kv[0][1]))
+    ]
+
+    return rows, table.get_item(Key={KEY: CHECKPOINT_KEY}).get('Item', {}).get('until')
+
+
+def query_access_users(start, end, resource):
+    """
+    Returns the number of requests per user to `resource` between `start` and `end`, most active first.
+    """
+    users = Counter()
+    for item in batch_get(access_table(), rollup_periods(start, end)):
+        for key, count in item['users'].items():
+            item_resource, uni = key.split('|', 1)
+            if item_resource == resource:
+                users[uni] += int(count)
+
+    return users.most_common()
@@ -0,0 +1,194 @@
+"""
+Bulk blocked-off times (holidays, maintenance) for department admins.
+
+A bulk request covers a set of resources, a range of days and a daily time window, and becomes one BLOCK
+item per resource and day. Blocks of one day each are found by the same window queries as events, including
+the overlap check of new reservations, which only looks at items starting within the calendar's view.
+
+Conflicts with active events are found with a single query of the department's events over the whole
+range and one sweep over blocks and events sorted by resource and start, so a request costs O(n log n)
+and a few round trips: the resources, the events (one query per partition), the existing blocks, the
+cancellations and the writes, the last two as concurrent batches.
+"""
+# Standard library imports
+from collections import defaultdict
+from uuid import uuid4
+
+# Third party imports
+import arrow
+from boto3.dynamodb.conditions import Attr, Key
+
+# Local application imports
+from app.utils.events import (MAX_EVENT_SECONDS,
+                              batch_put_items,
+                              deactivate_events,
+                              event_epochs,
+                              query_blocks,
+                              query_events,
+                              record_changes)
+from app.utils.resources import query_resources
+from app.utils.scheduler import datetime_to_EST, get_local_ISO_timestamp
+
+
+TIMEZONE = 'US/Eastern'
+
+# Blocks per request
+MAX_BLOCKS = 10000
+
+
+class BlockRequestError(ValueError):
+    """Invalid bulk block request, the message is shown to the user"""
+
+
+def day_time(day, minutes):
+    """Local time `minutes` after the midnight starting `day`, 1440 being the next midnight"""
+    return day.shift(days=minutes // 1440).replace(hour=minutes % 1440 // 60, minute=minutes % 60)
+
+
+def block_items(dept, resources, first_day, last_day, start_minutes, end_minutes, weekdays, title, uni):
+    """
+    One BLOCK item per resource and day.
+
+    Args:
+        dept (str)
+        resources (list[dict]): Resources to block
+        first_day, last_day (str): YYYY-MM-DD, inclusive
+        start_minutes, end_minutes (int): Daily window in minutes after midnight, end up to 1440
+        weekdays (set[int]): Days of the week to block, Monday is 0
+        title (str): Shown on the calendar
+        uni (str): Department admin creating the blocks
+
+    Returns:
+        list of items
+    """
+    first = arrow.get(first_day, 'YYYY-MM-DD').replace(tzinfo=TIMEZONE)
+    last = arrow.get(last_day, 'YYYY-MM-DD').replace(tzinfo=TIMEZONE)
+    if last < first:
+        raise BlockRequestError('The last day is before the first day.')
+    # Blocks must fit in a day, `query_blocks` only looks MAX_BLOCK_SECONDS back for them
+    if not 0 <= start_minutes < end_minutes <= 1440:
+        raise BlockRequestError('The daily end time must be after the start time.')
+
+    days = [day for day in arrow.Arrow.range('day', first, last) if day.weekday() in weekdays]
+    if len(days) * len(resources) > MAX_BLOCKS:
+        raise BlockRequestError(f'At most {MAX_BLOCKS} blocks can be created at once.')
+
+    timestamp = get_local_ISO_timestamp()
+    items = []
+    for day in days:
+        start = datetime_to_EST(day_time(day, start_minutes))
+        end = datetime_to_EST(day_time(day, end_minutes))
+        epochs = event_epochs(start, end)
+        for resource in resources:
+            items.append({
+                'PK': f'BLOCK#{dept}',
+                'SK': f"{resource['id']}#{uuid4()}",
+                'start': start,
+                'end': end,
+                'startEpoch': epochs['startEpoch'],
+                'endEpoch': epochs['endEpoch'],
+                'resourceId': resource['id'],
+                'resourceName': f"{resource.get('room', '')} - {resource.get('title', '')}",
+                'title': title,
+                'active': True,
+                'createdOn': timestamp,
+                'createdBy': uni,
+                'dept': dept,
+            })
+
+    return items
+
+
+def find_conflicts(blocks, events):
+    """
+    Events that overlap any of the blocks of their resource, in one sweep over both sorted by resource
+    and start. Blocks of a resource must not overlap each other; an event ending when a block starts
+    does not conflict with it.
+
+    Returns:
+        list of conflicting events
+    """
+    by_resource = defaultdict(list)
+    for block in blocks:
+        by_resource[block['resourceId']].append((block['startEpoch'], block['endEpoch']))
+    for intervals in by_resource.values():
+        intervals.sort()
+
+    conflicts = []
+    position = defaultdict(int)
+    for event in sorted(events, key=lambda e: (e['resourceId'], e['startEpoch'])):
+        intervals = by_resource.get(event['resourceId'])
+        if not intervals:
+            continue
+
+        # Blocks ending before this event also end before every later event of the resource
+        i = position[event['resourceId']]
+        while i < len(intervals) and intervals[i][1] <= event['startEpoch']:
+            i += 1
+        position[event['resourceId']] = i
+
+        if i < len(intervals) and intervals[i][0] < event['endEpoch']:
+            conflicts.append(event)
+
+    return conflicts
+
+
+def create_blocks(dept, resource_ids, first_day, last_day, start_minutes, end_minutes, weekdays, title, uni,
+                  cancel=False):
+    """
+    Blocks off `resource_ids` of the department, see `block_items`. Blocks identical to existing ones
+    are skipped, so a request can be repeated.
+
+    If active events conflict with the blocks, nothing is written unless `cancel` is set, in which case
+    the conflicting events are deactivated first.
+
+    Returns:
+        dict with `blocks` (number written), `conflicts` (conflicting events), `cancelled` and `failed`
+        (keys of the conflicting events that were or could not be deactivated)
+    """
+    resources = {resource['id']: resource for resource in query_resources(dept)}
+    unknown = [resource_id for resource_id in resource_ids if resource_id not in resources]
+    if unknown or not resource_ids:
+        raise BlockRequestError(f"Unknown resources: {', '.join(unknown)}" if unknown else 'No resources selected.')
+
+    blocks = block_items(dept, [resources[resource_id] for resource_id in dict.fromkeys(resource_ids)],
+                         first_day, last_day, start_minutes, end_minutes, weekdays, title, uni)
+    result = {'blocks': 0, 'conflicts': [], 'cancelled': [], 'failed': []}
+    if not blocks:
+        return result
+
+    lower = min(block['startEpoch'] for block in blocks)
+    upper = max(block['endEpoch'] for block in blocks)
+
+    # Blocks made by hand may lack any of these
+    existing = {(b.get('resourceId'), b.get('startEpoch'), b.get('endEpoch')) for b in query_blocks(dept, lower, upper)}
+    blocks = [b for b in blocks if (b['resourceId'], b['startEpoch'], b['endEpoch']) not in existing]
+
+    events = query_events(
+        dept,
+        Key('startEpoch').between(lower - MAX_EVENT_SECONDS, upper),
+        FilterExpression=Attr('active').eq(True),
+    )
+    conflicts = find_conflicts(blocks, events)
+    result['conflicts'] = conflicts
+
+    changes = []
+    if conflicts:
+        if not cancel:
+            return result
+
+        done, failed = deactivate_events([{'PK': e['PK'], 'SK': e['SK']} for e in conflicts])
+        result['cancelled'] = done
+        result['failed'] = failed
+        changes.extend(('delete', key) for key in done)
+
+        # Blocking a time that still has a reservation would hide it
+        if failed:
+            record_changes(dept, changes)
+            return result
+
+    result['blocks'] = batch_put_items(blocks)
+    changes.extend(('create', block) for block in blocks)
+    record_changes(dept, changes)
+
+    return result
@@ -0,0 +1,165 @@
+"""
+Conflict-free booking of resources.
+
+A reservation is claimed with one transaction that writes the event and increments the resource's lock
+version (LOCK#{dept} / resourceId), conditioned on the version read before the resource's events were
+checked for overlaps. Two requests that checked the same resource at the same time cannot both succeed:
+the second one's condition fails and it moves on (or reports the overlap) instead of double-booking.
+Moving an existing reservation (`event_modify`) does not take the lock. Reservations that would exceed
+one of the user's quotas raise `QuotaExceeded` (see `app.utils.quotas`), reservations longer than
+MAX_EVENT_SECONDS raise `EventTooLong`.
+
+"Any room" bookings check every resource of a room (the calendar's resource group) with one concurrent
+round of queries on the per-resource index, rank the free ones by ANY_ROOM_POLICY and claim them in that
+order until one succeeds:
+    best_fit: the resource whose free gap around the reservation is the smallest, so that long gaps
+              stay available for long reservations
+    lru: the resource whose last reservation before this one ended longest ago
+"""
+# Third party imports
+from flask import current_app
+
+# Local application imports
+from app.extensions import dynamo
+from app.utils.events import MAX_EVENT_SECONDS, check_event_length, resource_intervals
+from app.utils.quotas import transact_with_quotas
+from app.utils.scheduler import is_overlapping
+
+
+ANY_ROOM_POLICIES = ('best_fit', 'lru')
+
+# How far before and after a reservation neighbouring reservations are looked at for ranking
+NEIGHBOUR_SECONDS = 24 * 3600
+
+
+def lock_key(dept, resource_id):
+    return {'PK': f'LOCK#{dept}', 'SK': resource_id}
+
+
+def lock_versions(dept, resource_ids):
+    """Current lock version of each resource, 0 for resources that were never claimed"""
+    table_name = current_app.config['DB_SCHEDULING']
+
+    versions = dict.fromkeys(resource_ids, 0)
+    request = {table_name: {'Keys': [lock_key(dept, r) for r in resource_ids], 'ConsistentRead': True}}
+    while request:
+        response = dynamo.connection.batch_get_item(RequestItems=request)
+        for item in response['Responses'].get(table_name, []):
+            versions[item['SK']] = int(item['version'])
+        request = response.get('UnprocessedKeys')
+
+    return versions
+
+
+def claim(dept, item, version):
+    """
+    Writes the event `item` if its resource's lock version is still `version`, together with the user's
+    quota counters (see `app.utils.quotas`).
+
+    Raises:
+        QuotaExceeded
+
+    Returns:
+        True if the event was written, False if the resource was claimed by someone else in the meantime
+    """
+    table_name = current_app.config['DB_SCHEDULING']
+
+    return transact_with_quotas(dept, item['uni'], [
+        {
+            'Update': {
+                'TableName': table_name,
+                'Key': lock_key(dept, item['resourceId']),
+                'UpdateExpression': 'SET version = :next',
+                'ConditionExpression': 'attribute_not_exists(version) OR version = :seen'
+                                       if version == 0 else 'version = :seen',
+                'ExpressionAttributeValues': {':seen': version, ':next': version + 1},
+            }
+        },
+        {
+            'Put': {
+                'TableName': table_name,
+                'Item': item,
+            }
+        },
+    ], added=[item])
+
+
+def rank_free(resource_ids, intervals, epochs, policy):
+    """
+    Resources of `resource_ids` where `epochs` is free, best first by `policy` and then in the given order.
+    """
+    start, end = epochs['startEpoch'], epochs['endEpoch']
+
+    ranked = []
+    for order, resource_id in enumerate(resource_ids):
+        items = intervals[resource_id]
+        if is_overlapping(items, epochs):
+            continue
+
+        before = [item['endEpoch'] for item in items if item['endEpoch'] <= start]
+        if policy == 'lru':
+            # Blocks are not uses of the resource
+            used = [item['endEpoch'] for item in items
+                    if item['endEpoch'] <= start and item['PK'].startswith('EVENT#')]
+            rank = max(used + [start - NEIGHBOUR_SECONDS])
+        else:
+            after = [item['startEpoch'] for item in items if item['startEpoch'] >= end]
+            rank = min(after + [end + NEIGHBOUR_SECONDS]) - max(before + [start - NEIGHBOUR_SECONDS])
+
+        ranked.append((rank, order, resource_id))
+
+    return [resource_id for _, _, resource_id in sorted(ranked)]
+
+
+def book(dept, item):
+    """
+    Writes the event `item` unless it overlaps an event or block of its resource.
+
+    Raises:
+        EventTooLong, QuotaExceeded
+
+    Returns:
+        True if the event was written
+    """
+    check_event_length(item)
+
+    resource_id = item['resourceId']
+    version = lock_versions(dept, [resource_id])[resource_id]
+    items = resource_intervals(dept, [resource_id], item['startEpoch'] - MAX_EVENT_SECONDS, item['endEpoch'])[resource_id]
+
+    return not is_overlapping(items, item) and claim(dept, item, version)
+
+
+def book_any(dept, resources, epochs, make_item, policy=None):
+    """
+    Writes an event on the best free resource of `resources`, see the module docstring.
+
+    Args:
+        dept (str)
+        resources (list[dict]): Resources of one room, in natural order
+        epochs (dict): `startEpoch` and `endEpoch` of the event
+        make_item (function): Returns the event item for a resource
+        policy (str, optional): One of `ANY_ROOM_POLICIES`, ANY_ROOM_POLICY by default
+
+    Raises:
+        EventTooLong, QuotaExceeded
+
+    Returns:
+        The event item that was written, or None if none of the resources is free
+    """
+    policy = policy or current_app.config['ANY_ROOM_POLICY']
+    resource_ids = [resource['id'] for resource in resources]
+    by_id = {resource['id']: resource for resource in resources}
+
+    check_event_length(epochs)
+
+    versions = lock_versions(dept, resource_ids)
+    intervals = resource_intervals(dept, resource_ids, epochs['startEpoch'] - max(MAX_EVENT_SECONDS, NEIGHBOUR_SECONDS),
+                                   epochs['endEpoch'] + NEIGHBOUR_SECONDS)
+
+    for resource_id in rank_free(resource_ids, intervals, epochs, policy):
+        item = make_item(by_id[resource_id])
+        if claim(dept, item, versions[resource_id]):
+            return item
+
+    return None
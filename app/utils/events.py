@@ -0,0 +1,661 @@
+"""
+Event data access helpers shared by the scheduler blueprints.
+"""
+# Standard library imports
+import heapq
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+from uuid import uuid4
+
+# Third party imports
+import arrow
+from flask import current_app
+from flask.json import dumps as json_dumps
+from boto3.dynamodb.conditions import Attr, Key
+from itsdangerous.exc import BadSignature
+
+# Local application imports
+from app.extensions import dynamo, event_store, limits, pubsub, shared_cache
+from app.utils.quotas import dept_quotas, update_counted_event
+from app.utils.scheduler import decimal_conversion, datetime_to_epoch, get_local_ISO_timestamp
+
+
+# DynamoDB limits on the number of actions in a single TransactWriteItems and BatchWriteItem call
+TRANSACT_MAX_ITEMS = 25
+BATCH_WRITE_MAX_ITEMS = 25
+
+# GSIs with the UTC epoch sort key `startEpoch`; ISO strings with UTC offsets do not sort by time across DST changes
+START_INDEX = 'startEpoch-index'
+RESOURCE_START_INDEX = 'resourceId-startEpoch-index'
+
+# GSI over the user's events: partition key `uni`, sort key `history` (see `history_key`)
+HISTORY_INDEX = 'uni-history-index'
+HISTORY_STATUSES = ('upcoming', 'past', 'deleted')
+HISTORY_PAGE_SIZE = 20
+
+# Largest timestamp that fits the 10 digits of `history_key`
+EPOCH_MAX = 9999999999
+
+# Longest reservation. Events are only found by their start, so queries for the events overlapping a time
+# start this far before it.
+MAX_EVENT_SECONDS = 7 * 24 * 3600
+
+# Longest block in BLOCK#{dept}, one day's window (see `app.utils.blocks`) including the day the clocks go back.
+# Longer blocks, and blocks without epochs, are kept in BLOCK#{dept}#LONG, see `query_blocks`
+MAX_BLOCK_SECONDS = 25 * 3600
+
+# Runs the per-partition queries of sharded departments and other independent queries concurrently
+partition_executor = ThreadPoolExecutor(max_workers=16)
+
+
+def in_background(fn, *args, **kwargs):
+    """
+    Runs `fn(*args, **kwargs)` on `partition_executor` within the current application context, so that an independent
+    query runs while the request thread makes another one.
+
+    Returns:
+        Future of the result
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return fn(*args, **kwargs)
+
+    return partition_executor.submit(run)
+
+
+def event_partition(dept, SK):
+    """
+    Partition key of an event.
+
+    With EVENT_SHARDS > 1 a department's events are spread over that many partitions
+    (EVENT#{dept}#{n}, n derived from a hash of the SK), so that a busy department does not
+    concentrate all of its writes and reads on one partition. The SK never changes, so neither
+    does the partition when an event is moved to another time or resource.
+    """
+    shards = current_app.config['EVENT_SHARDS']
+    if shards <= 1:
+        return f'EVENT#{dept}'
+
+    return f'EVENT#{dept}#{zlib.crc32(SK.encode()) % shards}'
+
+
+def event_partitions(dept):
+    """
+    All partition keys that can hold the department's events. While EVENT_SHARDS_MIGRATING is set,
+    the unsharded EVENT#{dept} partition is included for events `flask reshard-events` has not moved yet.
+    """
+    shards = current_app.config['EVENT_SHARDS']
+    if shards <= 1:
+        return [f'EVENT#{dept}']
+
+    partitions = [f'EVENT#{dept}#{n}' for n in range(shards)]
+    if current_app.config['EVENT_SHARDS_MIGRATING']:
+        partitions.append(f'EVENT#{dept}')
+
+    return partitions
+
+
+def query_events(dept, start_condition=None, **kwargs):
+    """
+    Scatter-gather query of the department's events on `START_INDEX`: one paginated query per partition,
+    run concurrently, merged by `startEpoch`.
+
+    Args:
+        dept (str)
+        start_condition (boto3 condition, optional): Key condition on `startEpoch`
+        **kwargs: Additional query arguments, e.g. FilterExpression
+
+    Returns:
+        list of events ordered by `startEpoch`
+    """
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    def query(PK):
+        key_condition = Key('PK').eq(PK)
+        if start_condition is not None:
+            key_condition = key_condition & start_condition
+
+        query_kwargs = dict(kwargs, IndexName=START_INDEX, KeyConditionExpression=key_condition)
+        items = []
+        while True:
+            response = table.query(**query_kwargs)
+            items.extend(response['Items'])
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    partitions = event_partitions(dept)
+    if len(partitions) == 1:
+        return query(partitions[0])
+
+    results = list(partition_executor.map(query, partitions))
+
+    # An event being moved between partitions during a migration can be read from both
+    merged = {}
+    for item in heapq.merge(*results, key=itemgetter('startEpoch')):
+        merged.setdefault(item['SK'], item)
+
+    return list(merged.values())
+
+
+def long_blocks_PK(dept):
+    """Partition of the department's blocks that are longer than `MAX_BLOCK_SECONDS` or have no epochs"""
+    return f'BLOCK#{dept}#LONG'
+
+
+def is_long_block(block):
+    """True if `block` belongs to the `long_blocks_PK` partition"""
+    if 'startEpoch' not in block or 'endEpoch' not in block:
+        return True
+
+    return block['endEpoch'] - block['startEpoch'] > MAX_BLOCK_SECONDS
+
+
+def overlaps(item, lower, upper):
+    """True if `item` overlaps the epochs `lower` to `upper`, or has no epochs to tell"""
+    if 'startEpoch' not in item or 'endEpoch' not in item:
+        return True
+
+    return item['startEpoch'] <= upper and item['endEpoch'] >= lower
+
+
+def query_long_blocks(dept, lower, upper):
+    """
+    Returns the blocks of the department's `long_blocks_PK` partition that overlap the epochs `lower` to `upper`,
+    and all of those without epochs. The partition is read whole, it only holds the few blocks made by hand.
+    """
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    query_kwargs = {'KeyConditionExpression': Key('PK').eq(long_blocks_PK(dept))}
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return [item for item in items if overlaps(item, lower, upper)]
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_blocks(dept, lower, upper):
+    """
+    Returns the department's blocked-off times that overlap the epochs `lower` to `upper`.
+
+    Blocks of BLOCK#{dept} are at most one day long (see `app.utils.blocks`), so a department can have thousands
+    of them; only those starting up to `MAX_BLOCK_SECONDS` before `lower` are read, from `START_INDEX`. Longer
+    blocks and blocks without epochs are kept apart (`flask move-long-blocks` moves them) and are added from
+    `query_long_blocks`.
+    """
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    starts = Key('startEpoch').between(lower - MAX_BLOCK_SECONDS, upper)
+    query_kwargs = {
+        'IndexName': START_INDEX,
+        'KeyConditionExpression': Key('PK').eq(f'BLOCK#{dept}') & starts,
+        'FilterExpression': Attr('endEpoch').gte(lower),
+    }
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items + query_long_blocks(dept, lower, upper)
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def resource_events(resource_ids, lower, upper):
+    """Active events of each resource starting between the epochs `lower` and `upper`, from `RESOURCE_START_INDEX`"""
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    def query(resource_id):
+        query_kwargs = {
+            'IndexName': RESOURCE_START_INDEX,
+            'KeyConditionExpression': Key('resourceId').eq(resource_id) & Key('startEpoch').between(lower, upper),
+            'FilterExpression': Attr('active').eq(True),
+        }
+        items = []
+        while True:
+            response = table.query(**query_kwargs)
+            # The index has the resource's blocks too, those are read with `query_blocks`
+            items.extend(item for item in response['Items'] if not item['PK'].startswith('BLOCK#'))
+            if 'LastEvaluatedKey' not in response:
+                return items
+            query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return dict(zip(resource_ids, partition_executor.map(query, resource_ids)))
+
+
+def resource_intervals(dept, resource_ids, lower, upper):
+    """
+    Active events of each resource starting between the epochs `lower` and `upper` (`resource_events`), plus its
+    blocks that overlap them (`query_blocks`). Blocks without epochs cannot be compared with them and are left out.
+    """
+    blocks = in_background(query_blocks, dept, lower, upper)
+    intervals = resource_events(resource_ids, lower, upper)
+
+    for block in blocks.result():
+        if block.get('resourceId') in intervals and 'startEpoch' in block and 'endEpoch' in block:
+            intervals[block['resourceId']].append(block)
+
+    return intervals
+
+
+def load_event_data(dept, start, end, resource_ids=None):
+    """
+    Returns the department's active events starting between `start` and `end` and its blocked-off times
+    overlapping them, serialized to JSON. Concurrent identical calls share one execution, and only calls that reach DynamoDB
+    take a token from the department's rate limit (`limits.Throttled` is raised when there is none).
+
+    With `resource_ids` (resources of the department) only the events and blocks of these resources are
+    returned: the events read with one concurrent query per resource on `RESOURCE_START_INDEX`, the blocks
+    with `query_blocks` as without `resource_ids`.
+    """
+
+    def load():
+        # Served from memory when the window is within the event store's horizon
+        events = event_store.window(dept, start, end)
+
+        if events is not None and resource_ids is not None:
+            wanted = set(resource_ids)
+            events = [event for event in events if event.get('resourceId') in wanted]
+
+        elif resource_ids is not None:
+            limits.take_dept(dept)
+
+            wanted = set(resource_ids)
+            blocks = in_background(query_blocks, dept, datetime_to_epoch(start), datetime_to_epoch(end))
+            intervals = resource_events(resource_ids, datetime_to_epoch(start), datetime_to_epoch(end))
+            events = [item for items in intervals.values() for item in items]
+
+            events.extend(block for block in blocks.result() if block.get('resourceId') in wanted)
+
+        elif events is None:
+            limits.take_dept(dept)
+
+            # The blocks are queried while the events are, `query_blocks` itself does not use the executor
+            blocks = in_background(query_blocks, dept, datetime_to_epoch(start), datetime_to_epoch(end))
+            events = query_events(
+                dept,
+                Key('startEpoch').between(datetime_to_epoch(start), datetime_to_epoch(end)),
+                FilterExpression=Attr('active').eq(True)
+            )
+
+            events.extend(blocks.result())
+
+        # Dynamo returns numbers as Decimal objects, convert to integers with the default functions
+        return json_dumps(events, default=decimal_conversion)
+
+    ids = tuple(resource_ids) if resource_ids is not None else None
+    return limits.coalesce(('event_data', dept, start, end, ids), load)
+
+
+def sign_event_keys(events):
+    """
+    Adds a `token` attribute to every event: the event's PK and SK signed together as one compact
+    URL-safe string. The serializer is looked up once for the whole list, so templates can emit
+    the token directly instead of signing PK and SK separately per row.
+
+    Args:
+        events (list[dict])
+
+    Returns:
+        The same list, with `token` set on each event
+    """
+    s = current_app.config['SERIALIZER']
+    for event in events:
+        event['token'] = s.dumps((event['PK'], event['SK']))
+
+    return events
+
+
+def load_event_token(token):
+    """
+    Inverse of `sign_event_keys` for a single token.
+
+    Returns:
+        Key dict {'PK': ..., 'SK': ...} or None if the signature is invalid
+    """
+    s = current_app.config['SERIALIZER']
+    try:
+        PK, SK = s.loads(token)
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+    return {'PK': PK, 'SK': SK}
+
+
+def deactivate_events(keys, uni=None):
+    """
+    Deactivates (soft-deletes) many events using TransactWriteItems, one round trip per
+    `TRANSACT_MAX_ITEMS` events, with the chunks sent concurrently. The resource's client is used,
+    so keys and values are plain Python types like with `Table` calls.
+
+    Each update is conditioned on the event still being active and, if `uni` is given, belonging to `uni`.
+    If any condition fails, DynamoDB cancels the whole transaction; the failing keys are then dropped
+    and the rest of the chunk is retried once. A chunk that fails otherwise (e.g. throttled) is returned
+    as failed, so the caller can still record the chunks that were written. Events of departments with
+    quotas are deactivated one transaction each, with their owner's counters (see `app.utils.quotas`).
+
+    Args:
+        keys (list[dict]): Event keys as returned by `load_event_token`
+        uni (str, optional): UNI of the user making the request, None for department admins
+
+    Returns:
+        Tuple of (deactivated keys, failed keys)
+    """
+    client = dynamo.connection.meta.client
+    table_name = current_app.config['DB_SCHEDULING']
+    timestamp = get_local_ISO_timestamp()
+
+    def transact(chunk):
+        values = {':f': False, ':a': True, ':t': timestamp}
+        if uni is not None:
+            values[':uni'] = uni
+
+        client.transact_write_items(TransactItems=[
+            {
+                'Update': {
+                    'TableName': table_name,
+                    'Key': key,
+                    'UpdateExpression': 'SET active = :f, changedOn = :t, history = :h',
+                    'ConditionExpression': 'active = :a' if uni is None else 'uni = :uni AND active = :a',
+                    'ExpressionAttributeValues': dict(values, **{
+                        ':h': history_key(False, event_dept(key['PK']), timestamp),
+                    }),
+                }
+            } for key in chunk
+        ])
+
+    def deactivate(chunk):
+        try:
+            transact(chunk)
+            return chunk, []
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+        except client.exceptions.ClientError:
+            # E.g. throttled: only this chunk failed, other chunks may have been written and are recorded
+            return [], chunk
+
+        if len(reasons) != len(chunk):
+            return [], chunk
+
+        retry = []
+        failed = []
+        for key, reason in zip(chunk, reasons):
+            if reason.get('Code', 'None') == 'None':
+                retry.append(key)
+            else:
+                failed.append(key)
+
+        if retry:
+            try:
+                transact(retry)
+            except client.exceptions.ClientError:
+                return [], failed + retry
+
+        return retry, failed
+
+    app = current_app._get_current_object()
+
+    def deactivate_counted(keys):
+        # One at a time, as the events of a user share a future bookings counter
+        done, failed = [], []
+        with app.app_context():
+            for key in keys:
+                dept = event_dept(key['PK'])
+                update = {
+                    'UpdateExpression': 'SET active = :f, changedOn = :t, history = :h',
+                    'ExpressionAttributeValues': {
+                        ':f': False,
+                        ':t': timestamp,
+                        ':h': history_key(False, dept, timestamp),
+                    },
+                }
+                try:
+                    event = update_counted_event(dept, key, update, uni=uni)
+                except client.exceptions.ClientError:
+                    event = None
+                (done if event is not None else failed).append(key)
+
+        return done, failed
+
+    counted = [key for key in keys if dept_quotas(event_dept(key['PK']))]
+    keys = [key for key in keys if not dept_quotas(event_dept(key['PK']))]
+    chunks = [keys[i:i + TRANSACT_MAX_ITEMS] for i in range(0, len(keys), TRANSACT_MAX_ITEMS)]
+
+    counted_future = partition_executor.submit(deactivate_counted, counted)
+    results = list(partition_executor.map(deactivate, chunks)) + [counted_future.result()]
+
+    done = []
+    failed = []
+    for chunk_done, chunk_failed in results:
+        done.extend(chunk_done)
+        failed.extend(chunk_failed)
+
+    return done, failed
+
+
+def batch_put_items(items):
+    """
+    Writes many items with BatchWriteItem, `BATCH_WRITE_MAX_ITEMS` per request and the requests sent
+    concurrently. Unprocessed items are retried with exponential backoff.
+
+    Returns:
+        Number of items written
+    """
+    client = dynamo.connection.meta.client
+    table_name = current_app.config['DB_SCHEDULING']
+
+    def put(chunk):
+        requests = [{'PutRequest': {'Item': item}} for item in chunk]
+        for attempt in range(8):
+            response = client.batch_write_item(RequestItems={table_name: requests})
+            requests = response.get('UnprocessedItems', {}).get(table_name)
+            if not requests:
+                return len(chunk)
+            time.sleep(0.05 * 2 ** attempt)
+
+        raise RuntimeError(f'{len(requests)} items were not written')
+
+    chunks = [items[i:i + BATCH_WRITE_MAX_ITEMS] for i in range(0, len(items), BATCH_WRITE_MAX_ITEMS)]
+    return sum(partition_executor.map(put, chunks))
+
+
+def get_dept_version(dept):
+    """
+    Returns the department's change version: a counter incremented by every change to its events.
+    """
+    return get_dept_change(dept)[0]
+
+
+def get_dept_change(dept):
+    """
+    Read from the shared cache, where it is at most SHARED_CACHE_VERSION_TTL seconds old unless this
+    instance changed it since (see `bump_dept_version`).
+
+    Returns:
+        Tuple of the department's change version and the ISO8601 time of its last change (None before the first)
+    """
+    def load():
+        response = dynamo.tables[current_app.config['DB_SCHEDULING']].get_item(
+            Key={'PK': f'VERSION#{dept}', 'SK': 'VERSION'},
+        )
+        item = response.get('Item', {})
+
+        return [int(item.get('version', 0)), item.get('changedOn')]
+
+    version, changed_on = shared_cache.get_or_load(('dept-change', dept), load,
+                                                   ttl=current_app.config['SHARED_CACHE_VERSION_TTL'])
+    return version, changed_on
+
+
+def bump_dept_version(dept):
+    """Increments the department's change version, and writes it to the shared cache"""
+    response = dynamo.tables[current_app.config['DB_SCHEDULING']].update_item(
+        Key={'PK': f'VERSION#{dept}', 'SK': 'VERSION'},
+        UpdateExpression='ADD version :one SET changedOn = :t',
+        ExpressionAttributeValues={
+            ':one': 1,
+            ':t': get_local_ISO_timestamp(),
+        },
+        ReturnValues='ALL_NEW',
+    )
+    item = response['Attributes']
+
+    shared_cache.set(('dept-change', dept), [int(item['version']), item['changedOn']], version=int(item['version']))
+
+
+def fragment_cache_key(dept, *parts):
+    """
+    Key for cached template fragments that show the department's events (see `app.fragment_cache`).
+    It includes the department's change version, so it changes with every change to the events.
+    """
+    return (dept, get_dept_version(dept)) + parts
+
+
+def event_data_etag(dept):
+    """
+    ETag of the department's event windows (see `app.utils.http`), the same for every window: any change
+    to the department's events changes it. It is read before the events, and the event store catches up to
+    the current version before answering a window, so a change in between makes the tag older than the data
+    it is sent with, which only costs the client one extra download, but never newer.
+    """
+    return f'{dept}-{get_dept_version(dept)}'
+
+
+def record_change(dept, change, event):
+    """
+    Propagates a change that was written to DynamoDB: increments the department's change version,
+    updates this process' event store and publishes the change to open calendars.
+
+    Args:
+        dept (str)
+        change (str): 'create', 'modify' or 'delete'
+        event (dict): Full item for 'create', PK/SK plus changed attributes otherwise
+    """
+    record_changes(dept, [(change, event)])
+
+
+def record_changes(dept, changes):
+    """`record_change` for many changes of one department, with a single version increment"""
+    bump_dept_version(dept)
+
+    for change, event in changes:
+        event_store.apply(dept, change, event)
+
+        if change == 'create':
+            event = {k: event[k] for k in ('PK', 'SK', 'start', 'end', 'resourceId', 'title', 'uni') if k in event}
+        pubsub.publish(dept, change, event)
+
+
+def history_key(active, dept, timestamp):
+    """
+    Composite sort key of `HISTORY_INDEX`: status, department and a timestamp.
+    The timestamp is the start time for active events and the deletion time for deactivated ones,
+    stored as zero-padded UTC epoch seconds so that string order is time order.
+
+    Putting the status first lets a key condition select only active (or only deleted) events,
+    and putting the timestamp last keeps each status/department range in time order.
+    """
+    status = 'ACTIVE' if active else 'INACTIVE'
+    return f'{status}#{dept}#{datetime_to_epoch(timestamp):010d}'
+
+
+def new_event_item(dept, uni, resource_id, resource_name, start, end):
+    """Item of a new reservation of `uni` from the ISO8601 timestamps `start` to `end`"""
+    SK = f'{resource_id}#{uuid4()}'
+
+    return dict(
+        event_epochs(start, end),
+        PK=event_partition(dept, SK),
+        SK=SK,
+        start=start,
+        end=end,
+        resourceId=resource_id,
+        resourceName=resource_name,
+        title=uni,
+        uni=uni,
+        active=True,
+        createdOn=get_local_ISO_timestamp(),
+        changedOn='',
+        dept=dept,
+        history=history_key(True, dept, start),
+    )
+
+
+class EventTooLong(ValueError):
+    """A reservation is longer than `MAX_EVENT_SECONDS`, the message is shown to the user"""
+
+
+def check_event_length(epochs):
+    """Raises EventTooLong if the `startEpoch` to `endEpoch` of `epochs` is longer than a reservation can be"""
+    if epochs['endEpoch'] - epochs['startEpoch'] > MAX_EVENT_SECONDS:
+        raise EventTooLong(f'Reservations can be at most {MAX_EVENT_SECONDS // 86400} days long.')
+
+
+def event_epochs(start, end):
+    """Epoch attributes stored with every EVENT/BLOCK item next to its ISO8601 `start` and `end`"""
+    return {'startEpoch': datetime_to_epoch(start), 'endEpoch': datetime_to_epoch(end)}
+
+
+def event_dept(PK):
+    """Department part of an event's PK (EVENT#{dept} or EVENT#{dept}#{shard})"""
+    return PK.split('#')[1]
+
+
+def query_user_history(uni, dept, status='upcoming', cursor=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Returns one page of a user's events in a department using keyset pagination on `HISTORY_INDEX`.
+
+        upcoming: active events starting today or later, soonest first
+        past: active events that started before today, most recent first
+        deleted: deactivated events, most recently deleted first
+
+    Args:
+        uni (str)
+        dept (str)
+        status (str): One of `HISTORY_STATUSES`
+        cursor (str, optional): Signed cursor returned with the previous page
+        limit (int): Page size
+
+    Returns:
+        Tuple of (list of events, cursor for the next page or None)
+    """
+    s = current_app.config['SERIALIZER']
+    today = arrow.now('US/Eastern').floor('day')
+
+    if status == 'upcoming':
+        lower = history_key(True, dept, today)
+        upper = history_key(True, dept, EPOCH_MAX)
+        forward = True
+    elif status == 'past':
+        lower = history_key(True, dept, 0)
+        upper = history_key(True, dept, today.shift(seconds=-1))
+        forward = False
+    else:
+        lower = history_key(False, dept, 0)
+        upper = history_key(False, dept, EPOCH_MAX)
+        forward = False
+
+    query_kwargs = {}
+    if cursor:
+        query_kwargs['ExclusiveStartKey'] = s.loads(cursor)
+
+    response = dynamo.tables[current_app.config['DB_SCHEDULING']].query(
+        IndexName=HISTORY_INDEX,
+        KeyConditionExpression='uni = :uni AND history BETWEEN :lower AND :upper',
+        ExpressionAttributeValues={
+            ':uni': uni,
+            ':lower': lower,
+            ':upper': upper,
+        },
+        ScanIndexForward=forward,
+        Limit=limit,
+        **query_kwargs
+    )
+
+    next_key = response.get('LastEvaluatedKey')
+    return response['Items'], s.dumps(next_key) if next_key else None
@@ -0,0 +1,63 @@
+"""
+Conditional responses for the calendar feeds.
+
+Feeds are sent with an ETag and `Cache-Control: private, no-cache`: browsers, and the calendar's IndexedDB
+cache, keep them but revalidate them with If-None-Match before reuse, and an unchanged feed costs a 304
+without a body. Tags are weak because compression changes the bytes, not the content. Feeds that also
+have a Last-Modified time are fresh for clients that only send If-Modified-Since.
+"""
+# Third party imports
+from flask import current_app, request
+
+
+REVALIDATE = 'private, no-cache'
+
+
+def is_fresh(etag, last_modified=None):
+    """
+    True if the request's If-None-Match has `etag`, or if it has no If-None-Match and its If-Modified-Since
+    is not before `last_modified` (naive UTC datetime), i.e. the client's copy is current
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+
+    since = request.if_modified_since
+    return last_modified is not None and since is not None and last_modified.replace(microsecond=0) <= since
+
+
+def not_modified(etag, last_modified=None):
+    """Empty 304 response for a request with a current copy"""
+    response = current_app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = REVALIDATE
+    return response
+
+
+def revalidated_json(data, etag=None):
+    """
+    JSON response that clients revalidate before reuse.
+
+    Args:
+        data (str): Serialized JSON
+        etag (str): Entity tag, a hash of `data` by default
+
+    Returns:
+        The response, or a 304 response if the request's If-None-Match has the tag
+    """
+    return revalidated(data, 'application/json', etag)
+
+
+def revalidated(data, mimetype, etag=None, last_modified=None):
+    """`revalidated_json` for any type of body, optionally with a Last-Modified time (naive UTC datetime)"""
+    response = current_app.response_class(data, mimetype=mimetype)
+    if etag is None:
+        response.add_etag(weak=True)
+    else:
+        response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = REVALIDATE
+
+    return response.make_conditional(request)
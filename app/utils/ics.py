@@ -0,0 +1,178 @@
+"""
+iCalendar (.ics) subscription feeds, so that calendar clients rather than an open browser tab keep
+reservations in view.
+
+A feed is read-only and addressed by a token, its kind, department and subject signed with SERIALIZER:
+    user: a user's active reservations in the department, from `HISTORY_INDEX`
+    room: the events and blocked-off times of every resource of a room, one concurrent query per resource
+          on `RESOURCE_START_INDEX`
+Both cover PAST_DAYS before today to FUTURE_DAYS after it.
+
+Feeds are tagged with the department's change version and the day (the covered range moves at midnight),
+and last modified at the later of the department's last change and midnight, so polling clients mostly get
+a 304. Bodies are kept in the fragment cache per feed and tag, and each VEVENT per event and time of its
+last change, so a change rebuilds a feed from mostly cached events.
+"""
+# Third party imports
+import arrow
+from flask import current_app
+from boto3.dynamodb.conditions import Key
+from itsdangerous.exc import BadSignature
+
+# Local application imports
+from app.extensions import dynamo, fragment_cache, limits
+from app.utils.events import HISTORY_INDEX, get_dept_change, history_key, resource_intervals
+from app.utils.resources import query_resources
+from app.utils.scheduler import datetime_to_epoch
+
+
+FEED_KINDS = ('user', 'room')
+
+PAST_DAYS = 30
+FUTURE_DAYS = 365
+
+# Content lines longer than this many octets are folded (RFC 5545, 3.1)
+LINE_OCTETS = 75
+
+
+def feed_token(kind, dept, subject):
+    """Token of the feed of `kind` for `subject` (uni or room name) in the department"""
+    return current_app.config['SERIALIZER'].dumps(('ics', kind, dept, subject))
+
+
+def load_feed_token(token):
+    """
+    Returns:
+        Tuple (kind, dept, subject), or None if the token is not a valid feed token
+    """
+    try:
+        prefix, kind, dept, subject = current_app.config['SERIALIZER'].loads(token)
+    except (BadSignature, TypeError, ValueError):
+        return None
+
+    if prefix != 'ics' or kind not in FEED_KINDS:
+        return None
+
+    return kind, dept, subject
+
+
+def feed_state(dept):
+    """
+    Returns:
+        Tuple of the feeds' ETag and Last-Modified time (naive UTC datetime) for the department
+    """
+    version, changed_on = get_dept_change(dept)
+    today = arrow.now('US/Eastern').floor('day')
+
+    last_modified = today if changed_on is None else max(today, arrow.get(changed_on))
+    return f'ics-{dept}-{version}-{today.format("YYYYMMDD")}', last_modified.to('UTC').naive
+
+
+def escape_text(value):
+    return (str(value).replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,')
+            .replace('\r\n', '\\n').replace('\n', '\\n'))
+
+
+def fold(line):
+    """Splits a content line into lines of at most `LINE_OCTETS` octets, continued by a leading space"""
+    parts = []
+    current = ''
+    for char in line:
+        limit = LINE_OCTETS if not parts else LINE_OCTETS - 1
+        if len((current + char).encode()) > limit:
+            parts.append(current)
+            current = ''
+        current += char
+    parts.append(current)
+
+    return '\r\n '.join(parts)
+
+
+def ics_time(epoch_or_timestamp):
+    return arrow.get(epoch_or_timestamp).to('UTC').format('YYYYMMDDTHHmmss') + 'Z'
+
+
+def vevent(event, host):
+    """VEVENT of an event or blocked-off time"""
+    blocked = event['PK'].startswith('BLOCK#')
+    summary = f"Blocked: {event.get('title', '')}" if blocked else event.get('title') or 'Reservation'
+
+    lines = [
+        'BEGIN:VEVENT',
+        f"UID:{event['SK']}@{host}",
+        f"DTSTAMP:{ics_time(event.get('changedOn') or event['createdOn'])}",
+        f"DTSTART:{ics_time(int(event['startEpoch']))}",
+        f"DTEND:{ics_time(int(event['endEpoch']))}",
+        f'SUMMARY:{escape_text(summary)}',
+        f"LOCATION:{escape_text(event.get('resourceName', ''))}",
+    ]
+    if not blocked and event.get('uni'):
+        lines.append(f"DESCRIPTION:{escape_text('Reserved by ' + event['uni'])}")
+    lines.append('END:VEVENT')
+
+    return '\r\n'.join(fold(line) for line in lines)
+
+
+def cached_vevent(event, host):
+    key = ('ics-event', event['SK'], event.get('changedOn') or event['createdOn'], host)
+    return fragment_cache.get_or_render(key, lambda: vevent(event, host))
+
+
+def query_user_events(dept, uni, lower, upper):
+    """The user's active events in the department starting between the arrow times `lower` and `upper`"""
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    history = Key('history').between(history_key(True, dept, lower), history_key(True, dept, upper))
+    query_kwargs = {
+        'IndexName': HISTORY_INDEX,
+        'KeyConditionExpression': Key('uni').eq(uni) & history,
+    }
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_room_events(dept, room, lower, upper):
+    """Active events and blocks of the room's resources starting between the arrow times `lower` and `upper`"""
+    resource_ids = [resource['id'] for resource in query_resources(dept) if resource.get('room') == room]
+    intervals = resource_intervals(dept, resource_ids, datetime_to_epoch(lower), datetime_to_epoch(upper))
+
+    return sorted((item for items in intervals.values() for item in items), key=lambda item: item['startEpoch'])
+
+
+def feed_body(kind, dept, subject, etag, host):
+    """
+    The feed's iCalendar text, from the fragment cache while `etag` is current. Building it takes a token
+    from the department's rate limit (`limits.Throttled` is raised when there is none).
+    """
+    def build():
+        limits.take_dept(dept)
+
+        today = arrow.now('US/Eastern').floor('day')
+        lower, upper = today.shift(days=-PAST_DAYS), today.shift(days=FUTURE_DAYS)
+
+        if kind == 'user':
+            events = query_user_events(dept, subject, lower, upper)
+            name = f'Room reservations of {subject}'
+        else:
+            events = query_room_events(dept, subject, lower, upper)
+            name = f'{subject} ({dept})'
+
+        lines = [
+            'BEGIN:VCALENDAR',
+            'VERSION:2.0',
+            'PRODID:-//Room Scheduler//EN',
+            'CALSCALE:GREGORIAN',
+            'METHOD:PUBLISH',
+            fold(f'X-WR-CALNAME:{escape_text(name)}'),
+        ]
+        lines.extend(cached_vevent(event, host) for event in events)
+        lines.append('END:VCALENDAR')
+
+        return '\r\n'.join(lines) + '\r\n'
+
+    return fragment_cache.get_or_render(('ics', kind, dept, subject, etag, host), build)
@@ -0,0 +1,223 @@
+"""
+Room occupancy analytics for global admins.
+
+The events of a date range are loaded once per department and turned into NumPy arrays of start and end
+epochs with the row (room) each one is in. Occupied seconds per room and time bucket are accumulated with
+`numpy.add.at`, and peak concurrency comes from one sort of all start/end points followed by a cumulative
+sum, so the cost grows with the number of events rather than rooms x buckets x events.
+
+Requires the `numpy` package; `occupancy_summary` raises RuntimeError without it.
+"""
+# Standard library imports
+from collections import defaultdict
+
+# Third party imports
+from flask import current_app
+from boto3.dynamodb.conditions import Attr, Key
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Local application imports
+from app.extensions import archive, dynamo
+from app.utils.events import MAX_EVENT_SECONDS, event_dept, query_events
+from app.utils.resources import resource_sort_key
+
+
+# Bounds the size of the matrix per room
+MAX_BUCKETS = 10000
+
+
+def load_rooms():
+    """
+    Returns:
+        dict of dept -> (list of room names in natural order, dict of resource id -> room index)
+    """
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    scan_kwargs = {'FilterExpression': Key('PK').begins_with('RESOURCE#')}
+    resources = []
+    while True:
+        response = table.scan(**scan_kwargs)
+        resources.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    by_dept = defaultdict(list)
+    for resource in resources:
+        by_dept[resource['PK'].split('#', 1)[1]].append(resource)
+
+    rooms = {}
+    for dept, dept_resources in by_dept.items():
+        names = []
+        rows = {}
+        for resource in sorted(dept_resources, key=lambda r: r.get('sortKey') or resource_sort_key(r)):
+            room = resource.get('room', '')
+            if room not in names:
+                names.append(room)
+            rows[resource['SK']] = names.index(room)
+        rooms[dept] = (names, rows)
+
+    return rooms
+
+
+def event_arrays(events, rows):
+    """
+    Args:
+        events (list[dict]): Events with `resourceId`, `startEpoch` and `endEpoch`
+        rows (dict): Resource id -> row, events of other resources are left out
+
+    Returns:
+        Tuple of int64 arrays (starts, ends, rows)
+    """
+    known = [e for e in events if e['resourceId'] in rows]
+
+    starts = numpy.fromiter((int(e['startEpoch']) for e in known), dtype=numpy.int64, count=len(known))
+    ends = numpy.fromiter((int(e['endEpoch']) for e in known), dtype=numpy.int64, count=len(known))
+    event_rows = numpy.fromiter((rows[e['resourceId']] for e in known), dtype=numpy.int64, count=len(known))
+
+    return starts, ends, event_rows
+
+
+def occupancy_matrix(starts, ends, rows, n_rows, lower, upper, bucket):
+    """
+    Occupied seconds per row and time bucket: the sum over the row's events of their overlap with the bucket.
+    Buckets are `bucket` seconds long from `lower`; events are clipped to [lower, upper).
+
+    Returns:
+        int64 array of shape (n_rows, number of buckets)
+    """
+    n_buckets = -(-(upper - lower) // bucket)
+    seconds = numpy.zeros((n_rows, n_buckets + 1), dtype=numpy.int64)
+
+    starts = numpy.clip(starts, lower, upper)
+    ends = numpy.clip(ends, lower, upper)
+    inside = ends > starts
+    starts, ends, rows = starts[inside], ends[inside], rows[inside]
+
+    first = (starts - lower) // bucket
+    last = (ends - 1 - lower) // bucket
+
+    # Events within one bucket
+    single = first == last
+    numpy.add.at(seconds, (rows[single], first[single]), (ends - starts)[single])
+
+    # Events over several buckets: the partial first and last buckets...
+    rows, starts, ends, first, last = (a[~single] for a in (rows, starts, ends, first, last))
+    numpy.add.at(seconds, (rows, first), lower + (first + 1) * bucket - starts)
+    numpy.add.at(seconds, (rows, last), ends - (lower + last * bucket))
+
+    # ...and the buckets in between, as +1/-1 steps summed along the time axis
+    full = numpy.zeros_like(seconds)
+    numpy.add.at(full, (rows, first + 1), 1)
+    numpy.add.at(full, (rows, last), -1)
+    seconds += numpy.cumsum(full, axis=1) * bucket
+
+    return seconds[:, :n_buckets]
+
+
+def peak_concurrency(starts, ends, rows, n_rows):
+    """
+    Largest number of events that overlap at any time, per row. An event ending when another starts
+    does not overlap it.
+
+    Returns:
+        Tuple of int64 arrays (peaks, peak times as epochs, 0 for rows without events)
+    """
+    times = numpy.concatenate([starts, ends])
+    steps = numpy.concatenate([numpy.ones_like(starts), -numpy.ones_like(ends)])
+    point_rows = numpy.concatenate([rows, rows])
+
+    # By row, then time, ends before starts at the same time
+    order = numpy.lexsort((steps, times, point_rows))
+    times, steps, point_rows = times[order], steps[order], point_rows[order]
+
+    # Every row's steps sum to 0, so the running total starts over at each row
+    running = numpy.cumsum(steps)
+
+    peaks = numpy.zeros(n_rows, dtype=numpy.int64)
+    numpy.maximum.at(peaks, point_rows, running)
+
+    # First point of each row after sorting by row and descending running total
+    by_peak = numpy.lexsort((-running, point_rows))
+    peak_rows, first = numpy.unique(point_rows[by_peak], return_index=True)
+    peak_times = numpy.zeros(n_rows, dtype=numpy.int64)
+    peak_times[peak_rows] = times[by_peak][first]
+
+    return peaks, peak_times
+
+
+def dept_summary(events, rooms, rows, lower, upper, bucket):
+    """Heatmap and peak concurrency of one department's events, see `occupancy_summary`"""
+    starts, ends, event_rows = event_arrays(events, rows)
+    n_rooms = len(rooms)
+
+    capacity = numpy.bincount(numpy.fromiter(rows.values(), dtype=numpy.int64), minlength=n_rooms)
+    seconds = occupancy_matrix(starts, ends, event_rows, n_rooms, lower, upper, bucket)
+    utilization = seconds / (capacity[:, None] * bucket)
+
+    room_peaks, room_peak_times = peak_concurrency(starts, ends, event_rows, n_rooms)
+    dept_peaks, dept_peak_times = peak_concurrency(starts, ends, numpy.zeros_like(event_rows), 1)
+
+    by_bucket = seconds.sum(axis=0) / (capacity.sum() * bucket)
+    busiest = int(by_bucket.argmax()) if by_bucket.size else 0
+
+    return {
+        'rooms': [
+            {
+                'room': room,
+                'capacity': int(capacity[i]),
+                'utilization': round(float(seconds[i].sum() / (capacity[i] * (upper - lower))), 4),
+                'peak': int(room_peaks[i]),
+                'peakAt': int(room_peak_times[i]) or None,
+            } for i, room in enumerate(rooms)
+        ],
+        'heatmap': numpy.round(utilization, 3).tolist(),
+        'capacity': int(capacity.sum()),
+        'bookedHours': round(float(seconds.sum()) / 3600, 1),
+        'utilization': round(float(seconds.sum() / (capacity.sum() * (upper - lower))), 4),
+        'peak': int(dept_peaks[0]),
+        'peakAt': int(dept_peak_times[0]) or None,
+        'busiestBucket': lower + busiest * bucket,
+    }
+
+
+def occupancy_summary(lower, upper, bucket):
+    """
+    Occupancy of every department's rooms between the epochs `lower` and `upper`, including archived events.
+
+    Args:
+        lower, upper (int): Epoch range
+        bucket (int): Seconds per heatmap column
+
+    Returns:
+        dict with `bucketStart` and `bucketSeconds`, and `depts`: dept -> dict of
+            rooms: per room `room`, `capacity` (resources), `utilization` (booked share of the
+                   capacity over the range), `peak` (most concurrent bookings) and `peakAt` (epoch)
+            heatmap: rooms x buckets list of the booked share of each room's capacity
+            capacity, bookedHours, utilization, peak, peakAt: the same for the whole department
+            busiestBucket: start epoch of the bucket with the highest utilization
+    """
+    if numpy is None:
+        raise RuntimeError('Occupancy analytics need the numpy package')
+
+    start_condition = Key('startEpoch').between(lower - MAX_EVENT_SECONDS, upper)
+    archived = defaultdict(list)
+    if lower - MAX_EVENT_SECONDS < archive.cutoff():
+        for event in archive.query(lower - MAX_EVENT_SECONDS, upper, active=True):
+            archived[event_dept(event['PK'])].append(event)
+
+    depts = {}
+    for dept, (rooms, rows) in sorted(load_rooms().items()):
+        events = query_events(dept, start_condition, FilterExpression=Attr('active').eq(True))
+
+        # Events archived while the table was being queried are returned by both
+        keys = {event['SK'] for event in events}
+        events.extend(event for event in archived[dept] if event['SK'] not in keys)
+
+        depts[dept] = dept_summary(events, rooms, rows, lower, upper, bucket)
+
+    return {'bucketStart': lower, 'bucketSeconds': bucket, 'depts': depts}
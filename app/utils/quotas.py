@@ -0,0 +1,264 @@
+"""
+Per-user booking quotas.
+
+BOOKING_QUOTAS caps, per department (or '*' for departments not listed):
+    weekly_hours: hours of reservations starting in one week (Monday to Sunday, US/Eastern)
+    future_bookings: active reservations that have not ended yet
+
+Usage is kept in counter items next to the events, written in the same TransactWriteItems as the
+reservation they count, so a quota check costs no query of the user's events and two concurrent
+reservations cannot both take the last free slot:
+    QUOTA#{dept} / {uni}#WEEK#{YYYY-Www}: `seconds` reserved in the week, incremented with ADD conditioned
+        on the cap not being exceeded
+    QUOTA#{dept} / {uni}#FUTURE: `ends`, a map of the SK to the end epoch of each reservation that had not
+        ended when the item was last written, replaced as a whole and conditioned on its `version`;
+        reservations that ended since are dropped on each write
+
+Moving a reservation counts it from its new time instead of its old one, deleting it stops counting it.
+Counters of a department must be rebuilt with `flask rebuild-quotas` when its quotas are first configured,
+as reservations made before are not counted.
+"""
+# Standard library imports
+from collections import defaultdict
+
+# Third party imports
+import arrow
+from flask import current_app
+from boto3.dynamodb.conditions import Key
+
+# Local application imports
+from app.extensions import dynamo
+from app.utils.scheduler import datetime_to_epoch
+
+
+QUOTA_KINDS = ('weekly_hours', 'future_bookings')
+
+TIMEZONE = 'US/Eastern'
+
+# Attempts of a write whose future bookings counter was changed by a concurrent write of the same user
+RETRIES = 3
+
+
+class QuotaExceeded(Exception):
+    """A reservation would exceed one of the user's quotas, the message is shown to the user"""
+
+
+def dept_quotas(dept):
+    """The department's caps, see the module docstring; empty if it has none"""
+    quotas = current_app.config['BOOKING_QUOTAS']
+    return quotas.get(dept, quotas.get('*', {}))
+
+
+def quota_week(epoch):
+    """ISO week of the epoch in US/Eastern, e.g. 2020-W42"""
+    year, week, _ = arrow.get(int(epoch)).to(TIMEZONE).isocalendar()
+    return f'{year}-W{week:02d}'
+
+
+def week_key(dept, uni, week):
+    return {'PK': f'QUOTA#{dept}', 'SK': f'{uni}#WEEK#{week}'}
+
+
+def future_key(dept, uni):
+    return {'PK': f'QUOTA#{dept}', 'SK': f'{uni}#FUTURE'}
+
+
+def read_future(dept, uni):
+    """
+    Returns:
+        Tuple of the version (0 for a new user) and the map of SK -> end epoch of the future bookings counter
+    """
+    item = dynamo.tables[current_app.config['DB_SCHEDULING']].get_item(
+        Key=future_key(dept, uni),
+        ConsistentRead=True,
+    ).get('Item', {})
+
+    return int(item.get('version', 0)), {SK: int(end) for SK, end in item.get('ends', {}).items()}
+
+
+def counter_updates(dept, uni, removed=(), added=()):
+    """
+    TransactWriteItems updates of the user's counters for a change that stops counting the events `removed`
+    and starts counting the events `added` (dicts with SK, startEpoch and endEpoch).
+
+    Raises:
+        QuotaExceeded if the change would exceed a quota according to the counters as they are now
+
+    Returns:
+        list of (kind, update) with kind one of `QUOTA_KINDS`
+    """
+    quotas = dept_quotas(dept)
+    table_name = current_app.config['DB_SCHEDULING']
+    updates = []
+
+    if 'weekly_hours' in quotas:
+        cap = int(quotas['weekly_hours'] * 3600)
+
+        weeks = defaultdict(int)
+        for event in removed:
+            weeks[quota_week(event['startEpoch'])] -= int(event['endEpoch']) - int(event['startEpoch'])
+        for event in added:
+            weeks[quota_week(event['startEpoch'])] += int(event['endEpoch']) - int(event['startEpoch'])
+
+        for week, seconds in sorted(weeks.items()):
+            if seconds > cap:
+                raise QuotaExceeded(f"Reservations are limited to {quotas['weekly_hours']} hours per week.")
+
+            update = {
+                'TableName': table_name,
+                'Key': week_key(dept, uni, week),
+                'UpdateExpression': 'ADD seconds :d',
+                'ExpressionAttributeValues': {':d': seconds},
+            }
+            if seconds > 0:
+                update['ConditionExpression'] = 'attribute_not_exists(seconds) OR seconds <= :room'
+                update['ExpressionAttributeValues'][':room'] = cap - seconds
+            if seconds:
+                updates.append(('weekly_hours', {'Update': update}))
+
+    if 'future_bookings' in quotas:
+        now = datetime_to_epoch(arrow.utcnow())
+        version, ends = read_future(dept, uni)
+
+        counted = len(ends)
+        ends = {SK: end for SK, end in ends.items() if end > now}
+        for event in removed:
+            ends.pop(event['SK'], None)
+        before = len(ends)
+        for event in added:
+            if int(event['endEpoch']) > now:
+                ends[event['SK']] = int(event['endEpoch'])
+
+        if len(ends) > before and len(ends) > quotas['future_bookings']:
+            raise QuotaExceeded(f"You can have at most {quotas['future_bookings']} upcoming reservations.")
+
+        if ends or counted:
+            updates.append(('future_bookings', {
+                'Update': {
+                    'TableName': table_name,
+                    'Key': future_key(dept, uni),
+                    'UpdateExpression': 'SET ends = :ends, version = :next',
+                    'ConditionExpression': 'attribute_not_exists(version)' if version == 0 else 'version = :seen',
+                    'ExpressionAttributeValues': dict({':ends': ends, ':next': version + 1},
+                                                      **({':seen': version} if version else {})),
+                }
+            }))
+
+    return updates
+
+
+def transact_with_quotas(dept, uni, transact_items, removed=(), added=()):
+    """
+    Writes `transact_items` in one TransactWriteItems with the updates of the user's counters for the change,
+    see `counter_updates`. Departments without quotas only write `transact_items`.
+
+    Raises:
+        QuotaExceeded
+
+    Returns:
+        True if written, False if a condition of `transact_items` failed
+    """
+    client = dynamo.connection.meta.client
+
+    for _ in range(RETRIES):
+        updates = counter_updates(dept, uni, removed, added)
+
+        try:
+            client.transact_write_items(TransactItems=list(transact_items) + [update for _, update in updates])
+            return True
+        except client.exceptions.TransactionCanceledException as e:
+            reasons = e.response.get('CancellationReasons', [])
+
+        failed = [i for i, reason in enumerate(reasons) if reason.get('Code', 'None') != 'None']
+        if not failed or failed[0] < len(transact_items):
+            return False
+
+        kind = updates[failed[0] - len(transact_items)][0]
+        if kind == 'weekly_hours':
+            quota = dept_quotas(dept)['weekly_hours']
+            raise QuotaExceeded(f'Reservations are limited to {quota} hours per week.')
+
+        # The future bookings counter was written by another request of the user, read it again
+
+    return False
+
+
+def update_counted_event(dept, key, update, epochs=None, uni=None):
+    """
+    Applies `update` to an active event in one transaction with its owner's counters, counting the event
+    from `epochs` instead of its current times, or no longer if `epochs` is None (the update deactivates it).
+
+    Args:
+        dept (str)
+        key (dict): PK and SK of the event
+        update (dict): UpdateExpression, ExpressionAttributeValues and optionally ExpressionAttributeNames
+        epochs (dict, optional): New `startEpoch` and `endEpoch`
+        uni (str, optional): The event must belong to this user
+
+    Raises:
+        QuotaExceeded
+
+    Returns:
+        The event before the update, or None if it is not active (or not `uni`'s) or was changed meanwhile
+    """
+    table_name = current_app.config['DB_SCHEDULING']
+    event = dynamo.tables[table_name].get_item(Key=key, ConsistentRead=True).get('Item')
+    if event is None or not event.get('active') or (uni is not None and event.get('uni') != uni):
+        return None
+
+    # The counters are adjusted for the times that were read
+    values = dict(update['ExpressionAttributeValues'], **{
+        ':quota_active': True,
+        ':quota_start': event['startEpoch'],
+        ':quota_end': event['endEpoch'],
+    })
+    item = dict(update, TableName=table_name, Key=key, ExpressionAttributeValues=values,
+                ConditionExpression='active = :quota_active AND startEpoch = :quota_start AND endEpoch = :quota_end')
+
+    added = [dict(event, **epochs)] if epochs is not None else []
+    if not transact_with_quotas(dept, event['uni'], [{'Update': item}], removed=[event], added=added):
+        return None
+
+    return event
+
+
+def rebuild_counters(dept, events):
+    """
+    Replaces the department's counters of the current and later weeks and its future bookings counters
+    by the usage of `events`, its active events starting from the current week on.
+
+    Returns:
+        Number of counter items written
+    """
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+    now = datetime_to_epoch(arrow.utcnow())
+    current_week = quota_week(now)
+
+    items = {}
+    query_kwargs = {'KeyConditionExpression': Key('PK').eq(f'QUOTA#{dept}')}
+    while True:
+        response = table.query(**query_kwargs)
+        for item in response['Items']:
+            if item['SK'].endswith('#FUTURE'):
+                items[item['SK']] = dict(item, ends={})
+            elif item['SK'].rsplit('#', 1)[1] >= current_week:
+                items[item['SK']] = dict(item, seconds=0)
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    for event in events:
+        start, end = int(event['startEpoch']), int(event['endEpoch'])
+        week = week_key(dept, event['uni'], quota_week(start))
+        items.setdefault(week['SK'], dict(week, seconds=0))['seconds'] += end - start
+        if end > now:
+            future = future_key(dept, event['uni'])
+            items.setdefault(future['SK'], dict(future, ends={}, version=0))['ends'][event['SK']] = end
+
+    with table.batch_writer() as batch:
+        for item in items.values():
+            if 'ends' in item:
+                item['version'] = int(item['version']) + 1
+            batch.put_item(Item=item)
+
+    return len(items)
@@ -0,0 +1,125 @@
+"""
+Resource data access helpers shared by the scheduler blueprints.
+
+Every RESOURCE item stores `sortKey`, its natural room/title order as a plain string (see `resource_sort_key`),
+so that DynamoDB returns a department's resources in order from `RESOURCE_ORDER_INDEX` and no natural
+sorting happens per request. Resources must be written with `put_resource`, or `flask sort-resources`
+must be run after editing them elsewhere: the index only contains items that have `sortKey`.
+
+The resource lists served to calendars are kept in the shared cache (`resource_list_json`), one copy for all
+worker processes of an instance. `put_resource` replaces its department's entry there with a list read
+consistently from the table, as the index may not have the change yet; other instances serve the previous
+list until it expires (SHARED_CACHE_TTL).
+
+Calendars of departments with many rooms page through them (`resource_page`), whole rooms at a time, and
+fetch the events of the resources on their pages only (`event_data` with `resourceIds`).
+"""
+# Standard library imports
+import json
+
+# Third party imports
+from flask import current_app
+from flask.json import dumps as json_dumps
+from boto3.dynamodb.conditions import Key
+
+# Local application imports
+from app.extensions import dynamo, shared_cache
+from app.utils.scheduler import natural_sort_key
+
+
+# GSI with partition key `PK` and sort key `sortKey`
+RESOURCE_ORDER_INDEX = 'PK-sortKey-index'
+
+# Separates room and title in `resource_sort_key`, sorts before the parts of `natural_sort_key`
+SORT_KEY_SEPARATOR = '\x01'
+
+# Largest page of `resource_page`, in rooms
+PAGE_MAX_ROOMS = 100
+
+# Most resources whose events are fetched in one `event_data` request
+MAX_RESOURCE_IDS = 500
+
+
+def resource_sort_key(resource):
+    """Sortable string of a resource's room and title in natural order, e.g. Room 900 before Room 1000"""
+    return natural_sort_key(resource.get('room', '')) + SORT_KEY_SEPARATOR + natural_sort_key(resource.get('title', ''))
+
+
+def query_resources(dept):
+    """Returns the department's resources ordered by room and title"""
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    query_kwargs = {
+        'IndexName': RESOURCE_ORDER_INDEX,
+        'KeyConditionExpression': Key('PK').eq(f'RESOURCE#{dept}'),
+    }
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def query_resources_consistent(dept):
+    """`query_resources` from a consistent read of the table instead of the index, e.g. right after a write"""
+    table = dynamo.tables[current_app.config['DB_SCHEDULING']]
+
+    query_kwargs = {
+        'KeyConditionExpression': Key('PK').eq(f'RESOURCE#{dept}'),
+        'ConsistentRead': True,
+    }
+    items = []
+    while True:
+        response = table.query(**query_kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            # Like the index, without the items that have no `sortKey`
+            return sorted((item for item in items if 'sortKey' in item), key=lambda item: item['sortKey'])
+        query_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def resource_list_json(dept):
+    """The department's resources as served to calendars, serialized to JSON, see the module docstring"""
+    return shared_cache.get_or_load(('resources', dept), lambda: json_dumps(query_resources(dept)),
+                                    ttl=current_app.config['SHARED_CACHE_TTL'])
+
+
+def resource_page(dept, offset, limit):
+    """
+    The resources of `limit` rooms from the `offset`th room on, serialized to JSON as
+    {"resources": [...], "rooms": number of rooms, "next": offset of the next page or null}
+    """
+    resources = json.loads(resource_list_json(dept))
+    rooms = list(dict.fromkeys(resource.get('room', '') for resource in resources))
+    page_rooms = set(rooms[offset:offset + limit])
+
+    return json_dumps({
+        'resources': [resource for resource in resources if resource.get('room', '') in page_rooms],
+        'rooms': len(rooms),
+        'next': offset + limit if offset + limit < len(rooms) else None,
+    })
+
+
+def dept_resource_ids(dept, resource_ids):
+    """The ids among `resource_ids` that are of the department's resources, without duplicates"""
+    known = {resource['id'] for resource in json.loads(resource_list_json(dept))}
+    return [resource_id for resource_id in dict.fromkeys(resource_ids) if resource_id in known]
+
+
+def put_resource(dept, resource):
+    """
+    Creates or replaces a resource, with its `sortKey`.
+
+    Args:
+        dept (str)
+        resource (dict): Resource attributes including `id`, `room` and `title`
+    """
+    item = dict(resource, PK=f'RESOURCE#{dept}', SK=resource['id'])
+    item['sortKey'] = resource_sort_key(item)
+
+    dynamo.tables[current_app.config['DB_SCHEDULING']].put_item(Item=item)
+    shared_cache.set(('resources', dept), json_dumps(query_resources_consistent(dept)))
+
+    return item
@@ -2,13 +2,20 @@
 Utils for the room scheduler.
 """
 # Standard library imports
+import re
 from decimal import Decimal
-from datetime import datetime
-from operator import itemgetter
 
 # Third party imports
 import arrow
-from natsort import natsorted
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Ends every text part of `natural_sort_key`
+NATURAL_TEXT_END = '\x02'
 
 
 def decimal_conversion(obj):
@@ -26,6 +33,11 @@ def datetime_to_EST(dt):
     return arrow.get(dt).to('US/Eastern').format('YYYY-MM-DDTHH:mm:ssZZ')
 
 
+def datetime_to_epoch(dt):
+    """Convert a datetime or ISO8601 string to integer seconds since the epoch"""
+    return int(arrow.get(dt).float_timestamp)
+
+
 def get_local_ISO_timestamp():
     """Returns current time converted to EDT/EST in ISO8601"""
     return datetime_to_EST(arrow.utcnow())
@@ -33,17 +45,16 @@ def get_local_ISO_timestamp():
 
 def is_overlapping(events, newEvent):
     """
-    Checks if `newEvent` overlaps with any events in `events` by converting start/end
-    timestamps to datetime objects and comparing.
-    In python 3.6 datetime cannot parse timezones with a colon, ignore the last 6 characters.
+    Checks if `newEvent` overlaps with any events in `events` by comparing their
+    `startEpoch`/`endEpoch` attributes (UTC seconds), so no timestamps are parsed.
     """
 
-    newEventStart = datetime.strptime(newEvent.get('start')[:-6], '%Y-%m-%dT%H:%M:%S')
-    newEventEnd = datetime.strptime(newEvent.get('end')[:-6], '%Y-%m-%dT%H:%M:%S')
+    newEventStart = newEvent['startEpoch']
+    newEventEnd = newEvent['endEpoch']
 
     for event in events:
-        eventStart = datetime.strptime(event['start'][:-6], '%Y-%m-%dT%H:%M:%S')
-        eventEnd = datetime.strptime(event['end'][:-6], '%Y-%m-%dT%H:%M:%S')
+        eventStart = event['startEpoch']
+        eventEnd = event['endEpoch']
 
         if (newEventStart > eventStart) & (newEventStart < eventEnd):
             # Start-time in between any of the events'
@@ -60,9 +71,29 @@ def is_overlapping(events, newEvent):
     return False
 
 
+def natural_sort_key(value):
+    """
+    String that sorts the way `natsorted` sorts `value`: text compares as text and runs of digits by their
+    numeric value, so 'Room 900' < 'Room 1000'. Text runs end with NATURAL_TEXT_END, which sorts before any
+    printable character, and numbers are prefixed with their length.
+    """
+    parts = []
+    for i, part in enumerate(re.split(r'([0-9]+)', str(value))):
+        if i % 2:
+            number = part.lstrip('0') or '0'
+            parts.append(f'{len(number):03d}{number}')
+        else:
+            parts.append(part + NATURAL_TEXT_END)
+
+    return ''.join(parts)
+
+
 def natmultisort(data, specs):
     """
-    "Natural" multisort
+    "Natural" multisort for orders that are not precomputed (see `app.utils.resources.resource_sort_key`)
+
+    The natural key of every attribute is computed once per item. With numpy installed, all specs are
+    sorted at once with `numpy.lexsort` on the ranks of the keys, otherwise with one stable sort per spec
     https://docs.python.org/3/howto/sorting.html#sort-stability-and-complex-sorts
 
     Args:
@@ -74,9 +105,19 @@ def natmultisort(data, specs):
     Returns:
         Sorted list[dict]
     """
-
-    temp = data
-    for key, reverse in reversed(specs):
-        temp = natsorted(temp, key=itemgetter(key), reverse=reverse)
-
-    return temp
+    data = list(data)
+    columns = [([natural_sort_key(item[key]) for item in data], reverse) for key, reverse in specs]
+
+    if numpy is not None and data:
+        # lexsort sorts by the last key first
+        ranks = []
+        for keys, reverse in reversed(columns):
+            _, inverse = numpy.unique(keys, return_inverse=True)
+            ranks.append(-inverse if reverse else inverse)
+        return [data[i] for i in numpy.lexsort(ranks)]
+
+    order = list(range(len(data)))
+    for keys, reverse in reversed(columns):
+        order.sort(key=keys.__getitem__, reverse=reverse)
+
+    return [data[i] for i in order]
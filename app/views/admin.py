@@ -10,7 +10,9 @@ from flask import (Blueprint,
                    url_for,
                    abort,
                    current_app,
-                   jsonify)
+                   jsonify,
+                   send_from_directory,
+                   session)
 from flask.json import dumps as json_dumps
 from flask_cas import login_required
 
@@ -19,9 +21,14 @@ from boto3.dynamodb.conditions import Attr, Key
 # Local application imports
 from app.users import User
 from app.logger import DynamoAccessLogger
-from app.extensions import dynamo
+from app.extensions import archive, compress, dynamo, fragment_cache, limits, profiler
 
-from app.utils.scheduler import decimal_conversion, natmultisort
+from app.utils.access_logs import query_access_counts, query_access_users
+from app.utils.events import in_background, query_events
+from app.utils.http import revalidated_json
+from app.utils.occupancy import MAX_BUCKETS, occupancy_summary
+from app.utils.resources import resource_sort_key
+from app.utils.scheduler import decimal_conversion, datetime_to_epoch
 
 bp = Blueprint('admin', __name__, url_prefix='/admin')
 logger = DynamoAccessLogger('admin')
@@ -58,17 +65,25 @@ def event_data():
     if current_user.is_admin():
 
         table_name = current_app.config['DB_SCHEDULING']
-        resp_events = dynamo.tables[table_name].scan(
+        lower = datetime_to_epoch(request.args.get('start'))
+        upper = datetime_to_epoch(request.args.get('end'))
+
+        # Blocks and past events that were moved out of the table are read while the events are scanned
+        table = dynamo.tables[table_name]
+        resp_notavailable = in_background(table.scan, FilterExpression=Key('PK').begins_with('BLOCK'))
+        archived = None
+        if lower < archive.cutoff():
+            archived = in_background(archive.query, lower, upper, active=True)
+
+        resp_events = table.scan(
             FilterExpression=Attr('PK').begins_with('EVENT') &
-                             Attr('start').between(request.args.get('start'), request.args.get('end')) &
+                             Attr('startEpoch').between(lower, upper) &
                              Attr('active').eq(True)
         )
 
-        resp_notavailable = dynamo.tables[table_name].scan(
-            FilterExpression=Key('PK').begins_with('BLOCK')
-        )
-
-        resp_events['Items'].extend(resp_notavailable['Items'])
+        resp_events['Items'].extend(resp_notavailable.result()['Items'])
+        if archived is not None:
+            resp_events['Items'].extend(archived.result())
 
         # Dynamo returns numbers as Decimal objects, convert to integers with the default functions
         return json_dumps(resp_events['Items'], default=decimal_conversion)
@@ -78,10 +93,10 @@ def event_data():
         abort(403)
 
 
-@bp.route('/resource_data', methods=['POST'])
+@bp.route('/resource_data', methods=['GET', 'POST'])
 def resource_data():
     """
-    Returns all resources for the user's department
+    Returns all resources for the user's department. Cacheable GET, tagged with a hash of the resources.
     """
     current_user = User()
 
@@ -92,9 +107,178 @@ def resource_data():
             FilterExpression=Key('PK').begins_with('RESOURCE')
         )
 
-        # Use natural sorting to make sure 900 comes before 1000, etc.
-        return jsonify(natmultisort(resp_resources['Items'], (('room', False), ('title', False))))
+        # Natural order (900 before 1000, etc.) by the stored sort key, see `resource_sort_key`
+        resources = resp_resources['Items']
+        resources = sorted(resources, key=lambda r: r.get('sortKey') or resource_sort_key(r))
+        return revalidated_json(json_dumps(resources))
 
     else:
         logger.log_access(success=False, route='resource_data')
         abort(403)
+
+
+@bp.route('/history')
+def history():
+    """
+    Returns a department's events, including deactivated ones, that started between `start` and `end`,
+    optionally of a single user. Ranges older than ARCHIVE_DAYS are read from the archive.
+    """
+    if not all(arg in request.args for arg in ('dept', 'start', 'end')):
+        logger.log_access(success=False, route='history', error='RequestArgs')
+        abort(400)
+
+    current_user = User()
+
+    if current_user.is_admin():
+
+        dept = request.args.get('dept')
+        uni = request.args.get('uni')
+        lower = datetime_to_epoch(request.args.get('start'))
+        upper = datetime_to_epoch(request.args.get('end'))
+
+        query_kwargs = {'FilterExpression': Attr('uni').eq(uni)} if uni else {}
+        events = query_events(dept, Key('startEpoch').between(lower, upper), **query_kwargs)
+
+        if lower < archive.cutoff():
+            equals = {'uni': uni} if uni else {}
+            archived = archive.query(lower, upper, dept=dept, **equals)
+
+            # Events archived while the table was being queried are returned by both
+            keys = {event['SK'] for event in events}
+            events = [event for event in archived if event['SK'] not in keys] + events
+
+        logger.log_access(success=True, route='history')
+        return json_dumps(events, default=decimal_conversion)
+
+    else:
+        logger.log_access(success=False, route='history')
+        abort(403)
+
+
+@bp.route('/access_stats')
+def access_stats():
+    """
+    Returns access counts between `start` and `end` from the access log rollups, per `by` ('day', 'hour'
+    or 'total') and optionally only for a `resource`, `route` or `success` ('true'/'false').
+    With `users=1`, returns the number of requests per user of `resource` instead.
+    """
+    if not ('start' in request.args and 'end' in request.args):
+        logger.log_access(success=False, route='access_stats', error='RequestArgs')
+        abort(400)
+
+    current_user = User()
+
+    if current_user.is_admin():
+
+        start = request.args.get('start')
+        end = request.args.get('end')
+
+        if request.args.get('users') == '1':
+            if 'resource' not in request.args:
+                abort(400)
+            return jsonify(users=query_access_users(start, end, request.args.get('resource')))
+
+        filters = {name: request.args.get(name) for name in ('resource', 'route') if name in request.args}
+        if 'success' in request.args:
+            filters['success'] = request.args.get('success') == 'true'
+
+        by = request.args.get('by', 'day')
+        rows, until = query_access_counts(start, end, None if by == 'total' else by, **filters)
+
+        return jsonify(rows=rows, compactedUntil=until)
+
+    else:
+        logger.log_access(success=False, route='access_stats')
+        abort(403)
+
+
+@bp.route('/occupancy')
+def occupancy():
+    """
+    Returns the occupancy heatmap and peak concurrency of every department's rooms between `start` and `end`,
+    in buckets of `bucket` seconds (default one hour), see `occupancy_summary`.
+    Summaries are cached per range and bucket for FRAGMENT_CACHE_TTL seconds.
+    """
+    if not ('start' in request.args and 'end' in request.args):
+        logger.log_access(success=False, route='occupancy', error='RequestArgs')
+        abort(400)
+
+    current_user = User()
+
+    if current_user.is_admin():
+
+        lower = datetime_to_epoch(request.args.get('start'))
+        upper = datetime_to_epoch(request.args.get('end'))
+        bucket = request.args.get('bucket', 3600, type=int)
+
+        if bucket < 60 or upper <= lower or (upper - lower) // bucket > MAX_BUCKETS:
+            logger.log_access(success=False, route='occupancy', error='RequestArgs')
+            abort(400)
+
+        try:
+            summary = fragment_cache.get_or_render(
+                ('occupancy', lower, upper, bucket),
+                lambda: json_dumps(occupancy_summary(lower, upper, bucket))
+            )
+        except RuntimeError as e:
+            logger.log_access(success=False, route='occupancy', error='NotAvailable')
+            return str(e), 501
+
+        logger.log_access(success=True, route='occupancy')
+        return current_app.response_class(summary, mimetype='application/json')
+
+    else:
+        logger.log_access(success=False, route='occupancy')
+        abort(403)
+
+
+@bp.route('/stats')
+def stats():
+    """
+    Returns this worker process' request coalescing, rate limiting and response compression counters
+    """
+    current_user = User()
+
+    if current_user.is_admin():
+
+        return jsonify(dict(limits.counters, compression=compress.stats()))
+
+    else:
+        logger.log_access(success=False, route='stats')
+        abort(403)
+
+
+@bp.route('/profile_token')
+def profile_token():
+    """
+    Returns the query parameter that profiles a request of the current admin, see `app.profiling`
+    """
+    current_user = User()
+
+    if current_user.is_admin():
+
+        return jsonify(param=current_app.config['PROFILE_PARAM'], token=profiler.token(session['CAS_USERNAME']))
+
+    else:
+        logger.log_access(success=False, route='profile_token')
+        abort(403)
+
+
+@bp.route('/profiles')
+@bp.route('/profiles/<name>')
+def profiles(name=None):
+    """
+    Returns the names of the saved request profiles, most recent first, or the report `name`
+    """
+    current_user = User()
+
+    if current_user.is_admin():
+
+        if name is None:
+            return jsonify(profiler.names())
+
+        return send_from_directory(current_app.config['PROFILE_DIR'], name, mimetype='text/html')
+
+    else:
+        logger.log_access(success=False, route='profiles')
+        abort(403)
@@ -3,6 +3,7 @@ Provides administrators with a way to export scheduler data.
 """
 
 # Third party imports
+import arrow
 from flask import (Blueprint,
                    render_template,
                    current_app,
@@ -12,9 +13,12 @@ from flask_cas import login_required
 from boto3.dynamodb.conditions import Attr
 
 # Local application imports
-from app.users import User
+from app.users import User, user_cache_key
 from app.logger import DynamoAccessLogger
-from app.extensions import dynamo
+from app.extensions import dynamo, shared_cache
+from app.fragment_cache import Deferred
+from app.utils.blocks import BlockRequestError, create_blocks
+from app.utils.events import fragment_cache_key, query_events
 from app.utils.scheduler import get_local_ISO_timestamp
 
 bp = Blueprint('dept_admin', __name__, url_prefix='/dept_admin')
@@ -29,17 +33,13 @@ def index():
     current_user = User()
     if current_user.is_dept_admin():
 
-        table_name = current_app.config['DB_SCHEDULING']
-        resp_events = dynamo.tables[table_name].query(
-            IndexName='start-index',
-            KeyConditionExpression='PK = :pk',
-            ExpressionAttributeValues={
-                ':pk': f'EVENT#{current_user.dept}',
-            },
-        )
+        dept = current_user.dept
 
+        # The rendered table is reused until the department's events change
         logger.log_access(success=True, route='booking_list')
-        return render_template('dept_admin.html', events=resp_events['Items'])
+        return render_template('dept_admin.html',
+                               bookings=Deferred(lambda: query_events(dept)),
+                               bookings_cache_key=fragment_cache_key(dept))
 
     else:
 
@@ -86,6 +86,7 @@ def add_users(add_list):
 
     success = 0
     errors = []
+    added = []
 
     if add_list:
         try:
@@ -107,11 +108,15 @@ def add_users(add_list):
                                 'added_on': get_local_ISO_timestamp()
                             }
                             batch.put_item(Item=user_item)
+                            added.append(user_params.get('uni').lower())
                             success += 1
                         except Exception:
                             errors.append(f'{user}\n')
         except connection.meta.client.exceptions.ClientError:
             return 'Unexpected error when adding.'
+        finally:
+            for uni in added:
+                shared_cache.discard(user_cache_key(uni))
 
     output = f'Added {success} user(s).'
     if errors:
@@ -146,6 +151,7 @@ def remove_users(remove_list):
                         }
                         # Only delete user its PK exists
                         table.delete_item(Key=user_item, ConditionExpression=Attr('PK').exists())
+                        shared_cache.discard(user_cache_key(user.lower()))
                         success += 1
                     except Exception:
                         errors.append(f'{user}\n')
@@ -183,3 +189,85 @@ def process_batch():
 
         logger.log_access(success=False, route='user_management_batch')
         return render_template('403.html')
+
+
+def parse_minutes(value):
+    """Minutes after midnight of an HH:MM time, 24:00 being the next midnight"""
+    try:
+        hours, minutes = (int(part) for part in value.split(':'))
+    except (AttributeError, ValueError):
+        raise BlockRequestError(f'Invalid time: {value}')
+
+    if not (0 <= hours <= 24 and 0 <= minutes < 60):
+        raise BlockRequestError(f'Invalid time: {value}')
+
+    return hours * 60 + minutes
+
+
+def parse_weekdays(value):
+    """Set of the days of the week in a list of them, Monday being 0"""
+    if not isinstance(value, list) or not all(type(day) is int and 0 <= day <= 6 for day in value):
+        raise BlockRequestError(f'Invalid weekdays: {value}')
+
+    return set(value)
+
+
+@bp.route('/blocks', methods=['POST'])
+@login_required
+def block_batch():
+    """
+    Blocks off many resources at once, one block per resource and day (see `app.utils.blocks`).
+
+    Payload should contain the following attributes:
+        resourceIds: list of resource ids of the department
+        firstDay, lastDay: YYYY-MM-DD, inclusive
+        startTime, endTime: daily HH:MM window, the whole day (00:00 to 24:00) by default
+        weekdays: days of the week to block, Monday is 0, every day by default
+        title: shown on the calendar, 'Not available' by default
+        cancelConflicts: if true, deactivates reservations that conflict with the blocks,
+                         otherwise nothing is written when there are any
+
+    Returns JSON with the number of blocks written, the conflicting reservations and the keys of those
+    that were or could not be cancelled. Conflicts that prevented the blocks are answered with 409.
+    """
+
+    current_user = User()
+    if current_user.is_dept_admin():
+
+        data = request.json or {}
+        if not isinstance(data, dict) or not isinstance(data.get('resourceIds', []), list):
+            logger.log_access(success=False, route='block_batch', error='RequestArgs')
+            return 'Invalid request.', 400
+
+        cancel = data.get('cancelConflicts') is True
+
+        try:
+            result = create_blocks(
+                current_user.dept,
+                [str(resource_id) for resource_id in data.get('resourceIds') or []],
+                str(data.get('firstDay', '')),
+                str(data.get('lastDay', '')),
+                parse_minutes(data.get('startTime', '00:00')),
+                parse_minutes(data.get('endTime', '24:00')),
+                parse_weekdays(data.get('weekdays', list(range(7)))),
+                str(data.get('title') or 'Not available'),
+                current_user.uni,
+                cancel=cancel,
+            )
+        except (BlockRequestError, arrow.parser.ParserError) as e:
+            logger.log_access(success=False, route='block_batch', error='RequestArgs')
+            return str(e), 400
+
+        conflicts = [
+            {k: e.get(k) for k in ('PK', 'SK', 'uni', 'resourceName', 'start', 'end')} for e in result['conflicts']
+        ]
+        blocked = not result['conflicts'] or (cancel and not result['failed'])
+
+        logger.log_access(success=blocked, route='block_batch')
+        return jsonify(blocks=result['blocks'], conflicts=conflicts,
+                       cancelled=result['cancelled'], failed=result['failed']), 200 if blocked else 409
+
+    else:
+
+        logger.log_access(success=False, route='block_batch')
+        return render_template('403.html')
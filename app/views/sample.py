@@ -2,11 +2,13 @@
 Sample calendar and admin tools that do not require auth.
 """
 # Standard library imports
-from uuid import uuid4
-from operator import itemgetter
+import math
 
 # Third party imports
+import arrow
 from flask import (Blueprint,
+                   Response,
+                   stream_with_context,
                    render_template,
                    request,
                    redirect,
@@ -14,7 +16,6 @@ from flask import (Blueprint,
                    current_app,
                    abort,
                    jsonify)
-from flask.json import dumps as json_dumps
 
 from boto3.dynamodb.conditions import Attr
 from itsdangerous.exc import BadSignature
@@ -22,13 +23,39 @@ from itsdangerous.exc import BadSignature
 # Local application imports
 from app.users import User
 from app.logger import DynamoAccessLogger
-from app.extensions import dynamo
-
-from app.utils.scheduler import (decimal_conversion,
-                                 datetime_to_EST,
-                                 get_local_ISO_timestamp,
-                                 is_overlapping,
-                                 natmultisort)
+from app.extensions import dynamo, limits, pubsub
+from app.limits import Throttled
+from app.fragment_cache import Deferred
+
+from app.utils.events import (HISTORY_STATUSES,
+                              HISTORY_PAGE_SIZE,
+                              EventTooLong,
+                              check_event_length,
+                              sign_event_keys,
+                              load_event_token,
+                              deactivate_events,
+                              history_key,
+                              event_dept,
+                              event_epochs,
+                              query_user_history,
+                              query_events,
+                              load_event_data,
+                              new_event_item,
+                              fragment_cache_key,
+                              event_data_etag,
+                              record_change,
+                              record_changes)
+from app.utils.booking import book, book_any
+from app.utils.quotas import QuotaExceeded, dept_quotas, update_counted_event
+from app.utils.http import is_fresh, not_modified, revalidated_json
+from app.utils.jinja_filters import datetime_humanize
+from app.utils.resources import (MAX_RESOURCE_IDS,
+                                 PAGE_MAX_ROOMS,
+                                 dept_resource_ids,
+                                 query_resources,
+                                 resource_list_json,
+                                 resource_page)
+from app.utils.scheduler import get_local_ISO_timestamp
 
 bp = Blueprint('sample', __name__, url_prefix='/sample')
 logger = DynamoAccessLogger('sample')
@@ -43,19 +70,14 @@ def index():
 
         logger.log_access(success=True, route='index')
 
-        table_name = current_app.config['DB_SCHEDULING']
-        resp_events = dynamo.tables[table_name].query(
-            IndexName='uni-PK-index',
-            KeyConditionExpression='uni = :uni AND PK = :pk',
-            ExpressionAttributeValues={
-                ':uni': current_user.uni,
-                ':pk': f'EVENT#{dept}',
-            },
-        )
+        # Only the first page of upcoming reservations, the rest is loaded from `event_history`.
+        # The rendered table is reused until the department's events change or the day changes.
+        def history():
+            events, cursor = query_user_history(current_user.uni, dept, 'upcoming')
+            return sign_event_keys(events), cursor
 
-        # Sort by start time
-        events = sorted(resp_events['Items'], key=itemgetter('start'))
-        return render_template('sample/sample_scheduler.html', events=events)
+        cache_key = fragment_cache_key(dept, current_user.uni, arrow.now('US/Eastern').format('YYYY-MM-DD'))
+        return render_template('sample/sample_scheduler.html', history=Deferred(history), history_cache_key=cache_key)
 
     else:
 
@@ -68,17 +90,12 @@ def dept_admin():
     current_user = User('sample_user')
     if current_user.is_dept_admin():
 
-        table_name = current_app.config['DB_SCHEDULING']
-        resp_events = dynamo.tables[table_name].query(
-            IndexName='start-index',
-            KeyConditionExpression='PK = :pk',
-            ExpressionAttributeValues={
-                ':pk': f'EVENT#{current_user.dept}',
-            },
-        )
+        dept = current_user.dept
 
         logger.log_access(success=True, route='booking_list')
-        return render_template('sample/sample_dept_admin.html', events=resp_events['Items'])
+        return render_template('sample/sample_dept_admin.html',
+                               bookings=Deferred(lambda: query_events(dept)),
+                               bookings_cache_key=fragment_cache_key(dept))
 
     else:
 
@@ -113,59 +130,77 @@ def user_management():
 @bp.route('/event_data')
 def event_data():
     """
-    Returns all existing event and blocked-off times for the user's department
+    Returns all existing event and blocked-off times for the user's department.
+    Tagged with the department's change version: clients that have the current version get a 304.
     """
     if not ('start' in request.args and 'end' in request.args):
         logger.log_access(success=False, route='event_data', error='RequestArgs')
         return redirect(url_for('scheduler.index'))
 
+    # Optional, comma-separated: only the events of these resources, see `resource_page`
+    resource_ids = request.args.get('resourceIds')
+    if resource_ids is not None:
+        resource_ids = [resource_id for resource_id in resource_ids.split(',') if resource_id]
+        if len(resource_ids) > MAX_RESOURCE_IDS:
+            logger.log_access(success=False, route='event_data', error='RequestArgs')
+            abort(400)
+
     current_user = User('sample_user')
+    dept = current_user.dept
+
+    try:
+        limits.take_user(current_user.uni)
+
+        etag = event_data_etag(dept)
+        if is_fresh(etag):
+            logger.log_access(success=True, route='event_data')
+            return not_modified(etag)
+
+        if resource_ids is not None:
+            resource_ids = dept_resource_ids(dept, resource_ids)
+        data = load_event_data(dept, request.args.get('start'), request.args.get('end'), resource_ids)
+    except Throttled as e:
+        logger.log_access(success=False, route='event_data', error='Throttled')
+        return 'Too many requests, please try again shortly.', 429, {'Retry-After': str(math.ceil(e.retry_after))}
 
-    table_name = current_app.config['DB_SCHEDULING']
-    resp_events = dynamo.tables[table_name].query(
-        IndexName='start-index',
-        KeyConditionExpression='PK = :pk AND #s BETWEEN :lower AND :upper',
-        ExpressionAttributeValues={
-            ':pk': f'EVENT#{current_user.dept}',
-            ':lower': f"{request.args.get('start')}",
-            ':upper': f"{request.args.get('end')}",
-        },
-        ExpressionAttributeNames={
-            '#s': 'start',
-        },
-        FilterExpression=Attr('active').eq(True)
-    )
-
-    resp_notavailable = dynamo.tables[table_name].query(
-        KeyConditionExpression='PK = :pk',
-        ExpressionAttributeValues={
-            ':pk': f'BLOCK#{current_user.dept}',
-        },
-    )
-
-    resp_events['Items'].extend(resp_notavailable['Items'])
-
-    # Dynamo returns numbers as Decimal objects, convert to integers with the default functions
-    return json_dumps(resp_events['Items'], default=decimal_conversion)
-
-
-@bp.route('/resource_data', methods=['POST'])
+    # Sampled, see ACCESS_LOG_SAMPLE_RATES
+    logger.log_access(success=True, route='event_data')
+    return revalidated_json(data, etag)
+
+
+@bp.route('/resource_data', methods=['GET', 'POST'])
 def resource_data():
     """
-    Returns all resources for the user's department
+    Returns all resources for the user's department, in natural room/title order (900 before 1000, etc.),
+    or with `limit` (and `offset`) a page of them, see `resource_page`.
+    Cacheable GET, tagged with a hash of the resources.
     """
     current_user = User('sample_user')
 
-    table_name = current_app.config['DB_SCHEDULING']
-    resp_resources = dynamo.tables[table_name].query(
-        KeyConditionExpression='PK = :pk',
-        ExpressionAttributeValues={
-            ':pk': f'RESOURCE#{current_user.dept}',
-        },
-    )
+    if 'limit' in request.args:
+        try:
+            offset = int(request.args.get('offset', 0))
+            limit = int(request.args.get('limit'))
+        except ValueError:
+            abort(400)
+
+        if offset < 0 or not 0 < limit <= PAGE_MAX_ROOMS:
+            abort(400)
+
+        return revalidated_json(resource_page(current_user.dept, offset, limit))
 
-    # Use natural sorting to make sure 900 comes before 1000, etc.
-    return jsonify(natmultisort(resp_resources['Items'], (('room', False), ('title', False))))
+    return revalidated_json(resource_list_json(current_user.dept))
+
+
+@bp.route('/service-worker.js')
+def service_worker():
+    """
+    Service worker of the calendar page (see static/service-worker.js), served here rather than from
+    the static folder so that its scope is this blueprint's root.
+    """
+    response = current_app.send_static_file('service-worker.js')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 
 @bp.route('/event_modify', methods=['POST'])
@@ -193,11 +228,21 @@ def event_modify():
         logger.log_access(success=False, route='event_modify', error='NotOwnReservation')
         return 'You can only modify your own reservations.', 403
 
-    expr = 'SET #s = :s, #e = :e, changedOn = :t'
+    epochs = event_epochs(data['start'], data['end'])
+    try:
+        check_event_length(epochs)
+    except EventTooLong as e:
+        logger.log_access(success=False, route='event_modify', error='RequestArgs')
+        return str(e), 400
+
+    expr = 'SET #s = :s, #e = :e, startEpoch = :se, endEpoch = :ee, changedOn = :t, history = :h'
     vals = {
         ':s': data['start'],
         ':e': data['end'],
+        ':se': epochs['startEpoch'],
+        ':ee': epochs['endEpoch'],
         ':t': get_local_ISO_timestamp(),
+        ':h': history_key(True, event_dept(data['PK']), data['start']),
     }
 
     if 'newResourceId' in data:
@@ -205,21 +250,40 @@ def event_modify():
         vals[':r'] = data['newResourceId']
         vals[':n'] = data['newResourceName']
 
+    dept = event_dept(data['PK'])
+
     try:
-        table_name = current_app.config['DB_SCHEDULING']
-        dynamo.tables[table_name].update_item(
-            Key={'PK': data['PK'], 'SK': data['SK']},
-            UpdateExpression=expr,
-            ExpressionAttributeValues=vals,
-            ExpressionAttributeNames={
-                '#s': 'start',
-                '#e': 'end',
-            }
-        )
+        if dept_quotas(dept):
+            # The owner's quota counters follow the event's new times
+            update = {'UpdateExpression': expr, 'ExpressionAttributeValues': vals,
+                      'ExpressionAttributeNames': {'#s': 'start', '#e': 'end'}}
+            if update_counted_event(dept, {'PK': data['PK'], 'SK': data['SK']}, update, epochs, data['uni']) is None:
+                logger.log_access(success=False, route='event_modify', error='Changed')
+                return 'This reservation was changed or deleted in the meantime, please reload the page.', 409
+        else:
+            table_name = current_app.config['DB_SCHEDULING']
+            dynamo.tables[table_name].update_item(
+                Key={'PK': data['PK'], 'SK': data['SK']},
+                UpdateExpression=expr,
+                ConditionExpression=Attr('PK').exists(),
+                ExpressionAttributeValues=vals,
+                ExpressionAttributeNames={
+                    '#s': 'start',
+                    '#e': 'end',
+                }
+            )
+    except QuotaExceeded as e:
+        logger.log_access(success=False, route='event_modify', error='Quota')
+        return str(e), 403
     except Exception as e:
         print(e)
         return 'Unexpected error occured', 500
 
+    event = dict(epochs, PK=data['PK'], SK=data['SK'], start=data['start'], end=data['end'])
+    if 'newResourceId' in data:
+        event['resourceId'] = data['newResourceId']
+    record_change(dept, 'modify', event)
+
     logger.log_access(success=True, route='event_modify')
     return 'Success', 200
 
@@ -235,70 +299,89 @@ def event_create():
         - end: event end timestamp
         - resourceId: id of the resource where event was scheduled
         - resourceName: name of the resource where event was scheduled
-        - viewStart: the start of the interval the calendar currently represents
-        - viewEnd: the end of the interval the calendar currently represents
 
-    viewStart and viewEnd are used to check for overlapping events by getting all
-    events between the two timestamps for the resourceId. They are in UTC time so
-    they are first converted to EDT/EST.
+    The event is written only if it does not overlap an active event or blocked-off time of the resource,
+    see `app.utils.booking.book`. Overlaps are answered with 409, reservations over the user's quotas with 403.
+    """
+
+    current_user = User('sample_user')
+    dept = current_user.dept
 
-    If no overlaps are present, event metadata is recorded to DynamoDB.
+    request_data = request.json
+    item = new_event_item(dept, current_user.uni, request_data.get('resourceId'), request_data.get('resourceName'),
+                          request_data.get('start'), request_data.get('end'))
+
+    try:
+        booked = book(dept, item)
+    except QuotaExceeded as e:
+        logger.log_access(success=False, route='event_create', error='Quota')
+        return str(e), 403
+    except EventTooLong as e:
+        logger.log_access(success=False, route='event_create', error='RequestArgs')
+        return str(e), 400
+    except Exception:
+        logger.log_access(success=False, route='event_create', error='Unexpected 500')
+        return 'Unexpected error occured', 500
+
+    if not booked:
+        logger.log_access(success=False, route='event_create', error='Overlap')
+        return 'Your booking overlaps with another booking or a reserved time.', 409
+
+    record_change(dept, 'create', item)
+
+    logger.log_access(success=True, route='event_create')
+    return 'Success', 200
+
+
+@bp.route('/event_create_any', methods=['POST'])
+def event_create_any():
+    """
+    Creates an event on any free resource of a room, chosen by ANY_ROOM_POLICY (see `app.utils.booking`).
+
+    Payload should contain the following attributes:
+        - start: event start timestamp
+        - end: event end timestamp
+        - room: the room, i.e. the resource group on the calendar
+
+    Returns JSON with the resource that was booked, or 409 if every resource of the room is taken.
     """
 
-    table_name = current_app.config['DB_SCHEDULING']
     current_user = User('sample_user')
-    uni = current_user.uni
     dept = current_user.dept
 
     request_data = request.json
-    resourceId = request_data.get('resourceId')
     event_start = request_data.get('start')
     event_end = request_data.get('end')
 
-    view_start = datetime_to_EST(request_data['viewStart'])
-    view_end = datetime_to_EST(request_data['viewEnd'])
-
-    resp_events_view = dynamo.tables[table_name].query(
-        IndexName='resourceId-start-index',
-        KeyConditionExpression='resourceId = :r AND #s BETWEEN :lower AND :upper',
-        ExpressionAttributeValues={
-            ':r': resourceId,
-            ':lower': view_start,
-            ':upper': view_end,
-        },
-        ExpressionAttributeNames={
-            '#s': 'start',
-        },
-        FilterExpression=Attr('active').eq(True)
-    )
-
-    if (is_overlapping(resp_events_view['Items'], request_data)):
-        logger.log_access(success=False, route='event_create', error='Overlap')
-        return 'Your booking overlaps with another booking or a reserved time.', 500
-
-    item = {
-        'PK': f'EVENT#{dept}',
-        'SK': f"{request_data.get('resourceId')}#{uuid4()}",
-        'start': event_start,
-        'end': event_end,
-        'resourceId': resourceId,
-        'resourceName': request_data.get('resourceName'),
-        'title': uni,
-        'uni': uni,
-        'active': True,
-        'createdOn': get_local_ISO_timestamp(),
-        'changedOn': '',
-        'dept': dept,
-    }
+    resources = [r for r in query_resources(dept) if r.get('room') == request_data.get('room')]
+    if not resources:
+        logger.log_access(success=False, route='event_create_any', error='RequestArgs')
+        abort(400)
+
+    def make_item(resource):
+        return new_event_item(dept, current_user.uni, resource['id'], f"{resource['room']} - {resource['title']}",
+                              event_start, event_end)
 
     try:
-        dynamo.tables[table_name].put_item(Item=item)
+        item = book_any(dept, resources, event_epochs(event_start, event_end), make_item)
+    except QuotaExceeded as e:
+        logger.log_access(success=False, route='event_create_any', error='Quota')
+        return str(e), 403
+    except EventTooLong as e:
+        logger.log_access(success=False, route='event_create_any', error='RequestArgs')
+        return str(e), 400
     except Exception:
-        logger.log_access(success=False, route='event_create', error='Unexpected 500')
+        logger.log_access(success=False, route='event_create_any', error='Unexpected 500')
         return 'Unexpected error occured', 500
 
-    logger.log_access(success=True, route='event_create')
-    return 'Success', 200
+    if item is None:
+        logger.log_access(success=False, route='event_create_any', error='Overlap')
+        return f"Every desk in {request_data.get('room')} is taken at that time.", 409
+
+    record_change(dept, 'create', item)
+
+    logger.log_access(success=True, route='event_create_any')
+    return jsonify(resourceId=item['resourceId'], resourceName=item['resourceName'])
 
 
 @bp.route('/event_delete', methods=['POST'])
@@ -307,28 +390,156 @@ def event_delete():
     Application logic for deleting an event.
     """
 
-    s = current_app.config['SERIALIZER']
+    key = load_event_token(request.form['token'])
 
-    try:
-        PK = s.loads(request.form['PK'])
-        SK = s.loads(request.form['SK'])
-    except BadSignature:
+    if key is None:
         logger.log_access(success=False, route='event_delete', error='BadSignature')
         abort(400)
 
+    timestamp = get_local_ISO_timestamp()
+    dept = event_dept(key['PK'])
+    values = {
+        ':f': False,
+        ':t': timestamp,
+        ':h': history_key(False, dept, timestamp),
+    }
+
     try:
-        table_name = current_app.config['DB_SCHEDULING']
-        dynamo.tables[table_name].update_item(
-            Key={'PK': PK, 'SK': SK},
-            UpdateExpression='SET active = :f, changedOn = :t',
-            ExpressionAttributeValues={
-                ':f': False,
-                ':t': get_local_ISO_timestamp(),
-            }
-        )
+        if dept_quotas(dept):
+            # Stops counting the event in the owner's quota counters
+            update_counted_event(dept, key, {
+                'UpdateExpression': 'SET active = :f, changedOn = :t, history = :h',
+                'ExpressionAttributeValues': values,
+            })
+        else:
+            table_name = current_app.config['DB_SCHEDULING']
+            dynamo.tables[table_name].update_item(
+                Key=key,
+                UpdateExpression='SET active = :f, changedOn = :t, history = :h',
+                ConditionExpression=Attr('PK').exists(),
+                ExpressionAttributeValues=values,
+            )
     except Exception:
         logger.log_access(success=False, route='event_delete', error='Unexpected 500')
         return 'Unexpected error occured', 500
 
+    record_change(dept, 'delete', key)
+
     logger.log_access(success=True, route='event_delete')
     return redirect(url_for('scheduler.index', _anchor='history'))
+
+
+@bp.route('/events/batch_delete', methods=['POST'])
+def event_batch_delete():
+    """
+    Application logic for deleting several of the user's events at once.
+
+    Payload should contain the following attributes:
+        tokens: list of signed event tokens (see `sign_event_keys`)
+
+    Returns JSON with the tokens that were deleted and the ones that were not
+    (bad signature, not the user's reservation, or already deleted).
+    """
+
+    tokens = (request.json or {}).get('tokens')
+    if not isinstance(tokens, list):
+        logger.log_access(success=False, route='event_batch_delete', error='RequestArgs')
+        abort(400)
+
+    current_user = User('sample_user')
+
+    keys = {}
+    failed = []
+    for token in tokens:
+        key = load_event_token(token)
+        if key is None:
+            failed.append(token)
+        else:
+            keys[(key['PK'], key['SK'])] = token
+
+    try:
+        done_keys, failed_keys = deactivate_events([{'PK': PK, 'SK': SK} for PK, SK in keys], current_user.uni)
+    except Exception:
+        logger.log_access(success=False, route='event_batch_delete', error='Unexpected 500')
+        return 'Unexpected error occured', 500
+
+    # One version increment per department, not per event
+    changes = {}
+    for key in done_keys:
+        changes.setdefault(event_dept(key['PK']), []).append(('delete', key))
+    for dept, dept_changes in changes.items():
+        record_changes(dept, dept_changes)
+
+    failed.extend(keys[(k['PK'], k['SK'])] for k in failed_keys)
+    deleted = [keys[(k['PK'], k['SK'])] for k in done_keys]
+
+    logger.log_access(success=not failed, route='event_batch_delete')
+    return jsonify(deleted=deleted, failed=failed)
+
+
+@bp.route('/events/history')
+def event_history():
+    """
+    Returns one page of the user's reservation history as JSON.
+
+    Request args:
+        status: One of `HISTORY_STATUSES`, defaults to `upcoming`
+        cursor: Cursor returned with the previous page
+        limit: Page size, at most 100
+    """
+
+    status = request.args.get('status', 'upcoming')
+    if status not in HISTORY_STATUSES:
+        logger.log_access(success=False, route='event_history', error='RequestArgs')
+        abort(400)
+
+    current_user = User('sample_user')
+    dept = current_user.dept
+
+    if not dept:
+        logger.log_access(success=False, route='event_history')
+        abort(403)
+
+    limit = max(1, min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 100))
+
+    try:
+        events, cursor = query_user_history(current_user.uni, dept, status, request.args.get('cursor'), limit)
+    except BadSignature:
+        logger.log_access(success=False, route='event_history', error='BadSignature')
+        abort(400)
+
+    events = [
+        {
+            'token': e['token'],
+            'resourceName': e['resourceName'],
+            'start': e['start'],
+            'end': e['end'],
+            'startDisplay': datetime_humanize(e['start']),
+            'endDisplay': datetime_humanize(e['end']),
+            'active': e['active'],
+        } for e in sign_event_keys(events)
+    ]
+
+    return jsonify(events=events, cursor=cursor)
+
+
+@bp.route('/events/stream')
+def event_stream():
+    """
+    Server-Sent Events stream of event changes in the user's department.
+    The calendar applies each change to the events it already shows instead of refetching.
+    Needs a worker class that can hold long-lived connections (threads or gevent).
+    """
+
+    current_user = User('sample_user')
+    dept = current_user.dept
+
+    if not dept:
+        logger.log_access(success=False, route='event_stream')
+        abort(403)
+
+    stream = pubsub.stream(dept, current_app.config['SSE_HEARTBEAT'])
+    return Response(stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
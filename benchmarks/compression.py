@@ -0,0 +1,83 @@
+"""
+Benchmark of response compression for event_data windows.
+
+Serves generated windows of 1k and 10k events (the JSON `load_event_data` returns) from a Flask app with
+the `Compress` extension, and reports bytes on the wire and server time per encoding and level, plus the
+transfer time over a link of --mbps.
+
+Usage:
+    python -m benchmarks.compression [--repeat 10] [--mbps 20]
+"""
+
+# Standard library imports
+import time
+import uuid
+import argparse
+
+# Third party imports
+from flask import Flask
+from flask.json import dumps as json_dumps
+
+# Local application imports
+from app.compression import Compress, brotli
+
+
+def window(n):
+    """`n` events as returned by `event_data`"""
+    return json_dumps([{
+        'PK': 'EVENT#CHEM',
+        'SK': f'r{i % 40}#{uuid.uuid4()}',
+        'resourceId': f'r{i % 40}',
+        'title': f'abc{i % 300:04d}',
+        'uni': f'abc{i % 300:04d}',
+        'resourceName': f'Room {900 + i % 40} - Desk {i % 7}',
+        'start': f'2020-10-{5 + i % 5:02d}T{8 + i % 10:02d}:00:00-04:00',
+        'end': f'2020-10-{5 + i % 5:02d}T{9 + i % 10:02d}:00:00-04:00',
+        'startEpoch': 1601902800 + i * 3600,
+        'endEpoch': 1601906400 + i * 3600,
+        'createdOn': '2020-10-01T12:00:00-04:00',
+        'active': True,
+    } for i in range(n)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--mbps', type=float, default=20)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    compress = Compress(app)
+
+    bodies = {n: window(n) for n in (1000, 10000)}
+
+    @app.route('/event_data/<int:n>')
+    def event_data(n):
+        return app.response_class(bodies[n], mimetype='application/json')
+
+    encodings = [('identity', None), ('gzip', 1), ('gzip', 6), ('gzip', 9)]
+    if brotli is not None:
+        encodings += [('br', 1), ('br', 4), ('br', 9)]
+
+    client = app.test_client()
+    print(f'{"events":>6} {"encoding":>10} {"bytes":>10} {"ratio":>6} {"server ms":>10} {"transfer ms":>12}')
+    for n in bodies:
+        for encoding, level in encodings:
+            if level is not None:
+                app.config['COMPRESS_LEVEL'] = level
+
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                response = client.get(f'/event_data/{n}', headers={'Accept-Encoding': encoding})
+            server_ms = (time.perf_counter() - start) / args.repeat * 1000
+
+            size = len(response.get_data())
+            transfer_ms = size * 8 / (args.mbps * 1e6) * 1000
+            label = encoding if level is None else f'{encoding}-{level}'
+            print(f'{n:>6} {label:>10} {size:>10} {len(bodies[n]) / size:>6.1f} {server_ms:>10.1f} {transfer_ms:>12.1f}')
+
+    print(f'Compression counters: {compress.stats()}')
+
+
+if __name__ == '__main__':
+    main()
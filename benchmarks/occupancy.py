@@ -0,0 +1,110 @@
+"""
+Benchmark of the occupancy analytics over a semester of bookings in every department.
+
+Generates --depts departments of --rooms rooms with --desks desks each, booked --bookings times per desk
+and weekday for --weeks weeks, and reports the time to build the per-department summaries
+(`app.utils.occupancy.dept_summary`: arrays, heatmap and peak concurrency), and the part of it spent turning
+items into arrays, against a reference implementation that loops over events and buckets in Python.
+DynamoDB is not involved.
+
+Usage:
+    python -m benchmarks.occupancy [--depts 30] [--rooms 10] [--desks 6] [--bookings 3] [--weeks 16] [--bucket 3600]
+"""
+
+# Standard library imports
+import time
+import random
+import argparse
+from collections import defaultdict
+
+# Local application imports
+from app.utils.occupancy import dept_summary, event_arrays
+
+
+SEMESTER_START = 1598832000  # 2020-08-31T00:00:00Z, a Monday
+
+
+def semester(args, rng):
+    """Per department: (events, room names, resource id -> room index)"""
+    depts = {}
+    for d in range(args.depts):
+        rooms = [f'Room {100 + r}' for r in range(args.rooms)]
+        rows = {f'r{r}-{k}': r for r in range(args.rooms) for k in range(args.desks)}
+        events = []
+        for resource_id in rows:
+            for day in range(args.weeks * 7):
+                if day % 7 >= 5:
+                    continue
+                hour = 8
+                for _ in range(args.bookings):
+                    hour += rng.randint(0, 2)
+                    length = rng.randint(1, 3)
+                    start = SEMESTER_START + day * 86400 + hour * 3600
+                    events.append({'resourceId': resource_id, 'startEpoch': start, 'endEpoch': start + length * 3600})
+                    hour += length
+        depts[f'DEPT{d}'] = (events, rooms, rows)
+    return depts
+
+
+def python_summary(events, rooms, rows, lower, upper, bucket):
+    """Occupied seconds per room and bucket and peak concurrency per room, one event at a time"""
+    n_buckets = -(-(upper - lower) // bucket)
+    seconds = [[0] * n_buckets for _ in rooms]
+    points = defaultdict(list)
+
+    for e in events:
+        row = rows[e['resourceId']]
+        start, end = max(e['startEpoch'], lower), min(e['endEpoch'], upper)
+        for b in range((start - lower) // bucket, (end - 1 - lower) // bucket + 1):
+            seconds[row][b] += min(end, lower + (b + 1) * bucket) - max(start, lower + b * bucket)
+        points[row] += [(start, 1), (end, -1)]
+
+    peaks = []
+    for row in range(len(rooms)):
+        running = peak = 0
+        for _, step in sorted(points[row]):
+            running += step
+            peak = max(peak, running)
+        peaks.append(peak)
+
+    return seconds, peaks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--depts', type=int, default=30)
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--desks', type=int, default=6)
+    parser.add_argument('--bookings', type=int, default=3)
+    parser.add_argument('--weeks', type=int, default=16)
+    parser.add_argument('--bucket', type=int, default=3600)
+    args = parser.parse_args()
+
+    depts = semester(args, random.Random(0))
+    lower, upper = SEMESTER_START, SEMESTER_START + args.weeks * 7 * 86400
+    n_events = sum(len(events) for events, _, _ in depts.values())
+    print(f'{n_events} events in {args.depts} departments, {(upper - lower) // args.bucket} buckets of {args.bucket}s')
+
+    start = time.perf_counter()
+    summaries = {dept: dept_summary(*data, lower, upper, args.bucket) for dept, data in depts.items()}
+    vectorized = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for events, _, rows in depts.values():
+        event_arrays(events, rows)
+    arrays = time.perf_counter() - start
+
+    start = time.perf_counter()
+    reference = {dept: python_summary(*data, lower, upper, args.bucket) for dept, data in depts.items()}
+    loops = time.perf_counter() - start
+
+    for dept, (seconds, peaks) in reference.items():
+        assert [room['peak'] for room in summaries[dept]['rooms']] == peaks
+        assert round(sum(map(sum, seconds)) / 3600, 1) == summaries[dept]['bookedHours']
+
+    print(f'NumPy: {vectorized * 1000:.0f}ms ({arrays * 1000:.0f}ms of it building arrays from items), '
+          f'Python loops: {loops * 1000:.0f}ms ({loops / vectorized:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark of the `event_data` read path against a stand-in for DynamoDB with a fixed network latency
+per call, with the independent queries made one after the other vs. concurrently as `load_event_data`
+does (the blocks on `partition_executor` while the events are queried).
+
+A request makes the same DynamoDB calls as `event_data`: the user's department, the department's
+version for the ETag, the events (one query per partition) and the blocks. Each worker thread stands
+for one synchronous WSGI worker and sends requests back to back; the request rate of 1 to --workers
+workers is measured, and the fewest workers reaching --target requests per second is reported.
+
+Usage:
+    python -m benchmarks.read_path [--latency 0.01] [--shards 1] [--workers 16] [--target 200] [--seconds 2]
+"""
+
+# Standard library imports
+import argparse
+import threading
+import time
+
+# Third party imports
+from flask import Flask
+from boto3.dynamodb.conditions import Attr, Key
+
+# Local application imports
+from app.extensions import dynamo
+from app.utils.events import in_background, query_blocks, query_events
+
+
+class LatencyTable(object):
+    """Answers every call with no items after `latency` seconds"""
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def query(self, **kwargs):
+        time.sleep(self.latency)
+        return {'Items': []}
+
+    def get_item(self, **kwargs):
+        time.sleep(self.latency)
+        return {'Item': dict(kwargs['Key'], version=1)}
+
+
+def make_app(latency, shards):
+    app = Flask(__name__)
+    app.config['DB_SCHEDULING'] = 'scheduling'
+    app.config['EVENT_SHARDS'] = shards
+    app.config['EVENT_SHARDS_MIGRATING'] = False
+    dynamo.tables = {'scheduling': LatencyTable(latency)}
+    return app
+
+
+def request(concurrent):
+    """The DynamoDB calls of one `event_data` request"""
+    table = dynamo.tables['scheduling']
+    lower, upper = 1600000000, 1600604800
+
+    table.query(KeyConditionExpression=Key('PK').eq('USER#abc123'))
+    table.get_item(Key={'PK': 'VERSION#CHEM', 'SK': 'VERSION'})
+
+    if concurrent:
+        blocks = in_background(query_blocks, 'CHEM', lower, upper)
+    events = query_events('CHEM', Key('startEpoch').between(lower, upper), FilterExpression=Attr('active').eq(True))
+    events.extend(blocks.result() if concurrent else query_blocks('CHEM', lower, upper))
+
+
+def throughput(app, workers, seconds, concurrent):
+    """Requests per second of `workers` threads sending requests back to back"""
+    counts = [0] * workers
+    deadline = time.perf_counter() + seconds
+
+    def work(n):
+        with app.app_context():
+            while time.perf_counter() < deadline:
+                request(concurrent)
+                counts[n] += 1
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(counts) / seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--target', type=float, default=200)
+    parser.add_argument('--seconds', type=float, default=2)
+    args = parser.parse_args()
+
+    app = make_app(args.latency, args.shards)
+    with app.app_context():
+        for concurrent in (False, True):
+            start = time.perf_counter()
+            request(concurrent)
+            print(f'{"concurrent" if concurrent else "sequential"} request: '
+                  f'{(time.perf_counter() - start) * 1000:.1f}ms')
+
+    print(f'\n{args.latency * 1000:.0f}ms per call, {args.shards} partition(s)')
+    print(f'{"workers":>7} {"sequential":>12} {"concurrent":>12}')
+    needed = {False: None, True: None}
+    for workers in range(1, args.workers + 1):
+        rates = {}
+        for concurrent in (False, True):
+            rates[concurrent] = throughput(app, workers, args.seconds, concurrent)
+            if needed[concurrent] is None and rates[concurrent] >= args.target:
+                needed[concurrent] = workers
+        print(f'{workers:>7} {rates[False]:>10.0f}/s {rates[True]:>10.0f}/s')
+
+    for concurrent in (False, True):
+        label = 'concurrent' if concurrent else 'sequential'
+        print(f'{label} workers for {args.target:.0f} requests/s: {needed[concurrent] or f"more than {args.workers}"}')
+
+
+if __name__ == '__main__':
+    main()
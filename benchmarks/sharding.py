@@ -0,0 +1,136 @@
+"""
+Benchmark of sharded event partitions against a local stand-in for DynamoDB.
+
+The stand-in models per-partition throughput limits (1,000 write units and 3,000 read units
+per second by default) on a virtual clock, and a fixed network latency per query.
+
+    1. Write throttling: a burst of bookings in one department, e.g. at semester start,
+       spread over EVENT_SHARDS partitions by `event_partition`.
+    2. Read throttling: a burst of `event_data` windows of the department, each reading its share of
+       the window's events from every partition (eventually consistent, half a unit per 4 KB read).
+    3. Read latency: `event_data` windows read from every partition, sequentially vs. concurrently
+       as `query_events` does.
+
+Usage:
+    python -m benchmarks.sharding [--bookings 20000] [--windows 2000] [--events 500] [--seconds 5] [--latency 0.01]
+"""
+
+# Standard library imports
+import argparse
+import math
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party imports
+from flask import Flask
+
+# Local application imports
+from app.utils.events import event_partition, event_partitions
+
+
+# Size of an event item, and data per read unit of a strongly consistent read
+ITEM_BYTES = 400
+READ_UNIT_BYTES = 4096
+
+
+class PartitionStandIn(object):
+    """Counts capacity used per partition per second of virtual time"""
+
+    def __init__(self, write_units=1000, read_units=3000):
+        self.write_units = write_units
+        self.read_units = read_units
+        self.writes = Counter()
+        self.reads = Counter()
+
+    def write(self, PK, second):
+        """Returns False if the write would be throttled"""
+        if self.writes[(PK, second)] >= self.write_units:
+            return False
+        self.writes[(PK, second)] += 1
+        return True
+
+    def read(self, PK, second, items):
+        """Returns False if a query reading `items` items would be throttled"""
+        units = max(math.ceil(items * ITEM_BYTES / READ_UNIT_BYTES) / 2, 0.5)
+        if self.reads[(PK, second)] + units > self.read_units:
+            return False
+        self.reads[(PK, second)] += units
+        return True
+
+
+def write_burst(shards, bookings, seconds):
+    app = Flask(__name__)
+    app.config['EVENT_SHARDS'] = shards
+    table = PartitionStandIn()
+
+    throttled = 0
+    with app.app_context():
+        for i in range(bookings):
+            SK = f'room-{i % 40}#{uuid.uuid4()}'
+            if not table.write(event_partition('CHEM', SK), i * seconds // bookings):
+                throttled += 1
+
+    return throttled
+
+
+def read_burst(shards, windows, events, seconds):
+    """Number of `windows` window reads of `events` events each throttled on any partition"""
+    app = Flask(__name__)
+    app.config['EVENT_SHARDS'] = shards
+    app.config['EVENT_SHARDS_MIGRATING'] = False
+    table = PartitionStandIn()
+
+    with app.app_context():
+        partitions = event_partitions('CHEM')
+
+    throttled = 0
+    for i in range(windows):
+        second = i * seconds // windows
+        results = [table.read(PK, second, math.ceil(events / shards)) for PK in partitions]
+        if not all(results):
+            throttled += 1
+
+    return throttled
+
+
+def read_window(shards, latency, concurrent):
+    def query(PK):
+        time.sleep(latency)
+        return []
+
+    partitions = [f'EVENT#CHEM#{n}' for n in range(shards)]
+    start = time.perf_counter()
+    if concurrent:
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            list(executor.map(query, partitions))
+    else:
+        for PK in partitions:
+            query(PK)
+
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bookings', type=int, default=20000)
+    parser.add_argument('--windows', type=int, default=2000)
+    parser.add_argument('--events', type=int, default=500)
+    parser.add_argument('--seconds', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.01)
+    args = parser.parse_args()
+
+    print(f'{args.bookings} bookings and {args.windows} windows of {args.events} events in {args.seconds}s, '
+          f'{args.latency * 1000:.0f}ms per query')
+    print(f'{"shards":>6} {"throttled writes":>17} {"throttled reads":>16} {"sequential read":>16} {"concurrent read":>16}')
+    for shards in (1, 2, 4, 8, 16):
+        throttled = write_burst(shards, args.bookings, args.seconds)
+        throttled_reads = read_burst(shards, args.windows, args.events, args.seconds)
+        sequential = read_window(shards, args.latency, concurrent=False)
+        concurrent = read_window(shards, args.latency, concurrent=True)
+        print(f'{shards:>6} {throttled:>17} {throttled_reads:>16} {sequential * 1000:>14.1f}ms {concurrent * 1000:>14.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Benchmark of template rendering with the fragment cache and the bytecode cache.
+
+    1. Compilation: loading every template into a new Jinja environment, as a new worker process does,
+       without and with a populated bytecode cache.
+    2. Rendering: the department admin booking list for a large department, on a fragment cache miss
+       (first request after a change) and on a hit.
+
+No DynamoDB access is needed: events are generated, and the user query of the navigation is replaced
+by a stand-in with a fixed latency.
+
+Usage:
+    python -m benchmarks.templates [--events 5000] [--repeat 20] [--latency 0.01]
+"""
+
+# Standard library imports
+import os
+import time
+import uuid
+import argparse
+import tempfile
+
+# Third party imports
+from flask import render_template, session
+from jinja2 import FileSystemBytecodeCache
+
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+# Local application imports
+from app import create_app  # noqa: E402
+from app.extensions import fragment_cache  # noqa: E402
+from app.fragment_cache import Deferred  # noqa: E402
+
+
+def compile_all(app, bytecode_dir):
+    """Seconds to load every template into a new environment with the application's filters and extensions"""
+    env = app.jinja_env.overlay(cache_size=0,
+                                bytecode_cache=FileSystemBytecodeCache(bytecode_dir) if bytecode_dir else None)
+
+    start = time.perf_counter()
+    for name in env.list_templates():
+        env.get_template(name)
+    return time.perf_counter() - start
+
+
+def events(n):
+    return [{
+        'PK': 'EVENT#BENCH',
+        'SK': f'r{i % 50}#{uuid.uuid4()}',
+        'uni': f'abc{i % 300}',
+        'resourceName': f'Room {i % 50} - Desk {i % 7}',
+        'start': '2020-10-05T09:00:00-04:00',
+        'end': '2020-10-05T10:00:00-04:00',
+        'createdOn': '2020-10-01T12:00:00-04:00',
+        'changedOn': '2020-10-02T12:00:00-04:00' if i % 3 else None,
+        'active': bool(i % 5),
+    } for i in range(n)]
+
+
+def render_ms(app, bookings, versions):
+    """Average milliseconds to render the booking list once per change version in `versions`"""
+    with app.test_request_context('/dept_admin/'):
+        session['CAS_USERNAME'] = 'bench'
+        start = time.perf_counter()
+        for version in versions:
+            render_template('dept_admin.html', bookings=Deferred(lambda: bookings), bookings_cache_key=('BENCH', version))
+        return (time.perf_counter() - start) / len(versions) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--events', type=int, default=5000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds per user query of the navigation.')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.jinja_env.filters['user_is_dept_admin'] = lambda uni: time.sleep(args.latency) or True
+    bookings = events(args.events)
+
+    with tempfile.TemporaryDirectory() as bytecode_dir:
+        no_cache = min(compile_all(app, None) for _ in range(args.repeat))
+        compile_all(app, bytecode_dir)
+        cached = min(compile_all(app, bytecode_dir) for _ in range(args.repeat))
+    print(f'Compile all templates: {no_cache * 1000:.1f}ms without bytecode cache, {cached * 1000:.1f}ms with')
+
+    fragment_cache.clear()
+    miss = render_ms(app, bookings, range(args.repeat))  # a new change version every time
+    hit = render_ms(app, bookings, [0] * args.repeat)
+    print(f'Booking list with {args.events} events: {miss:.1f}ms on a fragment cache miss, {hit:.1f}ms on a hit')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ Application configuration
 
 # Standard library imports
 import os
+import json
 
 # Third party imports
 import boto3
@@ -35,6 +36,43 @@ class Config(object):
         aws_secret_access_key=os.getenv('AWS_SECRET')
     )
 
+    # Calendar change stream; without a Redis URL changes only reach clients of the same worker process, so
+    # calendars refetch after inactivity instead of opening the stream. Streams need threaded or gevent workers,
+    # see gunicorn.conf.py
+    PUBSUB_REDIS_URL = os.getenv('PUBSUB_REDIS_URL')
+    SSE_HEARTBEAT = 15
+
+    # Number of partitions per department for events, see `app.utils.events.event_partition`
+    EVENT_SHARDS = int(os.getenv('EVENT_SHARDS', 1))
+    EVENT_SHARDS_MIGRATING = os.getenv('EVENT_SHARDS_MIGRATING') == '1'
+
+    # How "any room" bookings pick a free resource: best_fit or lru, see `app.utils.booking`
+    ANY_ROOM_POLICY = os.getenv('ANY_ROOM_POLICY', 'best_fit')
+
+    # Per-department caps of reservations per user, e.g. {"CHEM": {"weekly_hours": 10, "future_bookings": 3}},
+    # see `app.utils.quotas`
+    BOOKING_QUOTAS = json.loads(os.getenv('BOOKING_QUOTAS', '{}'))
+
+    # Events that started more than ARCHIVE_DAYS ago are moved to the archive by `flask archive-events`
+    ARCHIVE_DAYS = int(os.getenv('ARCHIVE_DAYS', 365))
+    ARCHIVE_S3_BUCKET = os.getenv('ARCHIVE_S3_BUCKET')
+
+    # Access log sinks (dynamo, file, stdout) and the fraction of successful requests logged per route
+    ACCESS_LOG_SINKS = os.getenv('ACCESS_LOG_SINKS', 'dynamo')
+    ACCESS_LOG_SAMPLE_RATES = {
+        'room_scheduler.event_data': 0.01,
+        'sample.event_data': 0.01,
+        'room_scheduler.ics_feed': 0.01,
+    }
+
+    # Departments whose resources and events are loaded into the caches before `/ready` reports ready
+    WARM_UP_DEPTS = [dept for dept in os.getenv('WARM_UP_DEPTS', '').split(',') if dept]
+
+    # Responses covering every department are the largest; level 1 compresses them about 6x at half the time of 6
+    COMPRESS_ROUTE_LEVELS = {
+        'admin.event_data': 1,
+    }
+
 
 class ProdConfig(Config):
     """Production configuration"""
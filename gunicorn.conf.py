@@ -0,0 +1,18 @@
+"""
+Gunicorn settings, used by the Procfile
+
+Each open calendar holds a connection to /events/stream for as long as it is open, so workers need to
+serve many requests at once: sync workers would be taken up by a single calendar each. Threaded workers
+serve up to `threads` requests at once per process; with gevent installed, WEB_WORKER_CLASS=gevent serves
+them on greenlets instead. Calendars only open the stream when PUBSUB_REDIS_URL is set.
+"""
+
+# Standard library imports
+import os
+
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+worker_class = os.getenv('WEB_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('WEB_THREADS', 32))
+worker_connections = int(os.getenv('WEB_WORKER_CONNECTIONS', 1000))